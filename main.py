@@ -13,21 +13,23 @@ class SpotifyDownloader:
         self.download_format = os.getenv("DOWNLOAD_FORMAT")
         self.download_quality = os.getenv("DOWNLOAD_QUALITY")
         self.playlists = os.getenv("PLAYLISTS")
+        self.scheduler = os.getenv("SCHEDULER", "smallest_first")
+        self.download_workers = os.getenv("DOWNLOAD_WORKERS", "1")
 
-    def download_playlist(self, playlist_url):
+    def download_playlists(self, playlist_urls):
         """
-        Downloads a playlist from the given URL using the zotify command.
+        Downloads the playlists from the given URLs using a single zotify command.
+        All playlists share the download workers of that command, the scheduler decides in which
+        order their tracks are downloaded, so small playlists don't wait behind large ones.
         Args:
-            playlist_url (str): The URL of the playlist to download.
+            playlist_urls (list): The URLs of the playlists to download.
         Prints:
             The status of the download process, including any output or errors from the zotify command.
-        Raises:
-            RuntimeError: If the download process fails.
         """
-        print(f"Downloading playlist: {playlist_url}")
-        
-        # zotify command (username, password, song archive path, root path, download format, download quality, print downloads, download lyrics, url)
-        command = ["zotify", "--credentials-locatio", self.credential_location,  "--song-archive", self.song_archive, "--root-path", self.root_path, "--download-format", self.download_format, "--download-quality", self.download_quality, "--skip-existing", "True", "--skip-previously-downloaded", "True", playlist_url]
+        print(f"Downloading playlists: {', '.join(playlist_urls)}")
+
+        # zotify command (credentials, song archive path, root path, download format, download quality, scheduler, download workers, urls)
+        command = ["zotify", "--credentials-location", self.credential_location,  "--song-archive", self.song_archive, "--root-path", self.root_path, "--download-format", self.download_format, "--download-quality", self.download_quality, "--skip-existing", "True", "--skip-previously-downloaded", "True", "--scheduler", self.scheduler, "--download-workers", self.download_workers, *playlist_urls]
 
         # start the subprocess
         process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -37,10 +39,10 @@ class SpotifyDownloader:
 
         # check if the subprocess was successfull
         if process.returncode != 0:
-            print(f"Error while downloading the playlist: {stderr.decode()}")
+            print(f"Error while downloading the playlists: {stderr.decode()}")
         else:
-            print(f"Playlist was downloaded successfuly: {stdout.decode()}")
-        
+            print(f"Playlists were downloaded successfuly: {stdout.decode()}")
+
     def create_playlists(self):
         """
         Creates playlists for each subdirectory in the root directory.
@@ -84,8 +86,8 @@ class SpotifyDownloader:
         and creates playlists in the music folder.
         This method performs the following steps:
         1. Prints the current date and time.
-        2. Loops through each playlist URL specified in the "PLAYLISTS" environment variable,
-           downloading each playlist.
+        2. Downloads all playlist URLs specified in the "PLAYLISTS" environment variable
+           with one zotify command.
         3. Creates playlists in the music folder.
         Environment Variables:
         - PLAYLISTS: A comma-separated string of playlist URLs to be downloaded.
@@ -93,10 +95,9 @@ class SpotifyDownloader:
         None
         """
         print(f"Running script at {datetime.now()}")
-        # loop through each playlist string and download the playlist
-        for playlist_url in os.getenv("PLAYLISTS").split(', '):
-            self.download_playlist(playlist_url)
-            
+        # download all playlists at once, the scheduler interleaves them
+        self.download_playlists(os.getenv("PLAYLISTS").split(', '))
+
         # create playlists in the music folder
         self.create_playlists()
         
@@ -109,6 +110,8 @@ class SpotifyDownloader:
         - DOWNLOAD_FORMAT
         - DOWNLOAD_QUALITY
         - PLAYLISTS
+        - SCHEDULER
+        - DOWNLOAD_WORKERS
         It also checks if the credential file exists at the specified location. If the file does not exist,
         it returns a FileNotFoundError with the appropriate message.
         Returns:
@@ -120,6 +123,8 @@ class SpotifyDownloader:
         print("DOWNLOAD_FORMAT:", self.download_format)
         print("DOWNLOAD_QUALITY:", self.download_quality)
         print("PLAYLISTS:", self.playlists)
+        print("SCHEDULER:", self.scheduler)
+        print("DOWNLOAD_WORKERS:", self.download_workers)
         credential_location = self.credential_location
         if not credential_location or not os.path.exists(credential_location):
             return FileNotFoundError(f"Credential file not found: {credential_location}")
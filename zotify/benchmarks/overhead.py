@@ -0,0 +1,141 @@
+""" Microbenchmarks of the fixed Python cost zotify pays for every track.
+
+Network and ffmpeg are left out, these are the helpers that run once or several times per
+track regardless of its size. Every benchmark has a budget in benchmarks/budget.json, in
+microseconds per call:
+
+    python benchmarks/overhead.py            # print the timings
+    python benchmarks/overhead.py --check    # also fail if a benchmark exceeds its budget
+"""
+import argparse
+import json
+import sys
+import tempfile
+import timeit
+from pathlib import Path, PurePath
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from zotify.config import CONFIG_VALUES, ROOT_PATH, ROOT_PODCAST_PATH, PRINT_PROGRESS_INFO, Config  # noqa: E402
+from zotify.loader import Loader  # noqa: E402
+from zotify.paths import PathPlanner  # noqa: E402
+from zotify.termoutput import PrintChannel  # noqa: E402
+from zotify.track import TrackInfo  # noqa: E402
+from zotify.utils import fix_filename, regex_input_for_urls  # noqa: E402
+from zotify.zotify import Zotify  # noqa: E402
+
+
+BUDGET_FILE = Path(__file__).resolve().parent / 'budget.json'
+
+TRACK = {
+    'id': '4uLU6hMCjMI75M1A2tKUQC',
+    'name': 'Never Gonna Give You Up',
+    'artists': [{'name': 'Rick Astley', 'href': 'https://api.spotify.com/v1/artists/0gxyHStUsqpMadRV0Di1Qt'}],
+    'album': {
+        'name': 'Whenever You Need Somebody',
+        'release_date': '1987-11-12',
+        'images': [{'url': 'https://i.scdn.co/image/a', 'width': 640}, {'url': 'https://i.scdn.co/image/b', 'width': 300}],
+    },
+    'disc_number': 1,
+    'track_number': 1,
+    'is_playable': True,
+    'duration_ms': 213573,
+}
+URLS = [
+    'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC?si=0123456789abcdef',
+    'spotify:album:6N9PS4QXF1D0OWPk0Sxtb4',
+    'https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M',
+    'https://open.spotify.com/show/2mTUnDkuKUkhiueKcVWoP0',
+]
+
+
+class PremiumSession:
+    """ Stands in for the librespot session of a premium account """
+
+    @staticmethod
+    def get_user_attribute(key):
+        return 'premium'
+
+
+def setup(root: str) -> None:
+    Config.Values = {key: Config.parse_arg_value(key, value['default']) for key, value in CONFIG_VALUES.items()}
+    Config.Values[ROOT_PATH] = root
+    Config.Values[ROOT_PODCAST_PATH] = root
+    # loaders are measured without drawing anything
+    Config.Values[PRINT_PROGRESS_INFO] = False
+    Zotify.CONFIG = Config
+    Zotify.SESSION = PremiumSession()
+
+
+def prepare_track(planner: PathPlanner, info: TrackInfo) -> None:
+    """ The per-track path work done by download_track before the stream is opened """
+    values = {
+        'artist': fix_filename(info.artists[0]),
+        'album': fix_filename(info.album_name),
+        'song_name': fix_filename(info.name),
+        'release_year': fix_filename(info.release_year),
+        'disc_number': fix_filename(info.disc_number),
+        'track_number': fix_filename(info.track_number),
+        'id': fix_filename(info.id),
+        'track_id': fix_filename(info.id),
+        'ext': 'ogg',
+    }
+    filename = PurePath(Config.get_root_path()).joinpath(planner.template(Config.get_output('single')).render(values))
+    directory = planner.directory(filename.parent)
+    with directory.lock:
+        directory.has_file(filename.name)
+        info.id in directory.song_ids
+
+
+def loader() -> None:
+    with Loader(PrintChannel.PROGRESS_INFO, 'Preparing download...'):
+        pass
+
+
+def benchmarks():
+    planner = PathPlanner()
+    info = TrackInfo.from_json(TRACK)
+    return {
+        'regex_input_for_urls': lambda: [regex_input_for_urls(url) for url in URLS],
+        'fix_filename': lambda: fix_filename('AC/DC: Back In Black?'),
+        'config_get_root_path': Config.get_root_path,
+        'config_get_output': lambda: Config.get_output('extplaylist'),
+        'track_info_from_json': lambda: TrackInfo.from_json(TRACK),
+        'check_premium': Zotify.check_premium,
+        'loader': loader,
+        'prepare_track': lambda: prepare_track(planner, info),
+    }
+
+
+def measure(function, repeat: int = 5) -> float:
+    """ Returns the best time of `repeat` runs, in microseconds per call """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Measures the per-track overhead of zotify helpers')
+    parser.add_argument('--check', action='store_true', help='fail when a benchmark exceeds its budget')
+    args = parser.parse_args()
+
+    budget = json.loads(BUDGET_FILE.read_text(encoding='utf-8'))
+    failed = []
+    with tempfile.TemporaryDirectory() as root:
+        setup(root)
+        for name, function in benchmarks().items():
+            took = measure(function)
+            limit = budget.get(name)
+            over = limit is not None and took > limit
+            if over:
+                failed.append(name)
+            print(f'{name:<24} {took:>10.2f} us   budget {limit if limit is not None else "-":>6}  {"OVER" if over else ""}')
+
+    if args.check and failed:
+        print(f'over budget: {", ".join(failed)}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,15 @@
+import pytest
+
+from zotify.config import CONFIG_VALUES, Config, ROOT_PATH, ROOT_PODCAST_PATH, SONG_ARCHIVE
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """ The default configuration, with the libraries and the song archive below tmp_path """
+    values = {key: Config.parse_arg_value(key, option['default']) for key, option in CONFIG_VALUES.items()}
+    values[ROOT_PATH] = str(tmp_path / 'Music')
+    values[ROOT_PODCAST_PATH] = str(tmp_path / 'Podcasts')
+    values[SONG_ARCHIVE] = str(tmp_path / '.song_archive')
+    monkeypatch.setattr(Config, 'Values', values)
+    monkeypatch.setattr(Config, '_derived', {})
+    return Config
@@ -0,0 +1,38 @@
+import pytest
+
+from zotify import app, podcast
+from zotify.failures import FailureQueue
+from zotify.zotify import Zotify
+
+
+EPISODE_ID = '4rOoJ6Egrf8K2IrywzwOMk'
+
+
+@pytest.fixture
+def failures(config, tmp_path, monkeypatch):
+    failures = FailureQueue(tmp_path / 'failures.db', max_attempts=3, backoff=0)
+    monkeypatch.setattr(Zotify, 'FAILURES', failures)
+    yield failures
+    failures.close()
+
+
+def test_retry_quarantines_episodes_that_are_not_found(failures, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(podcast, 'fetch_episode_info', lambda episode_id: lookups.append(episode_id))
+    failures.record('episode', EPISODE_ID, {}, LookupError('not found'))
+
+    app.retry_failed()
+
+    assert len(lookups) == 2
+    assert [entry['id'] for entry in failures.quarantined()] == [EPISODE_ID]
+
+
+def test_retry_stops_when_a_pass_changes_nothing(failures, monkeypatch):
+    passes = []
+    monkeypatch.setattr(app, 'download_episode', lambda episode_id: passes.append(episode_id))
+    failures.record('episode', EPISODE_ID, {}, LookupError('not found'))
+
+    app.retry_failed()
+
+    assert passes == [EPISODE_ID]
+    assert [entry['id'] for entry in failures.pending()] == [EPISODE_ID]
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from zotify.claims import Claim, ClaimStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    opened = []
+
+    def open_store():
+        store = ClaimStore(tmp_path / 'claims.db')
+        opened.append(store)
+        return store
+
+    yield open_store
+    for store in opened:
+        if not store._closed.is_set():
+            store.close()
+
+
+def test_claim_held_by_another_process_is_busy(stores):
+    first, second = stores(), stores()
+
+    assert first.claim('track') is Claim.CLAIMED
+    assert second.claim('track') is Claim.BUSY
+    first.release('track')
+    assert second.claim('track') is Claim.CLAIMED
+
+
+def test_completed_claim_of_a_running_process_is_done(stores):
+    first, second = stores(), stores()
+
+    first.claim('track')
+    first.complete('track')
+
+    assert second.claim('track') is Claim.DONE
+    # this process decides on its own downloads by the archive and .song_ids
+    assert first.claim('track') is Claim.CLAIMED
+
+
+def test_completed_claim_of_an_earlier_run_is_free(stores):
+    first = stores()
+    first.claim('track')
+    first.complete('track')
+    first.close()
+
+    assert stores().claim('track') is Claim.CLAIMED
+
+
+def test_completed_claim_of_a_crashed_process_is_free(stores):
+    first = stores()
+    first.claim('track')
+    first.complete('track')
+    # the process died without closing the store, it stopped renewing its lease
+    first._db.execute('UPDATE owners SET expires_at = ?', (time.time() - 1,))
+
+    assert stores().claim('track') is Claim.CLAIMED
+
+
+def test_forget_drops_completed_claims_only(stores):
+    first, second = stores(), stores()
+    first.claim('done')
+    first.complete('done')
+    first.claim('busy')
+
+    second.forget(['done', 'busy'])
+
+    assert second.claim('done') is Claim.CLAIMED
+    assert second.claim('busy') is Claim.BUSY
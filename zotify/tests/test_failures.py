@@ -0,0 +1,39 @@
+import pytest
+
+from zotify.failures import FailureQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = FailureQueue(tmp_path / 'failures.db', max_attempts=3, backoff=0)
+    yield queue
+    queue.close()
+
+
+def test_tracks_and_episodes_are_queued_until_resolved(queue):
+    queue.record('track', 'a', {'mode': 'single'}, RuntimeError('stream ended'))
+    queue.record('episode', 'b', {}, OSError('disk full'))
+
+    assert [(entry['kind'], entry['id'], entry['context']) for entry in queue.pending()] == \
+           [('track', 'a', {'mode': 'single'}), ('episode', 'b', {})]
+    queue.resolve('track', 'a')
+    assert [entry['id'] for entry in queue.pending()] == ['b']
+
+
+def test_entries_failing_too_often_are_quarantined(queue):
+    error = RuntimeError('unavailable')
+
+    assert [queue.record('track', 'a', {}, error) for _ in range(3)] == [False, False, True]
+    assert queue.pending() == []
+    assert queue.next_retry() is None
+    assert queue.quarantined() == [{'kind': 'track', 'id': 'a', 'error_class': 'RuntimeError',
+                                    'error': 'unavailable', 'attempts': 3}]
+
+
+def test_backoff_keeps_entries_from_being_due(tmp_path):
+    queue = FailureQueue(tmp_path / 'failures.db', backoff=60)
+    queue.record('track', 'a', {}, RuntimeError('timed out'))
+
+    assert queue.pending() == []
+    assert [entry['id'] for entry in queue.pending(due_only=False)] == ['a']
+    queue.close()
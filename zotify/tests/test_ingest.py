@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from zotify import ingest
+from zotify.ingest import DownloadFile
+
+
+def track_id(number):
+    return f'{number:022d}'
+
+
+def write_ids(path, *numbers):
+    path.write_text(''.join(f'spotify:track:{track_id(number)}\n' for number in numbers), encoding='utf-8')
+    return path
+
+
+@pytest.fixture(autouse=True)
+def window_size(monkeypatch):
+    monkeypatch.setattr(ingest, 'WINDOW_SIZE', 2)
+
+
+def test_resumes_after_saved_window(tmp_path):
+    path = write_ids(tmp_path / 'ids.txt', 1, 2, 3, 4, 1, 5)
+
+    windows = DownloadFile(path).windows()
+    assert next(windows) == {'track': [track_id(1), track_id(2)]}
+    # interrupted while the second window is downloaded, only the first one is saved
+    assert next(windows) == {'track': [track_id(3), track_id(4)]}
+    windows.close()
+
+    resumed = DownloadFile(path)
+    assert resumed.start == len(f'spotify:track:{track_id(1)}\n') * 2
+    # the duplicate of a line before the checkpoint is still dropped
+    assert list(resumed.windows()) == [{'track': [track_id(3), track_id(4)]}, {'track': [track_id(5)]}]
+    assert not resumed.checkpoint_path.exists()
+
+
+def test_shorter_file_starts_over(tmp_path):
+    path = write_ids(tmp_path / 'ids.txt', 1, 2, 3, 4)
+    file = DownloadFile(path)
+    file.checkpoint_path.write_text(json.dumps({'offset': path.stat().st_size}), encoding='utf-8')
+
+    # replaced by a shorter list
+    write_ids(path, 5, 6)
+    replaced = DownloadFile(path)
+
+    assert replaced.start == 0
+    assert list(replaced.windows()) == [{'track': [track_id(5), track_id(6)]}]
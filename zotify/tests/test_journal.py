@@ -0,0 +1,85 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from zotify import track
+from zotify.config import JOB_JOURNAL, Config
+from zotify.journal import JobJournal
+
+
+def jobs(*track_ids):
+    return [{'mode': 'liked', 'track_id': track_id} for track_id in track_ids]
+
+
+def journal_of(path, *track_ids, done=()):
+    """ A journal of an interrupted listing of `track_ids`, with the jobs at `done` finished """
+    journal = JobJournal(path)
+    for index, _ in journal.entries(jobs(*track_ids)):
+        if index in done:
+            journal.complete(index)
+        if index == len(track_ids) - 1:
+            break
+    journal._file.flush()
+    journal._file.close()
+    return path
+
+
+def test_resumed_listing_skips_journaled_jobs_by_key(tmp_path):
+    path = journal_of(tmp_path / 'liked.jsonl', '1', '2', '3', done={0})
+
+    journal = JobJournal(path)
+    # a track liked since the first run is listed first
+    listed = [job['track_id'] for _, job in journal.entries(jobs('0', '1', '2', '3', '4'))]
+    journal.close()
+
+    assert listed == ['2', '3', '0', '4']
+
+
+def test_expired_journal_is_listed_again(tmp_path):
+    path = journal_of(tmp_path / 'liked.jsonl', '1', '2', done={0})
+    old = time.time() - 8 * 24 * 60 * 60
+    os.utime(path, (old, old))
+
+    journal = JobJournal(path)
+    listed = [job['track_id'] for _, job in journal.entries(jobs('1', '2'))]
+    journal.close()
+
+    assert journal.expired
+    assert listed == ['1', '2']
+
+
+def test_finished_run_lists_again(config, monkeypatch):
+    monkeypatch.setitem(Config.Values, JOB_JOURNAL, True)
+    downloaded = []
+
+    def download_track(track_id, **kwargs):
+        downloaded.append(track_id)
+        return track_id != '2'
+
+    monkeypatch.setattr(track, 'download_track', download_track)
+
+    track.download_tracks(iter(jobs('1', '2')), journal='liked')
+    # the failed track is left to the failure queue, a newly liked one is found
+    track.download_tracks(iter(jobs('0', '1', '2')), journal='liked')
+
+    assert downloaded == ['1', '2', '0', '1', '2']
+    assert not Path(Config.get_job_journal_location(), 'liked.jsonl').exists()
+
+
+def test_interrupted_run_continues_with_unfinished_tracks(config, monkeypatch):
+    monkeypatch.setitem(Config.Values, JOB_JOURNAL, True)
+
+    def download_track(track_id, **kwargs):
+        if track_id == '3':
+            raise KeyboardInterrupt
+        return track_id != '2'
+
+    monkeypatch.setattr(track, 'download_track', download_track)
+    with pytest.raises(KeyboardInterrupt):
+        track.download_tracks(iter(jobs('1', '2', '3', '4')), journal='liked')
+
+    journal = JobJournal(Config.get_job_journal_location() / 'liked.jsonl', key=track.journal_key)
+    assert [job['track_id'] for _, job in journal.entries(jobs('1', '2', '3', '4'))] == ['2', '3', '4']
+    journal.close()
@@ -0,0 +1,45 @@
+import threading
+import time
+
+import pytest
+
+from zotify.pacer import RealTimePacer
+
+
+def chunks(count, size=10, stall_at=None, stall=0.0):
+    reads = 0
+
+    def read_chunk():
+        nonlocal reads
+        reads += 1
+        if reads == stall_at:
+            time.sleep(stall)
+        return size if reads <= count else None
+
+    return read_chunk
+
+
+def test_streams_are_paced_to_their_duration():
+    start = time.monotonic()
+    RealTimePacer().pace(chunks(5), 50, 0.3)
+    assert 0.2 <= time.monotonic() - start < 1.0
+
+
+def test_stalled_stream_does_not_hold_up_others():
+    pacer = RealTimePacer()
+    stalled = threading.Thread(target=pacer.pace, args=(chunks(3, stall_at=2, stall=1.5), 30, 0.2))
+    stalled.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    pacer.pace(chunks(10), 100, 0.3)
+    assert time.monotonic() - start < 1.0
+    stalled.join()
+
+
+def test_read_errors_are_raised_to_the_caller():
+    def read_chunk():
+        raise OSError('stream closed')
+
+    with pytest.raises(OSError):
+        RealTimePacer().pace(read_chunk, 10, 1.0)
@@ -0,0 +1,47 @@
+from zotify import paths
+from zotify.paths import EpisodeCatalog, parse_partial_filename, partial_filename
+
+
+EPISODE_ID = '4rOoJ6Egrf8K2IrywzwOMk'
+
+
+def test_partial_filename_round_trip(tmp_path):
+    partial = partial_filename(tmp_path / 'Artist - Song.ogg', '4uLU6hMCjMI75M1A2tKUQC')
+
+    assert partial.parent == tmp_path
+    assert parse_partial_filename(partial.name) == ('Artist - Song.ogg', '4uLU6hMCjMI75M1A2tKUQC')
+
+
+def test_has_episode_does_not_write(tmp_path):
+    (tmp_path / 'Show - Episode.mp3').write_bytes(b'ID3')
+    catalog = EpisodeCatalog(tmp_path)
+
+    assert not catalog.has_episode(EPISODE_ID)
+    assert not (tmp_path / '.episode_ids').exists()
+
+    catalog.add(EPISODE_ID, '2024-01-01', 'Show - Episode.mp3')
+    assert catalog.has_episode(EPISODE_ID)
+    assert EpisodeCatalog(tmp_path).has_episode(EPISODE_ID)
+
+
+def test_legacy_files_are_checked(tmp_path, monkeypatch):
+    (tmp_path / 'Show - Empty.ogg').write_bytes(b'')
+    (tmp_path / 'Show - Short.mp3').write_bytes(b'ID3')
+    (tmp_path / 'Show - Complete.mp3').write_bytes(b'ID3')
+    durations = {'Show - Short.mp3': 100.0, 'Show - Complete.mp3': 1799.0}
+    monkeypatch.setattr(paths.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    monkeypatch.setattr(paths, 'get_downloaded_song_duration', lambda filename: durations[filename.split('/')[-1]])
+    catalog = EpisodeCatalog(tmp_path)
+
+    assert catalog.find_legacy_file('Show - Missing', 1800000) is None
+    assert catalog.find_legacy_file('Show - Empty', 1800000) is None
+    assert catalog.find_legacy_file('Show - Short', 1800000) is None
+    assert catalog.find_legacy_file('Show - Complete', 1800000) == 'Show - Complete.mp3'
+    assert not (tmp_path / '.episode_ids').exists()
+
+
+def test_legacy_files_without_ffprobe_are_matched_by_size(tmp_path, monkeypatch):
+    (tmp_path / 'Show - Episode.ogg').write_bytes(b'OggS')
+    monkeypatch.setattr(paths.shutil, 'which', lambda name: None)
+
+    assert EpisodeCatalog(tmp_path).find_legacy_file('Show - Episode', 1800000) == 'Show - Episode.ogg'
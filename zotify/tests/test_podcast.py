@@ -0,0 +1,62 @@
+import pytest
+
+from zotify import podcast
+from zotify.claims import Claim, ClaimStore
+from zotify.const import DURATION_MS, NAME, RELEASE_DATE, SHOW
+from zotify.failures import FailureQueue
+from zotify.zotify import Zotify
+
+
+EPISODE_ID = '4rOoJ6Egrf8K2IrywzwOMk'
+EPISODE_INFO = {SHOW: {NAME: 'Show'}, NAME: 'Episode', DURATION_MS: 1800000, RELEASE_DATE: '2024-01-01'}
+
+
+@pytest.fixture
+def queues(config, tmp_path, monkeypatch):
+    claims = ClaimStore(tmp_path / 'claims.db')
+    failures = FailureQueue(tmp_path / 'failures.db')
+    monkeypatch.setattr(Zotify, 'CLAIMS', claims)
+    monkeypatch.setattr(Zotify, 'FAILURES', failures)
+    yield claims, failures
+    claims.close()
+    failures.close()
+
+
+def test_failed_episode_releases_its_claim_and_is_queued(queues, tmp_path, monkeypatch):
+    claims, failures = queues
+
+    def invoke_url(url, tryCount=0):
+        raise ConnectionError('pathfinder unreachable')
+
+    monkeypatch.setattr(Zotify, 'invoke_url', invoke_url)
+
+    podcast.download_episode(EPISODE_ID, EPISODE_INFO)
+
+    assert [entry['id'] for entry in failures.pending(due_only=False)] == [EPISODE_ID]
+    assert claims.claim(f'episode:{EPISODE_ID}') is Claim.CLAIMED
+    show = tmp_path / 'Podcasts' / 'Show'
+    assert not (show / '.episode_ids').exists()
+    assert not [path for path in show.iterdir() if path.name.endswith('.part')]
+
+
+def test_legacy_episode_is_adopted_and_resolves_its_failure(queues, tmp_path, monkeypatch):
+    claims, failures = queues
+    failures.record('episode', EPISODE_ID, {}, ConnectionError('earlier run'))
+    show = tmp_path / 'Podcasts' / 'Show'
+    show.mkdir(parents=True)
+    (show / 'Show - Episode.mp3').write_bytes(b'ID3')
+    monkeypatch.setattr(podcast.EpisodeCatalog, 'find_legacy_file', lambda self, filename, duration_ms: filename + '.mp3')
+
+    podcast.download_episode(EPISODE_ID, EPISODE_INFO)
+
+    assert (show / '.episode_ids').read_text(encoding='utf-8').startswith(EPISODE_ID)
+    assert failures.pending(due_only=False) == []
+
+
+def test_missing_episode_is_queued(queues, monkeypatch):
+    _, failures = queues
+    monkeypatch.setattr(podcast, 'fetch_episode_info', lambda episode_id: None)
+
+    podcast.download_episode(EPISODE_ID)
+
+    assert [(entry['id'], entry['attempts']) for entry in failures.pending(due_only=False)] == [(EPISODE_ID, 1)]
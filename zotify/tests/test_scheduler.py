@@ -0,0 +1,28 @@
+from zotify import utils
+from zotify.scheduler import Source, schedule
+
+
+def failing(*ids):
+    for track_id in ids:
+        yield dict(track_id=track_id)
+    raise TimeoutError('page timed out')
+
+
+def test_a_failing_source_leaves_the_others_alone(config, monkeypatch):
+    reported = []
+    monkeypatch.setattr(utils, 'report_listing_error', lambda name, error: reported.append(name))
+    sources = [Source('a', failing('a1')), Source('b', [dict(track_id='b1'), dict(track_id='b2')])]
+
+    jobs = [job['track_id'] for job in schedule(sources, 'round_robin')]
+
+    assert jobs == ['a1', 'b1', 'b2']
+    assert reported == ['a']
+
+
+def test_smallest_first_puts_sources_of_unknown_size_last(config):
+    def size():
+        raise TimeoutError('album lookup timed out')
+
+    sources = [Source('a', [dict(track_id='a1')], size), Source('b', [dict(track_id='b1')], lambda: 3)]
+
+    assert [job['track_id'] for job in schedule(sources, 'smallest_first')] == ['b1', 'a1']
@@ -0,0 +1,108 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from zotify.segmented import download_segmented
+
+
+CONTENT = bytes(range(256)) * 40
+SEGMENT_SIZE = 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    ranges = True
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        self.server.requests.append(self.headers.get('Range'))
+        if match is None or not self.ranges:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT)
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(CONTENT) - 1)
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(CONTENT)}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:end + 1])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class NoRangeHandler(Handler):
+    ranges = False
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def server():
+    server = serve(Handler)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def no_range_server():
+    server = serve(NoRangeHandler)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/episode.mp3'
+
+
+def test_download_in_segments(server, tmp_path):
+    received = []
+
+    path = download_segmented(url(server), tmp_path / 'episode.mp3', connections=3, segment_size=SEGMENT_SIZE,
+                              progress=received.append)
+
+    assert path.read_bytes() == CONTENT
+    assert sum(received) == len(CONTENT)
+    # the probe and one request per segment
+    assert len(server.requests) == 1 + -(-len(CONTENT) // SEGMENT_SIZE)
+    assert not (tmp_path / 'episode.mp3.part').exists()
+    assert not (tmp_path / 'episode.mp3.part.json').exists()
+
+
+def test_server_without_ranges_is_downloaded_as_one_stream(no_range_server, tmp_path):
+    sizes = []
+
+    path = download_segmented(url(no_range_server), tmp_path / 'episode.mp3', connections=3,
+                              segment_size=SEGMENT_SIZE, on_size=sizes.append)
+
+    assert path.read_bytes() == CONTENT
+    assert sizes == [len(CONTENT)]
+    assert len(no_range_server.requests) == 1
+
+
+def test_interrupted_download_resumes_missing_segments(server, tmp_path):
+    # the first two segments of an earlier attempt are in place, the rest of the file is garbage
+    done = [0, 1]
+    part = bytearray(b'\xff' * len(CONTENT))
+    part[:2 * SEGMENT_SIZE] = CONTENT[:2 * SEGMENT_SIZE]
+    (tmp_path / 'episode.mp3.part').write_bytes(bytes(part))
+    (tmp_path / 'episode.mp3.part.json').write_text(json.dumps({'size': len(CONTENT), 'segment_size': SEGMENT_SIZE,
+                                                                'done': done}))
+
+    path = download_segmented(url(server), tmp_path / 'episode.mp3', connections=2, segment_size=SEGMENT_SIZE)
+
+    assert path.read_bytes() == CONTENT
+    assert f'bytes=0-{SEGMENT_SIZE - 1}' not in server.requests
+    assert f'bytes={SEGMENT_SIZE}-{2 * SEGMENT_SIZE - 1}' not in server.requests
+    assert f'bytes={2 * SEGMENT_SIZE}-{3 * SEGMENT_SIZE - 1}' in server.requests
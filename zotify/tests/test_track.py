@@ -0,0 +1,131 @@
+import pytest
+
+from zotify import track
+from zotify.cache import MetadataCache
+from zotify.claims import ClaimStore
+from zotify.config import SKIP_PREVIOUSLY_DOWNLOADED, Config
+from zotify.paths import PathPlanner
+from zotify.zotify import Zotify
+
+
+SONG_ID = '4uLU6hMCjMI75M1A2tKUQC'
+
+
+@pytest.fixture
+def cache(config, tmp_path, monkeypatch):
+    cache = MetadataCache(tmp_path / 'cache.db')
+    monkeypatch.setattr(Zotify, 'METADATA_CACHE', cache)
+    yield cache
+    cache.close()
+
+
+def answer(monkeypatch, response):
+    calls = []
+
+    def invoke_url(url, tryCount=0):
+        calls.append(url)
+        return '', response
+
+    monkeypatch.setattr(Zotify, 'invoke_url', invoke_url)
+    return calls
+
+
+@pytest.mark.parametrize('response', [
+    {'error': {'status': 404, 'message': 'not found'}},
+    {'colors': {}},
+])
+def test_missing_lyrics_are_remembered(cache, monkeypatch, response):
+    calls = answer(monkeypatch, response)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            track.fetch_song_lyrics(SONG_ID)
+
+    assert len(calls) == 1
+    # looking up the marker is not a cache miss
+    assert cache.misses == 0
+
+
+@pytest.mark.parametrize('response', [
+    {'error': {'status': 'unknown', 'message': 'received an empty response'}},
+    {'error': {'status': 503, 'message': 'unavailable'}},
+    {'error': {'status': 429, 'message': 'rate limited'}},
+])
+def test_failed_lyrics_requests_are_not_remembered(cache, monkeypatch, response):
+    calls = answer(monkeypatch, response)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            track.fetch_song_lyrics(SONG_ID)
+
+    assert len(calls) == 2
+
+
+def test_lyrics_are_returned(cache, monkeypatch):
+    answer(monkeypatch, {'lyrics': {'syncType': 'UNSYNCED', 'lines': [{'words': 'la'}, {'words': 'la la'}]}})
+
+    assert track.fetch_song_lyrics(SONG_ID) == ['la\n', 'la la\n']
+
+
+
+def fake_ffmpeg(monkeypatch, error=None):
+    """ Replaces ffmpeg, writing every output unless `error` is raised """
+    def init(ff, global_options=None, inputs=None, outputs=None):
+        ff.outputs = outputs
+
+    def run(ff):
+        if error is not None:
+            raise error
+        for output in ff.outputs:
+            with open(output, 'wb') as file:
+                file.write(b'audio')
+
+    monkeypatch.setattr(track.ffmpy.FFmpeg, '__init__', init)
+    monkeypatch.setattr(track.ffmpy.FFmpeg, 'run', run)
+    # the bitrate of a transcode depends on the account
+    monkeypatch.setattr(Zotify, 'check_premium', classmethod(lambda cls: False))
+
+
+def test_extra_formats_are_not_reported_without_ffmpeg(config, tmp_path, monkeypatch):
+    fake_ffmpeg(monkeypatch, track.ffmpy.FFExecutableNotFoundError('ffmpeg'))
+    (tmp_path / 'song.ogg').write_bytes(b'raw')
+    extra = tmp_path / 'mp3' / 'song.mp3'
+
+    assert track.convert_audio_format(tmp_path / 'song.ogg', [('mp3', extra)]) == []
+    assert (tmp_path / 'song.ogg').read_bytes() == b'raw'
+    assert track.convert_extra_formats(tmp_path / 'song.ogg', [('mp3', extra)], SONG_ID) == []
+    assert not extra.exists()
+    assert list((tmp_path / 'mp3').iterdir()) == []
+
+
+def test_extra_formats_are_staged(config, tmp_path, monkeypatch):
+    fake_ffmpeg(monkeypatch)
+    (tmp_path / 'song.ogg').write_bytes(b'raw')
+    extra = tmp_path / 'mp3' / 'song.mp3'
+
+    assert track.convert_extra_formats(tmp_path / 'song.ogg', [('mp3', extra)], SONG_ID) == [extra]
+    assert list((tmp_path / 'mp3').iterdir()) == [extra]
+
+
+def test_track_archived_by_another_process_after_the_planner_read_the_archive_is_skipped(config, tmp_path, monkeypatch):
+    claims = ClaimStore(tmp_path / 'claims.db')
+    monkeypatch.setattr(Zotify, 'CLAIMS', claims)
+    monkeypatch.setitem(Config.Values, SKIP_PREVIOUSLY_DOWNLOADED, True)
+
+    def get_content_stream(*args):
+        raise AssertionError('downloaded again')
+
+    monkeypatch.setattr(Zotify, 'get_content_stream', get_content_stream)
+    planner = PathPlanner()
+    assert SONG_ID not in planner.previously_downloaded()
+    # another process downloads the track and exits, its claims are gone with it
+    (tmp_path / '.song_archive').write_text(f'{SONG_ID}\t2024-01-01 00:00:00\tArtist\tSong\tArtist - Song.ogg\n')
+    info = track.TrackInfo(id=SONG_ID, name='Song', artists=('Artist',), artist_urls=('',), album_name='Album',
+                           image_url='', release_year='2024', disc_number=1, track_number=1, is_playable=True,
+                           duration_ms=1000)
+
+    try:
+        assert track.download_track('single', SONG_ID, track_info=info, planner=planner)
+    finally:
+        claims.close()
+    assert not (tmp_path / 'Music' / 'Artist - Song.ogg').exists()
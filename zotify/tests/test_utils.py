@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from zotify import utils
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_run_jobs_reports_failed_jobs_and_goes_on(config, workers, monkeypatch):
+    reported = []
+    monkeypatch.setattr(utils, 'report_job_error', lambda name, job, error: reported.append((job['n'], str(error))))
+    done = []
+    lock = threading.Lock()
+
+    def job(n):
+        if n % 3 == 0:
+            raise ValueError(f'job {n}')
+        with lock:
+            done.append(n)
+
+    utils.run_jobs(job, (dict(n=n) for n in range(10)), workers, name='test')
+
+    assert sorted(done) == [1, 2, 4, 5, 7, 8]
+    assert sorted(reported) == [(0, 'job 0'), (3, 'job 3'), (6, 'job 6'), (9, 'job 9')]
+
+
+def test_report_job_error_prints_the_error(config, capsys):
+    utils.report_job_error('episode', {'episode_id': 'abc', 'episode_info': {'a': 1}}, ValueError('no stream'))
+
+    out = capsys.readouterr()
+    assert 'EPISODE FAILED: no stream' in out.out + out.err
+    assert 'episode_id: abc' in out.out + out.err
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_run_jobs_reports_a_failing_listing_and_runs_the_jobs_listed_before(config, workers, monkeypatch):
+    reported = []
+    monkeypatch.setattr(utils, 'report_listing_error', lambda name, error: reported.append((name, str(error))))
+    done = []
+    lock = threading.Lock()
+
+    def listing():
+        yield dict(n=1)
+        yield dict(n=2)
+        raise TimeoutError('page timed out')
+
+    def job(n):
+        with lock:
+            done.append(n)
+
+    utils.run_jobs(job, listing(), workers, name='download')
+
+    assert sorted(done) == [1, 2]
+    assert reported == [('download', 'page timed out')]
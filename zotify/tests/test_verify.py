@@ -0,0 +1,119 @@
+import os
+import time
+
+import pytest
+
+from zotify import verify
+from zotify.claims import Claim, ClaimStore
+from zotify.plan import Plan
+from zotify.track import TrackInfo
+from zotify.zotify import Zotify
+
+
+GOOD_ID = '4uLU6hMCjMI75M1A2tKUQC'
+BROKEN_ID = '1uLU6hMCjMI75M1A2tKUQC'
+PARTIAL_ID = '2uLU6hMCjMI75M1A2tKUQC'
+ARCHIVED_ID = '3uLU6hMCjMI75M1A2tKUQC'
+
+
+def song_ids_line(song_id, name):
+    return f'{song_id}\t2024-01-01 00:00:00\tArtist\t{name}\tArtist - {name}.ogg\n'
+
+
+@pytest.fixture
+def library(config, tmp_path):
+    album = tmp_path / 'Music' / 'Album'
+    album.mkdir(parents=True)
+    (album / '.song_ids').write_text(song_ids_line(GOOD_ID, 'Good') + song_ids_line(BROKEN_ID, 'Broken'), encoding='utf-8')
+    for name in ('Artist - Good.ogg', 'Artist - Broken.ogg', 'Artist - Archived.ogg', 'Artist - Unknown.ogg',
+                 f'.Artist - Partial.{PARTIAL_ID}.part.ogg'):
+        (album / name).write_bytes(b'OggS')
+    # left behind by an interrupted run, long enough ago that no download is still writing to it
+    old = time.time() - 3600
+    os.utime(album / f'.Artist - Partial.{PARTIAL_ID}.part.ogg', (old, old))
+    (tmp_path / '.song_archive').write_text(song_ids_line(ARCHIVED_ID, 'Archived'), encoding='utf-8')
+    return album
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """ Replaces the download of broken tracks, collects the jobs instead """
+    jobs = []
+    monkeypatch.setattr(verify, 'download_tracks', lambda tracks: jobs.extend(tracks))
+    monkeypatch.setattr(verify, 'get_songs_info', lambda ids: {
+        song_id: TrackInfo(id=song_id, duration_ms=200000) for song_id in ids})
+    monkeypatch.setattr(verify.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    return jobs
+
+
+def test_scan_library(library, tmp_path):
+    files = {file.path.name: file for file in verify.scan_library(tmp_path / 'Music', tmp_path / '.song_archive')}
+
+    assert set(files) == {'Artist - Good.ogg', 'Artist - Broken.ogg', 'Artist - Archived.ogg', 'Artist - Unknown.ogg',
+                          f'.Artist - Partial.{PARTIAL_ID}.part.ogg'}
+    assert files['Artist - Good.ogg'].song_id == GOOD_ID
+    assert files['Artist - Archived.ogg'].song_id == ARCHIVED_ID
+    assert files['Artist - Unknown.ogg'].song_id is None
+    partial = files[f'.Artist - Partial.{PARTIAL_ID}.part.ogg']
+    assert partial.partial and partial.song_id == PARTIAL_ID
+    assert partial.target == library / 'Artist - Partial.ogg'
+
+
+def test_verify_needs_ffprobe(library, downloads, monkeypatch):
+    monkeypatch.setattr(verify.shutil, 'which', lambda name: None)
+
+    verify.verify_library()
+
+    assert downloads == []
+    assert len(list(library.iterdir())) == 6
+
+
+def test_verify_downloads_broken_files_again(library, downloads, monkeypatch):
+    durations = {
+        library / 'Artist - Good.ogg': 200.5,
+        library / 'Artist - Broken.ogg': 61.0,
+        # ffprobe found nothing it could read
+        library / 'Artist - Unknown.ogg': None,
+        # library / 'Artist - Archived.ogg' could not be probed
+    }
+    monkeypatch.setattr(verify, 'probe_library', lambda files: {
+        file.path: durations[file.path] for file in files if file.path in durations})
+
+    verify.verify_library()
+
+    assert sorted(job['track_id'] for job in downloads) == [BROKEN_ID, PARTIAL_ID]
+    assert {job['output_template'] for job in downloads} == {'Album/Artist - Broken.{ext}', 'Album/Artist - Partial.{ext}'}
+    # only files that were probed and found broken are deleted, and interrupted downloads
+    assert sorted(path.name for path in library.iterdir()) == [
+        '.song_ids', 'Artist - Archived.ogg', 'Artist - Good.ogg', 'Artist - Unknown.ogg']
+    assert (library / '.song_ids').read_text(encoding='utf-8') == song_ids_line(GOOD_ID, 'Good')
+
+
+def test_verify_only_reports_in_a_plan(library, downloads, monkeypatch):
+    monkeypatch.setattr(verify, 'probe_library', lambda files: {file.path: None for file in files})
+    monkeypatch.setattr(Zotify, 'PLAN', Plan('HIGH'))
+
+    verify.verify_library()
+
+    assert downloads == []
+    assert len(list(library.iterdir())) == 6
+
+
+def test_forget_downloads_releases_claims(library, tmp_path, monkeypatch):
+    claims = ClaimStore(tmp_path / 'claims.db')
+    monkeypatch.setattr(Zotify, 'CLAIMS', claims)
+    other = ClaimStore(tmp_path / 'claims.db')
+    try:
+        broken = [file for file in verify.scan_library(tmp_path / 'Music') if file.song_id == BROKEN_ID]
+        # downloaded by another process that is still running
+        assert other.claim(BROKEN_ID) is Claim.CLAIMED
+        other.complete(BROKEN_ID)
+        assert claims.claim(BROKEN_ID) is Claim.DONE
+
+        verify.forget_downloads(broken)
+
+        assert not (library / 'Artist - Broken.ogg').exists()
+        assert claims.claim(BROKEN_ID) is Claim.CLAIMED
+    finally:
+        other.close()
+        claims.close()
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from zotify import track
+from zotify.watchdog import StageTimeout, Watchdog
+
+
+def test_hanging_read_times_out():
+    release = threading.Event()
+    chunks = iter([b'first'])
+
+    def read():
+        chunk = next(chunks, None)
+        if chunk is None:
+            release.wait()
+            return b''
+        return chunk
+
+    reader = Watchdog(stall_timeout=0.2).reader('stream', read)
+    assert reader.read() == b'first'
+
+    started = time.monotonic()
+    with pytest.raises(StageTimeout) as raised:
+        reader.read()
+    release.set()
+
+    assert raised.value.stage == 'stream'
+    assert time.monotonic() - started < 2
+
+
+def test_read_error_is_raised_by_reader():
+    def read():
+        raise ConnectionError('stream closed')
+
+    reader = Watchdog(stall_timeout=1).reader('stream', read)
+    with pytest.raises(ConnectionError):
+        reader.read()
+
+
+def test_deadline():
+    watchdog = Watchdog(deadline=0.2)
+    watchdog.check('metadata')
+    assert watchdog.call('metadata', lambda: 'info') == 'info'
+
+    release = threading.Event()
+    with pytest.raises(StageTimeout) as raised:
+        watchdog.call('convert', release.wait)
+    release.set()
+
+    assert raised.value.stage == 'convert'
+    assert 'deadline' in str(raised.value)
+    with pytest.raises(StageTimeout):
+        watchdog.check('tags')
+
+
+def test_without_timeouts_calls_directly():
+    watchdog = Watchdog()
+
+    assert not watchdog.enabled
+    assert watchdog.call('metadata', threading.current_thread) is threading.current_thread()
+
+
+def test_timed_out_track_is_requeued_once(config):
+    attempts = []
+
+    def download_track(track_id, requeue=None):
+        attempts.append(track_id)
+        # track 2 times out on every attempt
+        if track_id == '2' and requeue is not None:
+            requeue()
+
+    track.run_with_requeue(download_track, [{'track_id': '1'}, {'track_id': '2'}])
+
+    assert attempts == ['1', '2', '2']
@@ -0,0 +1,45 @@
+import pytest
+import requests
+
+from zotify import zotify
+from zotify.zotify import Zotify
+
+
+class Response:
+    status_code = 200
+    headers = {}
+
+
+@pytest.fixture
+def timeouts(config, monkeypatch):
+    """ requests.get times out as often as the returned list says, then answers """
+    remaining = [0]
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(url)
+        if remaining[0] > 0:
+            remaining[0] -= 1
+            raise requests.exceptions.ReadTimeout('read timed out')
+        return Response()
+
+    monkeypatch.setattr(zotify.requests, 'get', get)
+    monkeypatch.setattr(zotify, 'TIMEOUT_BACKOFF', 0)
+    return remaining, calls
+
+
+def test_timed_out_get_is_retried_regardless_of_retry_attempts(timeouts):
+    remaining, calls = timeouts
+    remaining[0] = zotify.TIMEOUT_RETRIES - 1
+
+    assert Zotify._get('https://api.spotify.com/v1/me/tracks', headers={}).status_code == 200
+    assert len(calls) == zotify.TIMEOUT_RETRIES
+
+
+def test_get_that_keeps_timing_out_raises(timeouts):
+    remaining, calls = timeouts
+    remaining[0] = zotify.TIMEOUT_RETRIES
+
+    with pytest.raises(requests.exceptions.Timeout):
+        Zotify._get('https://api.spotify.com/v1/me/tracks', headers={})
+    assert len(calls) == zotify.TIMEOUT_RETRIES
@@ -25,6 +25,16 @@ def main():
     parser.add_argument('--password',
                         type=str,
                         help='Account password')
+    parser.add_argument('--invalidate-cache',
+                        type=str,
+                        nargs='?',
+                        const='all',
+                        metavar='ENTITY',
+                        help='Drops cached metadata of the given entity type (track, album, artist, playlist) or everything')
+    parser.add_argument('--plan',
+                        type=str,
+                        metavar='FILE',
+                        help='Lists and checks everything that would be downloaded without downloading it, writes the plan to FILE')
     group = parser.add_mutually_exclusive_group(required=False)
     group.add_argument('urls',
                        type=str,
@@ -51,6 +61,16 @@ def main():
     group.add_argument('-d', '--download',
                        type=str,
                        help='Downloads tracks, playlists and albums from the URLs written in the file passed.')
+    group.add_argument('--execute-plan',
+                       type=str,
+                       metavar='FILE',
+                       help='Downloads the tracks and episodes of a plan written by --plan.')
+    group.add_argument('--retry-failed',
+                       action='store_true',
+                       help='Downloads the tracks and episodes that failed in earlier runs again, without listing their playlists, albums or shows.')
+    group.add_argument('--verify',
+                       action='store_true',
+                       help='Checks the durations of all downloaded tracks and downloads broken or incomplete ones again.')
 
     for configkey in CONFIG_VALUES:
         parser.add_argument(CONFIG_VALUES[configkey]['arg'],
@@ -1,6 +1,10 @@
-from zotify.const import ITEMS, ARTISTS, NAME, ID
+from typing import Iterator
+
+from zotify.const import ARTISTS, NAME, ID
+from zotify.paginator import Paginator
+from zotify.paths import PathPlanner
 from zotify.termoutput import Printer
-from zotify.track import download_track
+from zotify.track import download_tracks, TrackInfo
 from zotify.utils import fix_filename
 from zotify.zotify import Zotify
 
@@ -8,47 +12,49 @@ ALBUM_URL = 'https://api.spotify.com/v1/albums'
 ARTIST_URL = 'https://api.spotify.com/v1/artists'
 
 
-def get_album_tracks(album_id):
-    """ Returns album tracklist """
-    songs = []
-    offset = 0
-    limit = 50
+def get_album_tracks(album_id) -> Paginator:
+    """ Returns album tracklist, fetched lazily page by page """
+    return Paginator(f'{ALBUM_URL}/{album_id}/tracks', limit=50, market='from_token')
 
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{ALBUM_URL}/{album_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
 
-    return songs
+def get_album_info(album_id):
+    """ Returns the album object """
+    (raw, resp) = Zotify.invoke_url_cached('album', album_id, f'{ALBUM_URL}/{album_id}')
+    return resp
 
 
 def get_album_name(album_id):
     """ Returns album name """
-    (raw, resp) = Zotify.invoke_url(f'{ALBUM_URL}/{album_id}')
+    resp = get_album_info(album_id)
     return resp[ARTISTS][0][NAME], fix_filename(resp[NAME])
 
 
 def get_artist_albums(artist_id):
     """ Returns artist's albums """
-    (raw, resp) = Zotify.invoke_url(f'{ARTIST_URL}/{artist_id}/albums?include_groups=album%2Csingle')
-    # Return a list each album's id
-    album_ids = [resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))]
-    # Recursive requests to get all albums including singles an EPs
-    while resp['next'] is not None:
-        (raw, resp) = Zotify.invoke_url(resp['next'])
-        album_ids.extend([resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))])
+    # Return a list each album's id, including singles and EPs
+    return [album[ID] for album in Paginator(f'{ARTIST_URL}/{artist_id}/albums', limit=50, include_groups='album,single')]
+
+
+def get_album_jobs(album) -> Iterator[dict]:
+    """ Yields the download_track arguments for every track of an album """
+    album_info = get_album_info(album)
+    artist, album_name = album_info[ARTISTS][0][NAME], fix_filename(album_info[NAME])
+    tracks = get_album_tracks(album)
+    planner = PathPlanner()
+    for n, track in Printer.progress(enumerate(tracks, start=1), unit_scale=True, unit='Song', total=len(tracks)):
+        yield dict(mode='album', track_id=track[ID], extra_keys={'album_num': str(n).zfill(2), 'artist': artist, 'album': album_name, 'album_id': album},
+                   disable_progressbar=True, track_info=TrackInfo.from_json(track, album=album_info), planner=planner)
+
 
-    return album_ids
+def get_artist_album_jobs(artist) -> Iterator[dict]:
+    """ Yields the download_track arguments for every track of every album of an artist """
+    for album_id in get_artist_albums(artist):
+        yield from get_album_jobs(album_id)
 
 
 def download_album(album):
     """ Downloads songs from an album """
-    artist, album_name = get_album_name(album)
-    tracks = get_album_tracks(album)
-    for n, track in Printer.progress(enumerate(tracks, start=1), unit_scale=True, unit='Song', total=len(tracks)):
-        download_track('album', track[ID], extra_keys={'album_num': str(n).zfill(2), 'artist': artist, 'album': album_name, 'album_id': album}, disable_progressbar=True)
+    download_tracks(get_album_jobs(album))
 
 
 def download_artist_albums(artist):
@@ -1,16 +1,24 @@
 from librespot.audio.decoders import AudioQuality
 from tabulate import tabulate
 from pathlib import Path
+import time
+from typing import Dict, Iterator, List, Optional
 
-from zotify.album import download_album, download_artist_albums
+from zotify.album import download_album, download_artist_albums, get_album_info, get_album_jobs, get_artist_album_jobs
 from zotify.const import TRACK, NAME, ID, ARTIST, ARTISTS, ITEMS, TRACKS, EXPLICIT, ALBUM, ALBUMS, \
-    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, TYPE
+    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, TYPE, EPISODE, SHOW
 from zotify.loader import Loader
+from zotify.ingest import DownloadFile, INVALID
+from zotify.paginator import Paginator
+from zotify.paths import PathPlanner
+from zotify.plan import Plan, load_plan
 from zotify.playlist import get_playlist_songs, get_playlist_info, download_from_user_playlist, download_playlist
-from zotify.podcast import download_episode, get_show_episodes
+from zotify.podcast import download_episode, download_show, get_episodes_info
+from zotify.scheduler import Source, parse_priorities, schedule
 from zotify.termoutput import Printer, PrintChannel
-from zotify.track import download_track, get_saved_tracks, get_followed_artists
-from zotify.utils import splash, split_input, regex_input_for_urls
+from zotify.track import download_track, download_tracks, get_saved_tracks, get_followed_artists, get_songs_info, TrackInfo
+from zotify.utils import splash, split_input, parse_spotify_input, fmt_seconds, run_jobs
+from zotify.verify import verify_library
 from zotify.zotify import Zotify
 
 SEARCH_URL = 'https://api.spotify.com/v1/search'
@@ -30,19 +38,40 @@ def client(args) -> None:
     }
     Zotify.DOWNLOAD_QUALITY = quality_options[Zotify.CONFIG.get_download_quality()]
 
+    if args.plan:
+        Zotify.PLAN = Plan(Zotify.DOWNLOAD_QUALITY.name)
+        run(args)
+        finish_plan(args.plan)
+    else:
+        run(args)
+
+
+def run(args) -> None:
+    """ Runs the mode selected on the command line """
+    if args.execute_plan:
+        if Path(args.execute_plan).exists():
+            download_plan(args.execute_plan)
+        else:
+            Printer.print(PrintChannel.ERRORS, f'File {args.execute_plan} not found.\n')
+        return
+
     if args.download:
-        urls = []
         filename = args.download
         if Path(filename).exists():
-            with open(filename, 'r', encoding='utf-8') as file:
-                urls.extend([line.strip() for line in file.readlines()])
-
-            download_from_urls(urls)
+            download_from_file(filename)
 
         else:
             Printer.print(PrintChannel.ERRORS, f'File {filename} not found.\n')
         return
 
+    if args.retry_failed:
+        retry_failed()
+        return
+
+    if args.verify:
+        verify_library()
+        return
+
     if args.urls:
         if len(args.urls) > 0:
             download_from_urls(args.urls)
@@ -53,16 +82,11 @@ def client(args) -> None:
         return
 
     if args.liked_songs:
-        for song in get_saved_tracks():
-            if not song[TRACK][NAME] or not song[TRACK][ID]:
-                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
-            else:
-                download_track('liked', song[TRACK][ID])
+        download_tracks(get_liked_songs_jobs(), journal='liked')
         return
     
     if args.followed_artists:
-        for artist in get_followed_artists():
-            download_artist_albums(artist)
+        download_tracks(get_followed_artists_jobs(), journal='followed')
         return
 
     if args.search:
@@ -82,55 +106,196 @@ def client(args) -> None:
             search_text = input('Enter search: ')
         search(search_text)
 
+def finish_plan(path: str) -> None:
+    """ Writes the plan of a --plan run and prints its summary """
+    Zotify.PLAN.save(path)
+    summary = Zotify.PLAN.summary()
+    seconds = Zotify.PLAN.estimate_seconds(Zotify.CONFIG.get_download_workers(), Zotify.CONFIG.get_download_real_time(),
+                                           Zotify.CONFIG.get_download_rate_limit())
+    Printer.event('plan', path=path, **summary, estimated_seconds=seconds)
+    Printer.print(PrintChannel.DOWNLOADS, f'###   PLAN: {summary["tracks"]} tracks and {summary["episodes"]} episodes to download, '
+                                          f'about {summary["bytes"] / 1024 ** 2:.1f} MiB and {fmt_seconds(summary["duration_ms"] / 1000)} of audio   ###')
+    skipped = ', '.join(f'{count} {reason}' for reason, count in sorted(summary['skipped'].items(), key=lambda item: -item[1]))
+    Printer.print(PrintChannel.DOWNLOADS, f'###   SKIPPED: {skipped or "nothing"}   ###')
+    Printer.print(PrintChannel.DOWNLOADS, f'###   ESTIMATED TIME: {fmt_seconds(seconds) if seconds is not None else "depends on your connection"}   ###')
+    Printer.print(PrintChannel.DOWNLOADS, f'###   Plan written to {path}, run it with --execute-plan {path}   ###\n')
+
+
+def download_plan(path: str) -> None:
+    """ Downloads the items of a plan written by --plan, without listing anything again """
+    downloads = load_plan(path)
+    planner = PathPlanner()
+    download_tracks(dict(mode=item['mode'], track_id=item['track_id'], extra_keys=item['extra_keys'],
+                         track_info=TrackInfo(**item['track_info']), planner=planner, output_template=item['output'])
+                    for item in downloads if item['kind'] == 'track')
+    run_jobs(download_episode, (dict(episode_id=item['episode_id'], episode_info=item['episode_info'])
+                                for item in downloads if item['kind'] == 'episode'),
+             Zotify.CONFIG.get_download_workers(), name='episode')
+
+
+def retry_failed() -> None:
+    """ Downloads the tracks and episodes in the failure queue again, waiting out the backoff of
+    each entry, until every entry succeeded or got quarantined """
+    if Zotify.FAILURES is None:
+        Printer.print(PrintChannel.ERRORS, '###   The failure queue is disabled, enable FAILURE_QUEUE to keep failed downloads for --retry-failed   ###\n')
+        return
+    planner = PathPlanner()
+
+    def queue_state() -> tuple:
+        return tuple((entry['kind'], entry['id'], entry['attempts'], entry['retry_at'])
+                     for entry in Zotify.FAILURES.pending(due_only=False))
+
+    while True:
+        before = queue_state()
+        due = [entry for entry in Zotify.FAILURES.pending() if entry['kind'] in ('track', 'episode')]
+        tracks = [entry for entry in due if entry['kind'] == 'track']
+        episodes = [entry for entry in due if entry['kind'] == 'episode']
+        if tracks:
+            download_tracks(dict(mode=entry['context'].get('mode', 'single'), track_id=entry['id'],
+                                 extra_keys=entry['context'].get('extra_keys'),
+                                 output_template=entry['context'].get('output_template'), planner=planner)
+                            for entry in tracks)
+        if episodes:
+            run_jobs(download_episode, (dict(episode_id=entry['id']) for entry in episodes),
+                     Zotify.CONFIG.get_download_workers(), name='episode')
+        # a dry run can't tell whether a retry worked, one pass is all it plans
+        if Zotify.PLAN is not None:
+            break
+        if due and queue_state() == before:
+            # every download of the pass returned without resolving or failing again, another pass would do the same
+            Printer.print(PrintChannel.WARNINGS, f'###   {len(due)} failed downloads could not be retried, stopping   ###')
+            break
+        if due:
+            continue
+        retry_at = Zotify.FAILURES.next_retry()
+        if retry_at is None:
+            break
+        waiting = len(Zotify.FAILURES.pending(due_only=False))
+        Printer.print(PrintChannel.PROGRESS_INFO, f'###   Retrying {waiting} failed downloads in {fmt_seconds(max(0, retry_at - time.time()))}   ###')
+        time.sleep(max(0, retry_at - time.time()))
+
+    quarantined = Zotify.FAILURES.quarantined()
+    for entry in quarantined:
+        Printer.print(PrintChannel.WARNINGS, f'###   QUARANTINED: {entry["kind"]} {entry["id"]} after {entry["attempts"]} attempts '
+                                             f'({entry["error_class"]}: {entry["error"]})   ###')
+    Printer.event('retry_finished', quarantined=len(quarantined))
+
+
+def get_liked_songs_jobs() -> Iterator[dict]:
+    """ Yields the download_track arguments for every liked song """
+    planner = PathPlanner()
+    for song in get_saved_tracks():
+        if not song[TRACK][NAME] or not song[TRACK][ID]:
+            Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
+        else:
+            yield dict(mode='liked', track_id=song[TRACK][ID], track_info=TrackInfo.from_json(song[TRACK]), planner=planner)
+
+
+def get_followed_artists_jobs() -> Iterator[dict]:
+    """ Yields the download_track arguments for every album track of every followed artist """
+    for artist in get_followed_artists():
+        yield from get_artist_album_jobs(artist)
+
+
+def get_playlist_jobs(playlist_id: str, playlist_songs: Optional[Paginator] = None) -> Iterator[dict]:
+    """ Yields the download_track arguments for every track of a playlist, episodes are downloaded right away """
+    if playlist_songs is None:
+        playlist_songs = get_playlist_songs(playlist_id)
+    name, _ = get_playlist_info(playlist_id)
+    planner = PathPlanner()
+    enum = 1
+    char_num = len(str(len(playlist_songs)))
+    for song in playlist_songs:
+        if not song[TRACK][NAME] or not song[TRACK][ID]:
+            Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
+        else:
+            if song[TRACK][TYPE] == "episode": # Playlist item is a podcast episode
+                download_episode(song[TRACK][ID])
+            else:
+                yield dict(mode='playlist', track_id=song[TRACK][ID], extra_keys=
+                {
+                    'playlist_song_name': song[TRACK][NAME],
+                    'playlist': name,
+                    'playlist_num': str(enum).zfill(char_num),
+                    'playlist_id': playlist_id,
+                    'playlist_track_id': song[TRACK][ID]
+                }, track_info=TrackInfo.from_json(song[TRACK]), planner=planner)
+            enum += 1
+
+
 def download_from_urls(urls: list[str]) -> bool:
     """ Downloads from a list of urls """
     download = False
+    sources = []
+    priorities = parse_priorities(Zotify.CONFIG.get_scheduler_priorities())
 
     for spotify_url in urls:
-        track_id, album_id, playlist_id, episode_id, show_id, artist_id = regex_input_for_urls(spotify_url)
-
-        if track_id is not None:
-            download = True
-            download_track('single', track_id)
-        elif artist_id is not None:
-            download = True
-            download_artist_albums(artist_id)
-        elif album_id is not None:
-            download = True
-            download_album(album_id)
-        elif playlist_id is not None:
-            download = True
-            playlist_songs = get_playlist_songs(playlist_id)
-            name, _ = get_playlist_info(playlist_id)
-            enum = 1
-            char_num = len(str(len(playlist_songs)))
-            for song in playlist_songs:
-                if not song[TRACK][NAME] or not song[TRACK][ID]:
-                    Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
-                else:
-                    if song[TRACK][TYPE] == "episode": # Playlist item is a podcast episode
-                        download_episode(song[TRACK][ID])
-                    else:
-                        download_track('playlist', song[TRACK][ID], extra_keys=
-                        {
-                            'playlist_song_name': song[TRACK][NAME],
-                            'playlist': name,
-                            'playlist_num': str(enum).zfill(char_num),
-                            'playlist_id': playlist_id,
-                            'playlist_track_id': song[TRACK][ID]
-                        })
-                    enum += 1
-        elif episode_id is not None:
-            download = True
-            download_episode(episode_id)
-        elif show_id is not None:
-            download = True
-            for episode in get_show_episodes(show_id):
-                download_episode(episode)
+        parsed = parse_spotify_input(spotify_url)
+        if parsed is None:
+            continue
+        download = True
+        kind, entity_id = parsed
+        if kind == EPISODE:
+            download_episode(entity_id)
+        elif kind == SHOW:
+            download_show(entity_id)
+        else:
+            sources.append(get_source(kind, entity_id, priorities))
 
+    if sources:
+        download_sources(sources)
     return download
 
 
+def get_source(kind: str, source_id: str, priorities: Dict[str, int]) -> Source:
+    """ The tracks of a track, album, playlist or artist url as one source of the scheduler """
+    if kind == TRACK:
+        return Source(source_id, [dict(mode='single', track_id=source_id)], lambda: 1, priorities.get(source_id, 0))
+    if kind == ALBUM:
+        return Source(source_id, get_album_jobs(source_id), lambda: get_album_info(source_id).get('total_tracks'),
+                      priorities.get(source_id, 0))
+    if kind == PLAYLIST:
+        songs = get_playlist_songs(source_id)
+        return Source(source_id, get_playlist_jobs(source_id, songs), lambda: len(songs), priorities.get(source_id, 0))
+    return Source(source_id, get_artist_album_jobs(source_id), priority=priorities.get(source_id, 0))
+
+
+def download_sources(sources: List[Source]) -> None:
+    """ Downloads the tracks of several sources with one pool of workers, in the order of SCHEDULER """
+    download_tracks(schedule(sources, Zotify.CONFIG.get_scheduler()))
+
+
+def download_from_file(filename: str) -> None:
+    """ Downloads the URLs of a --download file, tracks and episodes are looked up 50 at a time """
+    download_file = DownloadFile(filename, checkpoint=Zotify.PLAN is None)
+    if download_file.start:
+        Printer.print(PrintChannel.PROGRESS_INFO, f'###   Continuing {filename} at byte {download_file.start}   ###')
+    planner = PathPlanner()
+    priorities = parse_priorities(Zotify.CONFIG.get_scheduler_priorities())
+    for window in download_file.windows():
+        for line in window.get(INVALID, []):
+            Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: {line} (NOT A SPOTIFY URL)   ###')
+
+        track_ids = window.get(TRACK, [])
+        for i in range(0, len(track_ids), 50):
+            batch = track_ids[i:i + 50]
+            infos = get_songs_info(batch)
+            download_tracks(dict(mode='single', track_id=track_id, track_info=infos.get(track_id), planner=planner)
+                            for track_id in batch)
+
+        episode_ids = window.get(EPISODE, [])
+        for i in range(0, len(episode_ids), 50):
+            infos = get_episodes_info(episode_ids[i:i + 50])
+            run_jobs(download_episode, (dict(episode_id=episode_id, episode_info=infos.get(episode_id))
+                                        for episode_id in episode_ids[i:i + 50]),
+                     Zotify.CONFIG.get_download_workers(), name='episode')
+
+        download_sources([get_source(kind, source_id, priorities)
+                          for kind in (ALBUM, PLAYLIST, ARTIST) for source_id in window.get(kind, [])])
+        for show_id in window.get(SHOW, []):
+            download_show(show_id)
+
+
 def search(search_term):
     """ Searches download server's API for relevant data """
     params = {'limit': '10',
@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+
+HOUR = 60 * 60
+
+# default time to live per entity type, metadata of releases hardly ever changes
+DEFAULT_TTLS = {
+    'track': 7 * 24 * HOUR,
+    'album': 30 * 24 * HOUR,
+    'artist': 7 * 24 * HOUR,
+    'playlist': 24 * HOUR,
+    'episode': 7 * 24 * HOUR,
+    'show': 24 * HOUR,
+    # ffprobe durations of downloaded files, keyed by path, size and modification time
+    'probe': 365 * 24 * HOUR,
+    # tracks that had no lyrics the last time they were requested
+    'lyrics_miss': 7 * 24 * HOUR,
+    # stored bodies of responses that carried an ETag or Last-Modified validator
+    'response': 30 * 24 * HOUR,
+}
+
+
+def parse_ttls(value: str) -> Dict[str, int]:
+    """ Parses 'entity=hours,...' into a dict of entity -> seconds, on top of the defaults """
+    ttls = dict(DEFAULT_TTLS)
+    for part in value.split(','):
+        if '=' not in part:
+            continue
+        entity, hours = part.split('=', 1)
+        ttls[entity.strip()] = int(float(hours) * HOUR)
+    return ttls
+
+
+class MetadataCache:
+    """ On-disk cache for API responses, keyed by entity type and id.
+
+    Entries expire after the time to live of their entity type, the total number of entries
+    is capped by evicting the oldest ones. Safe to use from several threads.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000, ttls: Optional[Dict[str, int]] = None):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.ttls = ttls if ttls is not None else dict(DEFAULT_TTLS)
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                         'entity TEXT NOT NULL, id TEXT NOT NULL, value TEXT NOT NULL, fetched_at REAL NOT NULL, '
+                         'PRIMARY KEY (entity, id))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS metadata_fetched_at ON metadata (fetched_at)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB NOT NULL, fetched_at REAL NOT NULL)')
+
+    def get(self, entity: str, entity_id: str) -> Optional[Any]:
+        """ Returns the cached value or None if it is missing or expired """
+        ttl = self.ttls.get(entity, 0)
+        with self._lock:
+            row = self._db.execute('SELECT value, fetched_at FROM metadata WHERE entity = ? AND id = ?',
+                                   (entity, entity_id)).fetchone()
+            if row is None or time.time() - row[1] > ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def has(self, entity: str, entity_id: str) -> bool:
+        """ Whether an unexpired entry exists, e.g. a marker, without counting as a cache hit or miss """
+        ttl = self.ttls.get(entity, 0)
+        with self._lock:
+            row = self._db.execute('SELECT fetched_at FROM metadata WHERE entity = ? AND id = ?',
+                                   (entity, entity_id)).fetchone()
+        return row is not None and time.time() - row[0] <= ttl
+
+    def put(self, entity: str, entity_id: str, value: Any) -> None:
+        data = json.dumps(value, separators=(',', ':'))
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO metadata (entity, id, value, fetched_at) VALUES (?, ?, ?, ?)',
+                             (entity, entity_id, data, time.time()))
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._evict()
+
+    def get_response(self, key: str) -> Optional[Tuple[Optional[str], Optional[str], str]]:
+        """ Returns the (etag, last_modified, body) stored for a request, if any """
+        with self._lock:
+            row = self._db.execute('SELECT etag, last_modified, body FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], zlib.decompress(row[2]).decode('utf-8')
+
+    def put_response(self, key: str, etag: Optional[str], last_modified: Optional[str], body: str) -> None:
+        data = zlib.compress(body.encode('utf-8'))
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses (key, etag, last_modified, body, fetched_at) '
+                             'VALUES (?, ?, ?, ?, ?)', (key, etag, last_modified, data, time.time()))
+
+    def touch_response(self, key: str) -> None:
+        """ Records that a stored response was confirmed unchanged by the server """
+        with self._lock:
+            self.revalidated += 1
+            self._db.execute('UPDATE responses SET fetched_at = ? WHERE key = ?', (time.time(), key))
+
+    def invalidate(self, entity: Optional[str] = None, entity_id: Optional[str] = None) -> int:
+        """ Removes a single entry, all entries of an entity type or everything. Returns the number removed """
+        with self._lock:
+            if entity is None:
+                cursor = self._db.execute('DELETE FROM metadata')
+                self._db.execute('DELETE FROM responses')
+            elif entity == 'response':
+                cursor = self._db.execute('DELETE FROM responses')
+            elif entity_id is None:
+                cursor = self._db.execute('DELETE FROM metadata WHERE entity = ?', (entity,))
+            else:
+                cursor = self._db.execute('DELETE FROM metadata WHERE entity = ? AND id = ?', (entity, entity_id))
+            return cursor.rowcount
+
+    def _evict(self) -> None:
+        """ Drops expired entries and, beyond max_entries, the oldest ones """
+        now = time.time()
+        for entity, ttl in self.ttls.items():
+            self._db.execute('DELETE FROM metadata WHERE entity = ? AND fetched_at < ?', (entity, now - ttl))
+        self._db.execute('DELETE FROM responses WHERE fetched_at < ?', (now - self.ttls.get('response', 0),))
+        for table in ('metadata', 'responses'):
+            count = self._db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute(f'DELETE FROM {table} WHERE rowid IN '
+                                 f'(SELECT rowid FROM {table} ORDER BY fetched_at LIMIT ?)', (count - self.max_entries,))
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = f'{self.hits / total:.0%}' if total else 'n/a'
+        return f'{self.hits} hits, {self.misses} misses ({rate} hit rate), {self.revalidated} responses unchanged'
+
+    def close(self) -> None:
+        with self._lock:
+            self._evict()
+            self._db.close()
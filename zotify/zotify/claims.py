@@ -0,0 +1,109 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from enum import Enum
+from typing import Iterable, Set
+
+
+# a claim of a process that stopped renewing it (crashed, killed) is free again after this time
+LEASE_SECONDS = 5 * 60
+# finished downloads stay visible to other processes for at most this long, and only while the
+# process that downloaded them is running, the archive covers everything else
+DONE_SECONDS = 24 * 60 * 60
+
+
+class Claim(Enum):
+    CLAIMED = 'claimed'
+    BUSY = 'busy'
+    DONE = 'done'
+
+
+class ClaimStore:
+    """ Lets several zotify processes sharing one archive split the work between them.
+
+    Before downloading, a worker claims the track in a SQLite database (WAL mode) next to the
+    song archive. A claim held by another live process means the track is being downloaded
+    there, a completed claim of another process that is still running means it was just
+    downloaded there. Claims are leases renewed by a background thread, so the claims of a
+    process that dies expire on their own, and so does its entry in the table of live owners.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._held: Set[str] = set()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS claims ('
+                         'key TEXT PRIMARY KEY, owner TEXT NOT NULL, done INTEGER NOT NULL, expires_at REAL NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+        self._db.execute('INSERT OR REPLACE INTO owners (owner, expires_at) VALUES (?, ?)',
+                         (self.owner, time.time() + LEASE_SECONDS))
+        self._renewer = threading.Thread(target=self._renew, name='claims', daemon=True)
+        self._renewer.start()
+
+    def claim(self, key: str) -> Claim:
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so the check and the insert are atomic across processes
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT owner, done, owner IN (SELECT owner FROM owners WHERE expires_at > ?) '
+                                       'FROM claims WHERE key = ? AND expires_at > ?', (now, key, now)).fetchone()
+                if row is not None and row[1]:
+                    # a download of an earlier run, or of this one, is up to the archive and .song_ids
+                    if row[0] != self.owner and row[2]:
+                        return Claim.DONE
+                elif row is not None and row[0] != self.owner:
+                    return Claim.BUSY
+                self._db.execute('INSERT OR REPLACE INTO claims (key, owner, done, expires_at) VALUES (?, ?, 0, ?)',
+                                 (key, self.owner, now + LEASE_SECONDS))
+                self._held.add(key)
+                return Claim.CLAIMED
+            finally:
+                self._db.execute('COMMIT')
+
+    def complete(self, key: str) -> None:
+        """ Marks a claimed download as finished """
+        with self._lock:
+            self._held.discard(key)
+            self._db.execute('UPDATE claims SET done = 1, expires_at = ? WHERE key = ? AND owner = ?',
+                             (time.time() + DONE_SECONDS, key, self.owner))
+
+    def release(self, key: str) -> None:
+        """ Gives up a claim without completing it, e.g. after a failed download """
+        with self._lock:
+            self._held.discard(key)
+            self._db.execute('DELETE FROM claims WHERE key = ? AND owner = ? AND done = 0', (key, self.owner))
+
+    def forget(self, keys: Iterable[str]) -> None:
+        """ Drops the completed claims of downloads that turned out to be broken, so they can be downloaded again """
+        with self._lock:
+            self._db.executemany('DELETE FROM claims WHERE key = ? AND done = 1', [(key,) for key in keys])
+
+    def _renew(self) -> None:
+        while not self._closed.wait(LEASE_SECONDS / 3):
+            with self._lock:
+                if self._closed.is_set():
+                    return
+                expires_at = time.time() + LEASE_SECONDS
+                self._db.executemany('UPDATE claims SET expires_at = ? WHERE key = ? AND owner = ? AND done = 0',
+                                     [(expires_at, key, self.owner) for key in self._held])
+                self._db.execute('UPDATE owners SET expires_at = ? WHERE owner = ?', (expires_at, self.owner))
+                self._db.execute('DELETE FROM claims WHERE expires_at < ?', (time.time(),))
+                self._db.execute('DELETE FROM owners WHERE expires_at < ?', (time.time(),))
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed.set()
+            # completed claims only matter to other processes while this one runs
+            self._db.execute('DELETE FROM claims WHERE owner = ?', (self.owner,))
+            self._db.execute('DELETE FROM owners WHERE owner = ?', (self.owner,))
+            self._held.clear()
+            self._db.close()
@@ -1,7 +1,9 @@
 import json
 import sys
 from pathlib import Path, PurePath
-from typing import Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from zotify.throttle import parse_size
 
 
 ROOT_PATH = 'ROOT_PATH'
@@ -34,41 +36,95 @@ MD_GENREDELIMITER = 'MD_GENREDELIMITER'
 PRINT_PROGRESS_INFO = 'PRINT_PROGRESS_INFO'
 PRINT_WARNINGS = 'PRINT_WARNINGS'
 RETRY_ATTEMPTS = 'RETRY_ATTEMPTS'
+API_CONCURRENCY = 'API_CONCURRENCY'
+API_RATE_LIMIT = 'API_RATE_LIMIT'
+METADATA_CACHE = 'METADATA_CACHE'
+METADATA_CACHE_LOCATION = 'METADATA_CACHE_LOCATION'
+METADATA_CACHE_SIZE = 'METADATA_CACHE_SIZE'
+METADATA_CACHE_TTL = 'METADATA_CACHE_TTL'
+HTTP_REVALIDATE = 'HTTP_REVALIDATE'
+DOWNLOAD_WORKERS = 'DOWNLOAD_WORKERS'
+DIRECT_DOWNLOAD_CONNECTIONS = 'DIRECT_DOWNLOAD_CONNECTIONS'
+DOWNLOAD_RATE_LIMIT = 'DOWNLOAD_RATE_LIMIT'
+DOWNLOAD_STREAM_RATE_LIMIT = 'DOWNLOAD_STREAM_RATE_LIMIT'
+LOG_FORMAT = 'LOG_FORMAT'
+ARCHIVE_CLAIMS = 'ARCHIVE_CLAIMS'
+CONTENT_STORE = 'CONTENT_STORE'
+CONTENT_STORE_LINK = 'CONTENT_STORE_LINK'
+FAILURE_QUEUE = 'FAILURE_QUEUE'
+RETRY_MAX_ATTEMPTS = 'RETRY_MAX_ATTEMPTS'
+RETRY_BACKOFF = 'RETRY_BACKOFF'
+JOB_JOURNAL = 'JOB_JOURNAL'
+SCHEDULER = 'SCHEDULER'
+SCHEDULER_PRIORITIES = 'SCHEDULER_PRIORITIES'
+FORMAT_ROOT_PATHS = 'FORMAT_ROOT_PATHS'
+HTTP_CONNECT_TIMEOUT = 'HTTP_CONNECT_TIMEOUT'
+HTTP_READ_TIMEOUT = 'HTTP_READ_TIMEOUT'
+STREAM_STALL_TIMEOUT = 'STREAM_STALL_TIMEOUT'
+TRACK_DEADLINE = 'TRACK_DEADLINE'
+LOG_FILE = 'LOG_FILE'
 CONFIG_VERSION = 'CONFIG_VERSION'
 DOWNLOAD_LYRICS = 'DOWNLOAD_LYRICS'
 
 CONFIG_VALUES = {
-    SAVE_CREDENTIALS:           { 'default': 'True',  'type': bool, 'arg': '--save-credentials'           },
-    CREDENTIALS_LOCATION:       { 'default': '',      'type': str,  'arg': '--credentials-location'       },
-    OUTPUT:                     { 'default': '',      'type': str,  'arg': '--output'                     },
-    SONG_ARCHIVE:               { 'default': '',      'type': str,  'arg': '--song-archive'               },
-    ROOT_PATH:                  { 'default': '',      'type': str,  'arg': '--root-path'                  },
-    ROOT_PODCAST_PATH:          { 'default': '',      'type': str,  'arg': '--root-podcast-path'          },
-    SPLIT_ALBUM_DISCS:          { 'default': 'False', 'type': bool, 'arg': '--split-album-discs'          },
-    DOWNLOAD_LYRICS:            { 'default': 'True',  'type': bool, 'arg': '--download-lyrics'            },
-    MD_SAVE_GENRES:             { 'default': 'False', 'type': bool, 'arg': '--md-save-genres'             },
-    MD_ALLGENRES:               { 'default': 'False', 'type': bool, 'arg': '--md-allgenres'               },
-    MD_GENREDELIMITER:          { 'default': ',',     'type': str,  'arg': '--md-genredelimiter'          },
-    DOWNLOAD_FORMAT:            { 'default': 'ogg',   'type': str,  'arg': '--download-format'            },
-    DOWNLOAD_QUALITY:           { 'default': 'auto',  'type': str,  'arg': '--download-quality'           },
-    TRANSCODE_BITRATE:          { 'default': 'auto',  'type': str,  'arg': '--transcode-bitrate'          },
-    SKIP_EXISTING:              { 'default': 'True',  'type': bool, 'arg': '--skip-existing'              },
-    SKIP_PREVIOUSLY_DOWNLOADED: { 'default': 'False', 'type': bool, 'arg': '--skip-previously-downloaded' },
-    RETRY_ATTEMPTS:             { 'default': '1',     'type': int,  'arg': '--retry-attempts'             },
-    BULK_WAIT_TIME:             { 'default': '1',     'type': int,  'arg': '--bulk-wait-time'             },
-    OVERRIDE_AUTO_WAIT:         { 'default': 'False', 'type': bool, 'arg': '--override-auto-wait'         },
-    CHUNK_SIZE:                 { 'default': '20000', 'type': int,  'arg': '--chunk-size'                 },
-    DOWNLOAD_REAL_TIME:         { 'default': 'False', 'type': bool, 'arg': '--download-real-time'         },
-    LANGUAGE:                   { 'default': 'en',    'type': str,  'arg': '--language'                   },
-    PRINT_SPLASH:               { 'default': 'False', 'type': bool, 'arg': '--print-splash'               },
-    PRINT_SKIPS:                { 'default': 'True',  'type': bool, 'arg': '--print-skips'                },
-    PRINT_DOWNLOAD_PROGRESS:    { 'default': 'True',  'type': bool, 'arg': '--print-download-progress'    },
-    PRINT_ERRORS:               { 'default': 'True',  'type': bool, 'arg': '--print-errors'               },
-    PRINT_DOWNLOADS:            { 'default': 'False', 'type': bool, 'arg': '--print-downloads'            },
-    PRINT_API_ERRORS:           { 'default': 'True',  'type': bool, 'arg': '--print-api-errors'           },
-    PRINT_PROGRESS_INFO:        { 'default': 'True',  'type': bool, 'arg': '--print-progress-info'        },
-    PRINT_WARNINGS:             { 'default': 'True',  'type': bool, 'arg': '--print-warnings'             },
-    TEMP_DOWNLOAD_DIR:          { 'default': '',      'type': str,  'arg': '--temp-download-dir'          }
+    SAVE_CREDENTIALS:            { 'default': 'True',     'type': bool, 'arg': '--save-credentials'            },
+    CREDENTIALS_LOCATION:        { 'default': '',         'type': str,  'arg': '--credentials-location'        },
+    OUTPUT:                      { 'default': '',         'type': str,  'arg': '--output'                      },
+    SONG_ARCHIVE:                { 'default': '',         'type': str,  'arg': '--song-archive'                },
+    ROOT_PATH:                   { 'default': '',         'type': str,  'arg': '--root-path'                   },
+    ROOT_PODCAST_PATH:           { 'default': '',         'type': str,  'arg': '--root-podcast-path'           },
+    SPLIT_ALBUM_DISCS:           { 'default': 'False',    'type': bool, 'arg': '--split-album-discs'           },
+    DOWNLOAD_LYRICS:             { 'default': 'True',     'type': bool, 'arg': '--download-lyrics'             },
+    MD_SAVE_GENRES:              { 'default': 'False',    'type': bool, 'arg': '--md-save-genres'              },
+    MD_ALLGENRES:                { 'default': 'False',    'type': bool, 'arg': '--md-allgenres'                },
+    MD_GENREDELIMITER:           { 'default': ',',        'type': str,  'arg': '--md-genredelimiter'           },
+    DOWNLOAD_FORMAT:             { 'default': 'ogg',      'type': str,  'arg': '--download-format'             },
+    FORMAT_ROOT_PATHS:           { 'default': '',         'type': str,  'arg': '--format-root-paths'           },
+    DOWNLOAD_QUALITY:            { 'default': 'auto',     'type': str,  'arg': '--download-quality'            },
+    TRANSCODE_BITRATE:           { 'default': 'auto',     'type': str,  'arg': '--transcode-bitrate'           },
+    SKIP_EXISTING:               { 'default': 'True',     'type': bool, 'arg': '--skip-existing'               },
+    SKIP_PREVIOUSLY_DOWNLOADED:  { 'default': 'False',    'type': bool, 'arg': '--skip-previously-downloaded'  },
+    ARCHIVE_CLAIMS:              { 'default': 'False',    'type': bool, 'arg': '--archive-claims'              },
+    CONTENT_STORE:               { 'default': '',         'type': str,  'arg': '--content-store'               },
+    CONTENT_STORE_LINK:          { 'default': 'hardlink', 'type': str,  'arg': '--content-store-link'          },
+    RETRY_ATTEMPTS:              { 'default': '1',        'type': int,  'arg': '--retry-attempts'              },
+    FAILURE_QUEUE:               { 'default': 'False',    'type': bool, 'arg': '--failure-queue'               },
+    RETRY_MAX_ATTEMPTS:          { 'default': '5',        'type': int,  'arg': '--retry-max-attempts'          },
+    RETRY_BACKOFF:               { 'default': '30',       'type': int,  'arg': '--retry-backoff'               },
+    JOB_JOURNAL:                 { 'default': 'False',    'type': bool, 'arg': '--job-journal'                 },
+    API_CONCURRENCY:             { 'default': '4',        'type': int,  'arg': '--api-concurrency'             },
+    API_RATE_LIMIT:              { 'default': '0',        'type': int,  'arg': '--api-rate-limit'              },
+    HTTP_CONNECT_TIMEOUT:        { 'default': '10',       'type': int,  'arg': '--http-connect-timeout'        },
+    HTTP_READ_TIMEOUT:           { 'default': '30',       'type': int,  'arg': '--http-read-timeout'           },
+    METADATA_CACHE:              { 'default': 'False',    'type': bool, 'arg': '--metadata-cache'              },
+    METADATA_CACHE_LOCATION:     { 'default': '',         'type': str,  'arg': '--metadata-cache-location'     },
+    METADATA_CACHE_SIZE:         { 'default': '100000',   'type': int,  'arg': '--metadata-cache-size'         },
+    METADATA_CACHE_TTL:          { 'default': '',         'type': str,  'arg': '--metadata-cache-ttl'          },
+    HTTP_REVALIDATE:             { 'default': 'False',    'type': bool, 'arg': '--http-revalidate'             },
+    BULK_WAIT_TIME:              { 'default': '1',        'type': int,  'arg': '--bulk-wait-time'              },
+    OVERRIDE_AUTO_WAIT:          { 'default': 'False',    'type': bool, 'arg': '--override-auto-wait'          },
+    CHUNK_SIZE:                  { 'default': '20000',    'type': int,  'arg': '--chunk-size'                  },
+    DOWNLOAD_REAL_TIME:          { 'default': 'False',    'type': bool, 'arg': '--download-real-time'          },
+    DOWNLOAD_WORKERS:            { 'default': '1',        'type': int,  'arg': '--download-workers'            },
+    SCHEDULER:                   { 'default': 'fifo',     'type': str,  'arg': '--scheduler'                   },
+    SCHEDULER_PRIORITIES:        { 'default': '',         'type': str,  'arg': '--scheduler-priorities'        },
+    DOWNLOAD_RATE_LIMIT:         { 'default': '0',        'type': str,  'arg': '--download-rate-limit'         },
+    DOWNLOAD_STREAM_RATE_LIMIT:  { 'default': '0',        'type': str,  'arg': '--download-stream-rate-limit'  },
+    STREAM_STALL_TIMEOUT:        { 'default': '60',       'type': int,  'arg': '--stream-stall-timeout'        },
+    TRACK_DEADLINE:              { 'default': '0',        'type': int,  'arg': '--track-deadline'              },
+    DIRECT_DOWNLOAD_CONNECTIONS: { 'default': '4',        'type': int,  'arg': '--direct-download-connections' },
+    LANGUAGE:                    { 'default': 'en',       'type': str,  'arg': '--language'                    },
+    PRINT_SPLASH:                { 'default': 'False',    'type': bool, 'arg': '--print-splash'                },
+    PRINT_SKIPS:                 { 'default': 'True',     'type': bool, 'arg': '--print-skips'                 },
+    PRINT_DOWNLOAD_PROGRESS:     { 'default': 'True',     'type': bool, 'arg': '--print-download-progress'     },
+    PRINT_ERRORS:                { 'default': 'True',     'type': bool, 'arg': '--print-errors'                },
+    PRINT_DOWNLOADS:             { 'default': 'False',    'type': bool, 'arg': '--print-downloads'             },
+    PRINT_API_ERRORS:            { 'default': 'True',     'type': bool, 'arg': '--print-api-errors'            },
+    PRINT_PROGRESS_INFO:         { 'default': 'True',     'type': bool, 'arg': '--print-progress-info'         },
+    PRINT_WARNINGS:              { 'default': 'True',     'type': bool, 'arg': '--print-warnings'              },
+    LOG_FORMAT:                  { 'default': 'text',     'type': str,  'arg': '--log-format'                  },
+    LOG_FILE:                    { 'default': '',         'type': str,  'arg': '--log-file'                    },
+    TEMP_DOWNLOAD_DIR:           { 'default': '',         'type': str,  'arg': '--temp-download-dir'           }
 }
 
 OUTPUT_DEFAULT_PLAYLIST = '{playlist}/{artist} - {song_name}.{ext}'
@@ -80,6 +136,26 @@ OUTPUT_DEFAULT_ALBUM = '{artist}/{album}/{album_num} - {artist} - {song_name}.{e
 
 class Config:
     Values = {}
+    # directories already created by this process, so the getters below don't mkdir on every call
+    _created_dirs = set()
+    # values derived from an option, kept as (option value, derived value)
+    _derived = {}
+
+    @classmethod
+    def _ensure_dir(cls, path: PurePath) -> None:
+        if path not in cls._created_dirs:
+            Path(path).mkdir(parents=True, exist_ok=True)
+            cls._created_dirs.add(path)
+
+    @classmethod
+    def _derive(cls, key: str, derive: Callable[[Any], Any]) -> Any:
+        """ Returns derive(option), computed again only when the option changes """
+        value = cls.get(key)
+        cached = cls._derived.get(key)
+        if cached is None or cached[0] != value:
+            cached = (value, derive(value))
+            cls._derived[key] = cached
+        return cached[1]
 
     @classmethod
     def load(cls, args) -> None:
@@ -153,20 +229,22 @@ class Config:
 
     @classmethod
     def get_root_path(cls) -> str:
-        if cls.get(ROOT_PATH) == '':
-            root_path = PurePath(Path.home() / 'Music/Zotify Music/')
-        else:
-            root_path = PurePath(Path(cls.get(ROOT_PATH)).expanduser())
-        Path(root_path).mkdir(parents=True, exist_ok=True)
+        def derive(value):
+            if value == '':
+                return PurePath(Path.home() / 'Music/Zotify Music/')
+            return PurePath(Path(value).expanduser())
+        root_path = cls._derive(ROOT_PATH, derive)
+        cls._ensure_dir(root_path)
         return root_path
 
     @classmethod
     def get_root_podcast_path(cls) -> str:
-        if cls.get(ROOT_PODCAST_PATH) == '':
-            root_podcast_path = PurePath(Path.home() / 'Music/Zotify Podcasts/')
-        else:
-            root_podcast_path = PurePath(Path(cls.get(ROOT_PODCAST_PATH)).expanduser())
-        Path(root_podcast_path).mkdir(parents=True, exist_ok=True)
+        def derive(value):
+            if value == '':
+                return PurePath(Path.home() / 'Music/Zotify Podcasts/')
+            return PurePath(Path(value).expanduser())
+        root_podcast_path = cls._derive(ROOT_PODCAST_PATH, derive)
+        cls._ensure_dir(root_podcast_path)
         return root_podcast_path
 
     @classmethod
@@ -191,7 +269,15 @@ class Config:
 
     @classmethod
     def get_download_format(cls) -> str:
-        return cls.get(DOWNLOAD_FORMAT)
+        """ The first format of DOWNLOAD_FORMAT, the one checked by the skip logic and kept in the content store """
+        return cls.get_download_formats()[0]
+
+    @classmethod
+    def get_download_formats(cls) -> List[str]:
+        def derive(value):
+            formats = [download_format.strip().lower() for download_format in value.split(',') if download_format.strip()]
+            return formats or ['ogg']
+        return cls._derive(DOWNLOAD_FORMAT, derive)
 
     @classmethod
     def get_download_lyrics(cls) -> bool:
@@ -231,7 +317,7 @@ class Config:
                 song_archive = PurePath(system_paths[sys.platform] / '.song_archive')
         else:
             song_archive = PurePath(Path(cls.get(SONG_ARCHIVE)).expanduser())
-        Path(song_archive.parent).mkdir(parents=True, exist_ok=True)
+        cls._ensure_dir(song_archive.parent)
         return song_archive
 
     @classmethod
@@ -252,7 +338,7 @@ class Config:
                 credentials_location = PurePath(system_paths[sys.platform] / 'credentials.json')
         else:
             credentials_location = PurePath(Path.cwd()).joinpath(cls.get(CREDENTIALS_LOCATION))
-        Path(credentials_location.parent).mkdir(parents=True, exist_ok=True)
+        cls._ensure_dir(credentials_location.parent)
         return credentials_location
 
     @classmethod
@@ -308,3 +394,147 @@ class Config:
     @classmethod
     def get_retry_attempts(cls) -> int:
         return cls.get(RETRY_ATTEMPTS)
+
+    @classmethod
+    def get_api_concurrency(cls) -> int:
+        return max(1, cls.get(API_CONCURRENCY))
+
+    @classmethod
+    def get_api_rate_limit(cls) -> int:
+        return cls.get(API_RATE_LIMIT)
+
+    @classmethod
+    def get_metadata_cache(cls) -> bool:
+        return cls.get(METADATA_CACHE)
+
+    @classmethod
+    def get_metadata_cache_location(cls) -> str:
+        if cls.get(METADATA_CACHE_LOCATION) == '':
+            system_paths = {
+                'win32': Path.home() / 'AppData/Roaming/Zotify',
+                'linux': Path.home() / '.local/share/zotify',
+                'darwin': Path.home() / 'Library/Application Support/Zotify'
+            }
+            if sys.platform not in system_paths:
+                cache_location = PurePath(Path.cwd() / '.zotify/metadata_cache.db')
+            else:
+                cache_location = PurePath(system_paths[sys.platform] / 'metadata_cache.db')
+        else:
+            cache_location = PurePath(Path(cls.get(METADATA_CACHE_LOCATION)).expanduser())
+        cls._ensure_dir(cache_location.parent)
+        return cache_location
+
+    @classmethod
+    def get_metadata_cache_size(cls) -> int:
+        return cls.get(METADATA_CACHE_SIZE)
+
+    @classmethod
+    def get_metadata_cache_ttl(cls) -> str:
+        return cls.get(METADATA_CACHE_TTL)
+
+    @classmethod
+    def get_http_revalidate(cls) -> bool:
+        return cls.get(HTTP_REVALIDATE)
+
+    @classmethod
+    def get_download_rate_limit(cls) -> int:
+        return parse_size(cls.get(DOWNLOAD_RATE_LIMIT))
+
+    @classmethod
+    def get_download_stream_rate_limit(cls) -> int:
+        return parse_size(cls.get(DOWNLOAD_STREAM_RATE_LIMIT))
+
+    @classmethod
+    def get_download_workers(cls) -> int:
+        return max(1, cls.get(DOWNLOAD_WORKERS))
+
+    @classmethod
+    def get_direct_download_connections(cls) -> int:
+        return max(1, cls.get(DIRECT_DOWNLOAD_CONNECTIONS))
+
+    @classmethod
+    def get_log_format(cls) -> str:
+        return cls.get(LOG_FORMAT).lower()
+
+    @classmethod
+    def get_log_file(cls) -> str:
+        if cls.get(LOG_FILE) == '':
+            return ''
+        return str(Path(cls.get(LOG_FILE)).expanduser())
+
+    @classmethod
+    def get_archive_claims(cls) -> bool:
+        return cls.get(ARCHIVE_CLAIMS)
+
+    @classmethod
+    def get_archive_claims_location(cls) -> str:
+        # next to the song archive, so every process sharing the archive sees the same claims
+        return PurePath(cls.get_song_archive()).parent / '.song_claims.db'
+
+    @classmethod
+    def get_content_store(cls) -> str:
+        if cls.get(CONTENT_STORE) == '':
+            return ''
+        return PurePath(Path(cls.get(CONTENT_STORE)).expanduser())
+
+    @classmethod
+    def get_content_store_link(cls) -> str:
+        return cls.get(CONTENT_STORE_LINK).lower()
+
+    @classmethod
+    def get_failure_queue(cls) -> bool:
+        return cls.get(FAILURE_QUEUE)
+
+    @classmethod
+    def get_failure_queue_location(cls) -> str:
+        return PurePath(cls.get_song_archive()).parent / '.failed_downloads.db'
+
+    @classmethod
+    def get_retry_max_attempts(cls) -> int:
+        return max(1, cls.get(RETRY_MAX_ATTEMPTS))
+
+    @classmethod
+    def get_retry_backoff(cls) -> int:
+        return max(0, cls.get(RETRY_BACKOFF))
+
+    @classmethod
+    def get_job_journal(cls) -> bool:
+        return cls.get(JOB_JOURNAL)
+
+    @classmethod
+    def get_job_journal_location(cls) -> PurePath:
+        return PurePath(cls.get_song_archive()).parent / '.journal'
+
+    @classmethod
+    def get_scheduler(cls) -> str:
+        return cls.get(SCHEDULER).lower()
+
+    @classmethod
+    def get_scheduler_priorities(cls) -> str:
+        return cls.get(SCHEDULER_PRIORITIES)
+
+    @classmethod
+    def get_format_root_paths(cls) -> Dict[str, PurePath]:
+        """ Root paths of the additional DOWNLOAD_FORMATs, 'format=path,...' """
+        def derive(value):
+            root_paths = {}
+            for part in value.split(','):
+                if '=' not in part:
+                    continue
+                download_format, path = part.split('=', 1)
+                root_paths[download_format.strip().lower()] = PurePath(Path(path.strip()).expanduser())
+            return root_paths
+        return cls._derive(FORMAT_ROOT_PATHS, derive)
+
+    @classmethod
+    def get_http_timeout(cls) -> Tuple[Optional[int], Optional[int]]:
+        """ (connect, read) timeout of HTTP requests in seconds, 0 waits forever """
+        return cls.get(HTTP_CONNECT_TIMEOUT) or None, cls.get(HTTP_READ_TIMEOUT) or None
+
+    @classmethod
+    def get_stream_stall_timeout(cls) -> int:
+        return cls.get(STREAM_STALL_TIMEOUT)
+
+    @classmethod
+    def get_track_deadline(cls) -> int:
+        return cls.get(TRACK_DEADLINE)
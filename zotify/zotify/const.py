@@ -50,6 +50,8 @@ LIMIT = 'limit'
 
 OFFSET = 'offset'
 
+TOTAL = 'total'
+
 AUTHORIZATION = 'Authorization'
 
 IS_PLAYABLE = 'is_playable'
@@ -62,6 +64,10 @@ DISC_NUMBER = 'disc_number'
 
 SHOW = 'show'
 
+EPISODE = 'episode'
+
+EPISODES = 'episodes'
+
 ERROR = 'error'
 
 EXPLICIT = 'explicit'
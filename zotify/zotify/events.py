@@ -0,0 +1,53 @@
+import json
+import sys
+import threading
+import time
+from typing import Any
+
+
+# buffered events reach the log at most this many seconds late
+FLUSH_INTERVAL = 1.0
+BUFFER_SIZE = 64 * 1024
+
+
+class EventLog:
+    """ Writes one JSON object per line for every event of a run.
+
+    Lines are written into a large buffer under a lock, so workers can log from any thread
+    without waiting on the terminal or disk. The buffer is flushed when it is full and at the
+    latest FLUSH_INTERVAL seconds after an event, so the log can still be followed as a stream.
+    """
+
+    def __init__(self, path: str = ''):
+        # without a path the events replace the normal output on stdout
+        self.to_stdout = not path
+        if self.to_stdout:
+            self._file = open(sys.stdout.fileno(), 'w', buffering=BUFFER_SIZE, encoding='utf-8', closefd=False)
+        else:
+            self._file = open(path, 'a', buffering=BUFFER_SIZE, encoding='utf-8')
+        self._lock = threading.Lock()
+        self._flush_pending = False
+
+    def emit(self, event: str, **fields: Any) -> None:
+        record = {'time': round(time.time(), 3), 'event': event}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            if not self._flush_pending:
+                self._flush_pending = True
+                timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                timer.daemon = True
+                timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_pending = False
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._file.close()
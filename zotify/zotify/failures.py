@@ -0,0 +1,91 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+# the wait before the n-th retry of a download is RETRY_BACKOFF * 2 ** (n - 1), at most this long
+MAX_BACKOFF_SECONDS = 60 * 60
+
+
+class FailureQueue:
+    """ Keeps the downloads that failed, so they can be retried without listing anything again.
+
+    Every failure stores the arguments needed to repeat the download, the class and message of
+    the error and the number of attempts so far. A download that succeeds (or turns out to need
+    nothing, e.g. because the file exists by now) is removed from the queue. Entries that failed
+    `max_attempts` times are quarantined and left out of further retries.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 5, backoff: float = 30):
+        self.path = str(path)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS failures ('
+                         'kind TEXT NOT NULL, id TEXT NOT NULL, context TEXT NOT NULL, error_class TEXT NOT NULL, '
+                         'error TEXT NOT NULL, attempts INTEGER NOT NULL, failed_at REAL NOT NULL, '
+                         'retry_at REAL NOT NULL, quarantined INTEGER NOT NULL, PRIMARY KEY (kind, id))')
+        # resolve() runs after every download, this keeps it from writing to the database each time
+        self._queued = set(self._db.execute('SELECT kind, id FROM failures').fetchall())
+
+    def record(self, kind: str, entity_id: str, context: Dict[str, Any], error: BaseException) -> bool:
+        """ Adds a failure or counts another attempt of a queued one, True if the entry got quarantined """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT attempts FROM failures WHERE kind = ? AND id = ?',
+                                       (kind, entity_id)).fetchone()
+                attempts = row[0] + 1 if row is not None else 1
+                quarantined = attempts >= self.max_attempts
+                retry_at = now + min(self.backoff * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+                self._db.execute('INSERT OR REPLACE INTO failures (kind, id, context, error_class, error, attempts, '
+                                 'failed_at, retry_at, quarantined) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 (kind, entity_id, json.dumps(context, default=str), type(error).__name__, str(error),
+                                  attempts, now, retry_at, int(quarantined)))
+                self._queued.add((kind, entity_id))
+                return quarantined
+            finally:
+                self._db.execute('COMMIT')
+
+    def resolve(self, kind: str, entity_id: str) -> None:
+        """ Removes an entry that is not failing anymore, quarantined or not """
+        with self._lock:
+            if (kind, entity_id) not in self._queued:
+                return
+            self._queued.discard((kind, entity_id))
+            self._db.execute('DELETE FROM failures WHERE kind = ? AND id = ?', (kind, entity_id))
+
+    def pending(self, due_only: bool = True) -> List[Dict[str, Any]]:
+        """ The entries that are not quarantined, with `due_only` just those whose backoff is over """
+        query = 'SELECT kind, id, context, attempts, retry_at FROM failures WHERE quarantined = 0'
+        params = ()
+        if due_only:
+            query += ' AND retry_at <= ?'
+            params = (time.time(),)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY failed_at', params).fetchall()
+        return [{'kind': kind, 'id': entity_id, 'context': json.loads(context), 'attempts': attempts, 'retry_at': retry_at}
+                for kind, entity_id, context, attempts, retry_at in rows]
+
+    def next_retry(self) -> Optional[float]:
+        """ When the next entry is due, None if nothing is left to retry """
+        with self._lock:
+            row = self._db.execute('SELECT MIN(retry_at) FROM failures WHERE quarantined = 0').fetchone()
+        return row[0]
+
+    def quarantined(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute('SELECT kind, id, error_class, error, attempts FROM failures '
+                                    'WHERE quarantined = 1 ORDER BY failed_at').fetchall()
+        return [{'kind': kind, 'id': entity_id, 'error_class': error_class, 'error': error, 'attempts': attempts}
+                for kind, entity_id, error_class, error, attempts in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,80 @@
+import json
+import os
+from pathlib import Path, PurePath
+from typing import Dict, Iterator, List
+
+from zotify.utils import parse_spotify_input
+
+
+# entries read (and grouped by kind) before they are downloaded and the progress is saved
+WINDOW_SIZE = 500
+INVALID = 'invalid'
+
+
+class DownloadFile:
+    """ Streams the Spotify ids of a --download file without reading it into memory.
+
+    Lines are parsed with a single regex into (kind, id) pairs, duplicates anywhere in the file
+    are dropped and ids are handed out in windows grouped by kind, so tracks and episodes can be
+    looked up in batches. Once a window is done, the offset behind it is saved next to the file
+    and a restarted run continues from there.
+    """
+
+    def __init__(self, path: PurePath, checkpoint: bool = True):
+        self.path = Path(path)
+        self.checkpoint_path = self.path.with_name(self.path.name + '.progress')
+        self.checkpoint = checkpoint
+        # offset of the first line not downloaded yet
+        self.start = self._load_checkpoint()
+
+    def windows(self) -> Iterator[Dict[str, List[str]]]:
+        """ Yields {kind: [id, ...]}, unparseable lines are listed under INVALID """
+        seen = set()
+        window: Dict[str, List[str]] = {}
+        size = 0
+        offset = 0
+        with open(self.path, 'rb') as file:
+            for raw in file:
+                offset += len(raw)
+                line = raw.decode('utf-8', errors='replace').strip()
+                if not line or line.startswith('#'):
+                    continue
+                entry = parse_spotify_input(line)
+                if entry in seen:
+                    continue
+                if entry is not None:
+                    # lines before the checkpoint still count for deduplication
+                    seen.add(entry)
+                if offset <= self.start:
+                    continue
+
+                kind, entry_id = entry if entry is not None else (INVALID, line)
+                window.setdefault(kind, []).append(entry_id)
+                size += 1
+                if size == WINDOW_SIZE:
+                    yield window
+                    self._save_checkpoint(offset)
+                    window, size = {}, 0
+        if window:
+            yield window
+        if self.checkpoint:
+            self.checkpoint_path.unlink(missing_ok=True)
+
+    def _load_checkpoint(self) -> int:
+        if not self.checkpoint or not self.checkpoint_path.is_file():
+            return 0
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as file:
+                offset = int(json.load(file)['offset'])
+        except (ValueError, KeyError, TypeError):
+            return 0
+        # a file that got shorter was replaced, not appended to
+        return offset if offset <= self.path.stat().st_size else 0
+
+    def _save_checkpoint(self, offset: int) -> None:
+        if not self.checkpoint:
+            return
+        temp_path = self.checkpoint_path.with_name(self.checkpoint_path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'offset': offset}, file)
+        os.replace(temp_path, self.checkpoint_path)
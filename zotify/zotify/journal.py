@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path, PurePath
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, a journal is then not protected against a second run of the same job
+    fcntl = None
+
+
+# completions are written out in batches, a crash repeats at most this many finished jobs
+FLUSH_EVERY = 50
+BUFFER_SIZE = 64 * 1024
+# a journal left alone for longer than this is discarded, the work list is listed again instead
+MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
+
+class JobJournal:
+    """ Records the work list of a long run and which of its jobs are finished.
+
+    The journal is a JSON-lines file with one {"job": ...} line per listed job, a {"listed": n}
+    line once the listing is complete and a {"done": i} line for every finished job. A run that
+    finds a journal left behind takes its jobs from there instead of listing them again and
+    skips the finished ones. A listing that was interrupted is continued with the jobs the
+    journal doesn't hold yet, told apart by `key`, so jobs that were added to the front of the
+    listing in the meantime (e.g. newly liked songs) are still found. The journal is removed once
+    a run got through the whole work list, failed jobs are left to the failure queue, and it is
+    ignored once it is older than `max_age` seconds.
+    """
+
+    def __init__(self, path: PurePath, key: Callable[[Dict[str, Any]], str] = None,
+                 max_age: float = MAX_AGE_SECONDS):
+        self.path = Path(path)
+        self.key = key if key is not None else lambda job: json.dumps(job, sort_keys=True, default=str)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.jobs: List[Dict[str, Any]] = []
+        self.done: Set[int] = set()
+        self.listed = False
+        # number of jobs in the work list, once it is complete
+        self.count = 0
+        # set if a journal was found but too old to continue
+        self.expired = False
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self._file = open(self.path, 'a+', buffering=BUFFER_SIZE, encoding='utf-8')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._file.close()
+                raise
+        stat = os.fstat(self._file.fileno())
+        if stat.st_size > 0 and time.time() - stat.st_mtime > max_age:
+            self.expired = True
+            self._file.truncate(0)
+        self._load()
+
+    def _load(self) -> None:
+        self._file.seek(0)
+        for line in self._file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a journal whose process was killed mid-write
+                continue
+            if 'job' in record:
+                self.jobs.append(record['job'])
+            elif 'done' in record:
+                self.done.add(record['done'])
+            elif 'listed' in record:
+                self.listed = True
+                self.count = record['listed']
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.jobs)
+
+    def entries(self, listing: Iterable[Dict[str, Any]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """ Yields (index, job) for every job that is not finished.
+
+        `listing` is only iterated if the journal doesn't hold the complete work list yet, jobs it
+        yields are journaled before they are handed out.
+        """
+        for index, job in enumerate(list(self.jobs)):
+            if index not in self.done:
+                yield index, job
+        if self.listed:
+            return
+
+        known = {self.key(job) for job in self.jobs}
+        for job in listing:
+            key = self.key(job)
+            # listed in an earlier run, already handed out above
+            if key in known:
+                continue
+            known.add(key)
+            index = len(self.jobs)
+            self.jobs.append(job)
+            self._write({'job': job}, flush=False)
+            yield index, job
+        self.count = len(self.jobs)
+        self._write({'listed': self.count}, flush=True)
+        self.listed = True
+
+    def complete(self, index: int) -> None:
+        """ Marks a job as finished """
+        with self._lock:
+            self.done.add(index)
+        self._write({'done': index}, flush=False)
+
+    def _write(self, record: Dict[str, Any], flush: bool) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._unflushed += 1
+            if flush or self._unflushed >= FLUSH_EVERY:
+                self._file.flush()
+                self._unflushed = 0
+
+    def close(self, finished: bool = False) -> None:
+        """ Flushes the journal, and deletes it if every job is done or the run `finished` the
+        complete work list. Only an interrupted run is continued, the next run lists again """
+        with self._lock:
+            if self._file.closed:
+                return
+            if self.listed and (finished or len(self.done) >= self.count):
+                self.path.unlink(missing_ok=True)
+            self._file.close()
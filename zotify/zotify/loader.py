@@ -2,17 +2,15 @@
 # https://stackoverflow.com/questions/22029562/python-how-to-make-simple-animated-loading-while-process-is-running
 
 # imports
-from itertools import cycle
-from shutil import get_terminal_size
-from threading import Thread
-from time import sleep
-
 from zotify.termoutput import Printer
+from zotify.zotify import Zotify
 
 
 class Loader:
     """Busy symbol.
 
+    Loaders don't run threads of their own, they are animated by the shared Printer.RENDERER.
+
     Can be called inside a context:
 
     with Loader("This take some Time..."):
@@ -26,14 +24,13 @@ class Loader:
         Args:
             desc (str, optional): The loader's description. Defaults to "Loading...".
             end (str, optional): Final print. Defaults to "".
-            timeout (float, optional): Sleep time between prints. Defaults to 0.1.
+            timeout (float, optional): Time between two animation steps. Defaults to 0.1.
         """
         self.desc = desc
         self.end = end
         self.timeout = timeout
         self.channel = chan
 
-        self._thread = Thread(target=self._animate, daemon=True)
         if mode == 'std1':
             self.steps = ["⢿", "⣻", "⣽", "⣾", "⣷", "⣯", "⣟", "⡿"]
         elif mode == 'std2':
@@ -46,26 +43,28 @@ class Loader:
         self.done = False
 
     def start(self):
-        self._thread.start()
+        if Zotify.CONFIG.get(self.channel.value) and Printer.shows_progress():
+            Printer.RENDERER.add(self)
         return self
 
-    def _animate(self):
-        for c in cycle(self.steps):
-            if self.done:
-                break
-            Printer.print_loader(self.channel, f"\r\t{c} {self.desc} ")
-            sleep(self.timeout)
+    def render(self, now, width):
+        return f"\t{self.steps[int(now / self.timeout) % len(self.steps)]} {self.desc} "
+
+    def summary(self, now):
+        # only progress bars are reported when the output is not a terminal
+        return None
 
     def __enter__(self):
         self.start()
 
     def stop(self):
+        if self.done:
+            return
         self.done = True
-        cols = get_terminal_size((80, 20)).columns
-        Printer.print_loader(self.channel, "\r" + " " * cols)
+        Printer.RENDERER.remove(self)
 
         if self.end != "":
-            Printer.print_loader(self.channel, f"\r{self.end}")
+            Printer.print(self.channel, self.end)
 
     def __exit__(self, exc_type, exc_value, tb):
         # handle exceptions with those variables ^
@@ -0,0 +1,85 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Optional
+
+from zotify.throttle import StreamThrottle
+
+
+class _PacedStream:
+    __slots__ = ('total_size', 'duration', 'throttle', 'start', 'downloaded', 'turn')
+
+    def __init__(self, total_size, duration, throttle):
+        self.total_size = total_size
+        self.duration = duration
+        self.throttle = throttle
+        self.start = time.monotonic()
+        self.downloaded = 0
+        # set by the scheduler once the next chunk is due
+        self.turn = threading.Event()
+
+
+class RealTimePacer:
+    """ Paces any number of streams to the playback speed of their content.
+
+    Instead of every download sleeping in its own read loop, a single scheduler thread keeps
+    all paced streams in a queue ordered by the time their next chunk is due and wakes the
+    stream when the time has come. The chunk itself is read by the thread downloading the
+    stream, so a slow or stalled stream never holds up the others. Many streams can therefore
+    be downloaded in parallel while each of them still progresses like normal playback.
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def pace(self, read_chunk: Callable[[], Optional[int]], total_size: int, duration: float,
+             throttle: Optional[StreamThrottle] = None) -> None:
+        """ Reads a stream at real time, blocking until it is complete.
+
+        `read_chunk` reads and stores the next chunk and returns its size, or None once the
+        stream is exhausted. `duration` is the playback time of the whole stream in seconds.
+        """
+        stream = _PacedStream(max(total_size, 1), duration, throttle)
+        due = stream.start
+        while True:
+            self._wait_turn(stream, due)
+            size = read_chunk()
+            if size is None:
+                return
+            stream.downloaded += size
+            due = stream.start + (stream.downloaded / stream.total_size) * stream.duration
+            if stream.throttle is not None:
+                due = max(due, time.monotonic() + stream.throttle.reserve(size))
+
+    def _wait_turn(self, stream: _PacedStream, due: float) -> None:
+        if due <= time.monotonic():
+            return
+        stream.turn.clear()
+        self._schedule(stream, due)
+        stream.turn.wait()
+
+    def _schedule(self, stream: _PacedStream, due: float) -> None:
+        with self._condition:
+            heapq.heappush(self._queue, (due, next(self._counter), stream))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='realtime-pacer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                due, _, stream = self._queue[0]
+                now = time.monotonic()
+                if due > now:
+                    # a newly scheduled stream may be due earlier, so wait on the condition
+                    self._condition.wait(due - now)
+                    continue
+                heapq.heappop(self._queue)
+            stream.turn.set()
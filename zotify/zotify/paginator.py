@@ -0,0 +1,67 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, Optional
+
+from zotify.const import ITEMS, TOTAL
+from zotify.zotify import Zotify
+
+
+class Paginator:
+    """ Lazily iterates over the items of an offset/limit paged endpoint.
+
+    The first page is requested on demand. Once it reports the total number of items all
+    remaining offsets are known, so the following pages are fetched concurrently (under the
+    global API rate limit) while earlier ones are consumed, and are yielded in order.
+    Only a bounded window of pages is held in memory at any time.
+    """
+
+    def __init__(self, url: str, limit: int = 50, prefetch: Optional[int] = None, **params):
+        self.url = url
+        self.limit = limit
+        self.workers = Zotify.CONFIG.get_api_concurrency()
+        self.prefetch = max(1, prefetch if prefetch is not None else 2 * self.workers)
+        self.params = params
+        self._first_page = None
+
+    def _fetch(self, offset: int) -> Any:
+        return Zotify.invoke_url_with_params(self.url, limit=self.limit, offset=offset, **self.params)
+
+    def first_page(self) -> Any:
+        if self._first_page is None:
+            self._first_page = self._fetch(0)
+        return self._first_page
+
+    def __len__(self) -> int:
+        """ Returns the total number of items as reported by the first page """
+        page = self.first_page()
+        return page.get(TOTAL) or len(page[ITEMS])
+
+    def __iter__(self) -> Iterator[Any]:
+        page = self.first_page()
+        # the first page is only kept around until iteration starts
+        self._first_page = None
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        pending = deque()
+        next_offset = self.limit
+        try:
+            while True:
+                items = page[ITEMS]
+                total = page.get(TOTAL)
+                if len(items) < self.limit:
+                    # a short page is always the last one
+                    total = 0
+
+                # without a reported total only the next page is known to be worth requesting
+                depth = self.prefetch if total is not None else 1
+                while len(pending) < depth and (total is None or next_offset < total):
+                    pending.append(executor.submit(self._fetch, next_offset))
+                    next_offset += self.limit
+
+                yield from items
+
+                if not pending:
+                    break
+                page = pending.popleft().result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,235 @@
+import datetime
+import json
+import os
+import re
+import shutil
+import threading
+from pathlib import PurePath
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from zotify.utils import append_line, get_directory_song_ids, get_downloaded_song_duration, get_previously_downloaded
+
+
+TEMPLATE_FIELD = re.compile(r'\{(\w+)\}')
+# a downloaded file may be this many seconds shorter or longer than the track or episode on Spotify
+DURATION_TOLERANCE = 3.0
+# tracks are downloaded next to their file as '.<name>.<track id>.part.<ext>' and renamed once complete
+PARTIAL_FILENAME = re.compile(r'^\.(?P<stem>.+)\.(?P<id>[0-9A-Za-z]{22})\.part(?P<suffix>\.\w+)$')
+
+
+def partial_filename(filename: PurePath, track_id: str) -> PurePath:
+    """ The name `filename` has while it is downloaded, an interrupted run leaves it behind under this name """
+    return filename.with_name(f'.{filename.stem}.{track_id}.part{filename.suffix}')
+
+
+def parse_partial_filename(name: str) -> Optional[Tuple[str, str]]:
+    """ Returns (final name, track id) of a partial download, None for other file names
+
+    >>> parse_partial_filename('.Artist - Song.4uLU6hMCjMI75M1A2tKUQC.part.ogg')
+    ('Artist - Song.ogg', '4uLU6hMCjMI75M1A2tKUQC')
+    >>> parse_partial_filename('Artist - Song.ogg') is None
+    True
+    """
+    match = PARTIAL_FILENAME.match(name)
+    if match is None:
+        return None
+    return match.group('stem') + match.group('suffix'), match.group('id')
+
+
+class OutputTemplate:
+    """ An output template split once into literal text and placeholders """
+
+    def __init__(self, template: str):
+        # even indices are literal text, odd indices are placeholder names
+        self.parts = TEMPLATE_FIELD.split(str(template))
+
+    def render(self, values: Dict[str, str]) -> str:
+        """ Fills in the placeholders, unknown placeholders are kept as they are """
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            parts[i] = values[name] if name in values else '{' + name + '}'
+        return ''.join(parts)
+
+
+class DirectoryIndex:
+    """ The file names and .song_ids of one target directory, read from disk only once """
+
+    def __init__(self, path: PurePath):
+        self.path = path
+        # held while a track is checked against and claims a name in this directory
+        self.lock = threading.Lock()
+        self.reserved: Set[str] = set()
+        try:
+            with os.scandir(path) as entries:
+                self.names = {entry.name for entry in entries}
+        except FileNotFoundError:
+            self.names = set()
+        self.song_ids = set(get_directory_song_ids(path)) if '.song_ids' in self.names else set()
+
+    def has_file(self, name: str) -> bool:
+        """ Whether a non-empty file with this name exists or is being downloaded """
+        if name not in self.names:
+            return False
+        if name in self.reserved:
+            return True
+        try:
+            return os.stat(self.path / name).st_size > 0
+        except OSError:
+            return False
+
+    def free_name(self, name: str) -> str:
+        """ Returns the first '<name>_<n><ext>' that is not taken yet """
+        stem, suffix = os.path.splitext(name)
+        c = 1
+        while f'{stem}_{c}{suffix}' in self.names:
+            c += 1
+        return f'{stem}_{c}{suffix}'
+
+    def reserve(self, name: str, song_id: Optional[str] = None) -> None:
+        """ Claims a name (and song id) for a download in progress """
+        self.names.add(name)
+        self.reserved.add(name)
+        if song_id is not None:
+            self.song_ids.add(song_id)
+
+    def release(self, name: str, song_id: Optional[str] = None) -> None:
+        """ Gives up a reservation of a download that did not complete """
+        with self.lock:
+            self.reserved.discard(name)
+            if not os.path.exists(self.path / name):
+                self.names.discard(name)
+            if song_id is not None:
+                self.song_ids.discard(song_id)
+
+    def add(self, name: str, song_id: Optional[str] = None) -> None:
+        """ Records a completed download """
+        with self.lock:
+            self.reserved.discard(name)
+            self.names.add(name)
+            self.names.add('.song_ids')
+            if song_id is not None:
+                self.song_ids.add(song_id)
+
+
+class EpisodeCatalog:
+    """ The episodes downloaded into one show directory and the sync watermark of that show.
+
+    '.episode_ids' records every downloaded episode, '.show_sync' holds the newest release date
+    (and the ids released on it) of the last sync that left no episode behind. Shows are listed
+    newest first, so a sync can stop listing as soon as it reaches the watermark.
+    """
+
+    def __init__(self, path: PurePath):
+        self.path = PurePath(path)
+        self.lock = threading.Lock()
+        try:
+            with os.scandir(self.path) as entries:
+                self.names = {entry.name for entry in entries}
+        except FileNotFoundError:
+            self.names = set()
+
+        self.ids: Set[str] = set()
+        if '.episode_ids' in self.names:
+            with open(self.path / '.episode_ids', 'r', encoding='utf-8') as file:
+                self.ids = {line.split('\t')[0] for line in file.read().splitlines() if line}
+
+        self.watermark: Optional[Tuple[str, Set[str]]] = None
+        if '.show_sync' in self.names:
+            try:
+                with open(self.path / '.show_sync', 'r', encoding='utf-8') as file:
+                    sync = json.load(file)
+                self.watermark = (sync['release_date'], set(sync['ids']))
+            except (ValueError, KeyError):
+                pass
+
+    def has_episode(self, episode_id: str) -> bool:
+        """ Whether an episode was downloaded already """
+        with self.lock:
+            return episode_id in self.ids
+
+    def find_legacy_file(self, filename: str, duration_ms: Optional[int] = None) -> Optional[str]:
+        """ The file of an episode downloaded before the catalog existed, matched by name.
+
+        The file has to be non-empty and, if ffprobe is installed, as long as the episode. It is
+        not recorded here, the caller adds it once it is sure the match is used.
+        """
+        for ext in ('.ogg', '.mp3'):
+            name = filename + ext
+            if name not in self.names:
+                continue
+            try:
+                if os.stat(self.path / name).st_size == 0:
+                    continue
+            except OSError:
+                continue
+            if duration_ms is not None and shutil.which('ffprobe') is not None:
+                try:
+                    duration = get_downloaded_song_duration(str(self.path / name))
+                except (AttributeError, ValueError, OSError):
+                    continue
+                if abs(duration - duration_ms / 1000) > DURATION_TOLERANCE:
+                    continue
+            return name
+        return None
+
+    def add(self, episode_id: str, release_date: str, filename: str) -> None:
+        """ Records a completed download """
+        with self.lock:
+            self.ids.add(episode_id)
+            self.names.add(filename)
+            append_line(self.path / '.episode_ids',
+                        f'{episode_id}\t{release_date}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{filename}\n')
+
+    def save_watermark(self, episodes: Iterable[Tuple[str, str]]) -> None:
+        """ Moves the watermark up to the newest of the given (id, release date) pairs """
+        date, ids = self.watermark if self.watermark is not None else ('', set())
+        for episode_id, release_date in episodes:
+            if release_date > date:
+                date, ids = release_date, set()
+            if release_date == date:
+                ids.add(episode_id)
+        if not date:
+            return
+        self.watermark = (date, ids)
+        temp_path = self.path / '.show_sync.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'release_date': date, 'ids': sorted(ids)}, file)
+        os.replace(temp_path, self.path / '.show_sync')
+
+
+class PathPlanner:
+    """ Resolves target paths and skip checks for all tracks of one job (a playlist, an album, ...).
+
+    Output templates are compiled once, every target directory is listed once and the song
+    archive is read once, so the cost per track stays flat however large the directories get.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: Dict[str, OutputTemplate] = {}
+        self._directories: Dict[PurePath, DirectoryIndex] = {}
+        self._archive: Optional[Set[str]] = None
+
+    def template(self, template: str) -> OutputTemplate:
+        key = str(template)
+        with self._lock:
+            if key not in self._templates:
+                self._templates[key] = OutputTemplate(key)
+            return self._templates[key]
+
+    def directory(self, path: PurePath) -> DirectoryIndex:
+        path = PurePath(path)
+        with self._lock:
+            if path not in self._directories:
+                self._directories[path] = DirectoryIndex(path)
+            return self._directories[path]
+
+    def previously_downloaded(self) -> Set[str]:
+        with self._lock:
+            if self._archive is None:
+                self._archive = set(get_previously_downloaded())
+            return self._archive
+
+    def add_to_archive(self, song_id: str) -> None:
+        self.previously_downloaded().add(song_id)
@@ -0,0 +1,106 @@
+import datetime
+import json
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+PLAN_VERSION = 1
+# kbit/s of the Vorbis streams of each AudioQuality, used to estimate download sizes
+QUALITY_BITRATES = {
+    'NORMAL': 96,
+    'HIGH': 160,
+    'VERY_HIGH': 320,
+}
+
+
+class Plan:
+    """ Collects what a run would download and skip, without downloading anything.
+
+    download_track and download_episode go through the usual listing, path and skip checks and
+    hand every track they would start to add_track / add_episode instead of opening a stream.
+    Skips are picked up from the track_skipped and episode_skipped events. The plan is written
+    as JSON, a later run can download its items directly without listing anything again.
+    """
+
+    def __init__(self, quality: str = 'HIGH'):
+        self.bitrate = QUALITY_BITRATES.get(quality, QUALITY_BITRATES['HIGH'])
+        self.downloads: List[Dict[str, Any]] = []
+        self.skipped: List[Dict[str, Any]] = []
+        self._track_ids = set()
+        self._lock = threading.Lock()
+
+    def add_track(self, job: Dict[str, Any], name: str, path: str, duration_ms: int) -> None:
+        """ Records a track download, `job` holds the download_track arguments that reproduce it """
+        with self._lock:
+            self._track_ids.add(job['track_id'])
+            self.downloads.append({'kind': 'track', 'name': name, 'path': path, 'duration_ms': duration_ms,
+                                   'bytes': self.estimate_bytes(duration_ms), **job})
+
+    def add_episode(self, episode_id: str, episode_info: dict, name: str, path: str, duration_ms: int) -> None:
+        with self._lock:
+            self.downloads.append({'kind': 'episode', 'episode_id': episode_id, 'name': name, 'path': path,
+                                   'duration_ms': duration_ms, 'bytes': self.estimate_bytes(duration_ms),
+                                   'episode_info': episode_info})
+
+    def has_track(self, track_id: str) -> bool:
+        """ Whether a track is already planned, later copies of it count as archived like in a real run """
+        with self._lock:
+            return track_id in self._track_ids
+
+    def observe(self, event: str, fields: Dict[str, Any]) -> None:
+        """ Records the skips reported through Printer.event """
+        if event not in ('track_skipped', 'episode_skipped', 'track_failed'):
+            return
+        with self._lock:
+            self.skipped.append({
+                'kind': 'episode' if event.startswith('episode') else 'track',
+                'id': fields.get('id'),
+                'name': fields.get('name'),
+                'reason': fields.get('reason') or f'failed_{fields.get("stage")}',
+            })
+
+    def estimate_bytes(self, duration_ms: Optional[int]) -> int:
+        return int((duration_ms or 0) / 1000 * self.bitrate * 1000 / 8)
+
+    def estimate_seconds(self, workers: int, real_time: bool, rate_limit: int) -> Optional[float]:
+        """ The expected download time, None if it only depends on the connection """
+        if real_time:
+            return sum(item['duration_ms'] or 0 for item in self.downloads) / 1000 / workers
+        if rate_limit:
+            return sum(item['bytes'] for item in self.downloads) / rate_limit
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'tracks': sum(1 for item in self.downloads if item['kind'] == 'track'),
+                'episodes': sum(1 for item in self.downloads if item['kind'] == 'episode'),
+                'bytes': sum(item['bytes'] for item in self.downloads),
+                'duration_ms': sum(item['duration_ms'] or 0 for item in self.downloads),
+                'skipped': dict(Counter(item['reason'] for item in self.skipped)),
+            }
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            plan = {
+                'version': PLAN_VERSION,
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'downloads': self.downloads,
+                'skipped': self.skipped,
+            }
+        plan['summary'] = self.summary()
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(plan, file, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+
+def load_plan(path: str) -> List[Dict[str, Any]]:
+    """ Returns the downloads of a plan file """
+    with open(path, 'r', encoding='utf-8') as file:
+        plan = json.load(file)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f'Unsupported plan version {plan.get("version")} in {path}')
+    return plan['downloads']
@@ -1,61 +1,52 @@
-from zotify.const import ITEMS, ID, TRACK, NAME
+from typing import Iterator
+
+from zotify.const import ID, TRACK, TRACKS, NAME, TOTAL
+from zotify.paginator import Paginator
+from zotify.paths import PathPlanner
+from zotify.scheduler import Source, parse_priorities, schedule
 from zotify.termoutput import Printer
-from zotify.track import download_track
+from zotify.track import download_tracks, TrackInfo
 from zotify.utils import split_input
 from zotify.zotify import Zotify
 
 MY_PLAYLISTS_URL = 'https://api.spotify.com/v1/me/playlists'
 PLAYLISTS_URL = 'https://api.spotify.com/v1/playlists'
+# only request the parts of each item that are needed to download it
+PLAYLIST_TRACK_FIELDS = 'total,items(track(type,id,name,is_playable,duration_ms,disc_number,track_number,' \
+                        'artists(name,href),album(name,release_date,images)))'
 
 
 def get_all_playlists():
     """ Returns list of users playlists """
-    playlists = []
-    limit = 50
-    offset = 0
-
-    while True:
-        resp = Zotify.invoke_url_with_params(MY_PLAYLISTS_URL, limit=limit, offset=offset)
-        offset += limit
-        playlists.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return playlists
-
-
-def get_playlist_songs(playlist_id):
-    """ returns list of songs in a playlist """
-    songs = []
-    offset = 0
-    limit = 100
+    return list(Paginator(MY_PLAYLISTS_URL, limit=50))
 
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
 
-    return songs
+def get_playlist_songs(playlist_id) -> Paginator:
+    """ returns the songs in a playlist, fetched lazily page by page """
+    return Paginator(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=100, fields=PLAYLIST_TRACK_FIELDS, market='from_token')
 
 
 def get_playlist_info(playlist_id):
     """ Returns information scraped from playlist """
-    (raw, resp) = Zotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields=name,owner(display_name)&market=from_token')
+    (raw, resp) = Zotify.invoke_url_cached('playlist', playlist_id, f'{PLAYLISTS_URL}/{playlist_id}?fields=name,owner(display_name)&market=from_token')
     return resp['name'].strip(), resp['owner']['display_name'].strip()
 
 
+def get_user_playlist_jobs(playlist) -> Iterator[dict]:
+    """ Yields the download_track arguments for every song of one of the user's playlists """
+    songs = get_playlist_songs(playlist[ID])
+    playlist_songs = (song for song in songs if song[TRACK] is not None and song[TRACK][ID])
+    p_bar = Printer.progress(playlist_songs, unit='song', total=len(songs), unit_scale=True)
+    planner = PathPlanner()
+    for enum, song in enumerate(p_bar, start=1):
+        p_bar.set_description(song[TRACK][NAME])
+        yield dict(mode='extplaylist', track_id=song[TRACK][ID], extra_keys={'playlist': playlist[NAME], 'playlist_num': str(enum).zfill(2)},
+                   disable_progressbar=True, track_info=TrackInfo.from_json(song[TRACK]), planner=planner)
+
+
 def download_playlist(playlist):
     """Downloads all the songs from a playlist"""
-
-    playlist_songs = [song for song in get_playlist_songs(playlist[ID]) if song[TRACK] is not None and song[TRACK][ID]]
-    p_bar = Printer.progress(playlist_songs, unit='song', total=len(playlist_songs), unit_scale=True)
-    enum = 1
-    for song in p_bar:
-        download_track('extplaylist', song[TRACK][ID], extra_keys={'playlist': playlist[NAME], 'playlist_num': str(enum).zfill(2)}, disable_progressbar=True)
-        p_bar.set_description(song[TRACK][NAME])
-        enum += 1
+    download_tracks(get_user_playlist_jobs(playlist))
 
 
 def download_from_user_playlist():
@@ -75,9 +66,15 @@ def download_from_user_playlist():
         selection = str(input('ID(s): '))
     playlist_choices = map(int, split_input(selection))
 
+    # all selected playlists share the download workers, in the order of SCHEDULER
+    priorities = parse_priorities(Zotify.CONFIG.get_scheduler_priorities())
+    sources = []
     for playlist_number in playlist_choices:
         playlist = playlists[playlist_number - 1]
         print(f'Downloading {playlist[NAME].strip()}')
-        download_playlist(playlist)
+        sources.append(Source(playlist[ID], get_user_playlist_jobs(playlist),
+                              lambda playlist=playlist: (playlist.get(TRACKS) or {}).get(TOTAL),
+                              priorities.get(playlist[ID], 0)))
+    download_tracks(schedule(sources, Zotify.CONFIG.get_scheduler()))
 
     print('\n**All playlists have been downloaded**\n')
@@ -1,13 +1,17 @@
 # import os
-from pathlib import PurePath, Path
 import time
-from typing import Optional, Tuple
+import traceback
+from pathlib import PurePath, Path
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from librespot.metadata import EpisodeId
 
-from zotify.const import ERROR, ID, ITEMS, NAME, SHOW, DURATION_MS
+from zotify.const import ERROR, ID, NAME, SHOW, DURATION_MS, EPISODES, RELEASE_DATE
+from zotify.paginator import Paginator
+from zotify.paths import EpisodeCatalog
+from zotify.segmented import download_segmented
 from zotify.termoutput import PrintChannel, Printer
-from zotify.utils import create_download_directory, fix_filename
+from zotify.utils import create_download_directory, fix_filename, run_jobs
 from zotify.zotify import Zotify
 from zotify.loader import Loader
 
@@ -16,123 +20,260 @@ EPISODE_INFO_URL = 'https://api.spotify.com/v1/episodes'
 SHOWS_URL = 'https://api.spotify.com/v1/shows'
 
 
-def get_episode_info(episode_id_str) -> Tuple[Optional[str], Optional[str]]:
+EPISODE_BATCH_SIZE = 50
+
+
+def parse_episode_info(info: dict) -> Tuple[str, int, str]:
+    return fix_filename(info[SHOW][NAME]), info[DURATION_MS], fix_filename(info[NAME])
+
+
+def fetch_episode_info(episode_id_str) -> Optional[dict]:
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching episode information..."):
-        (raw, info) = Zotify.invoke_url(f'{EPISODE_INFO_URL}/{episode_id_str}')
+        (raw, info) = Zotify.invoke_url_cached('episode', episode_id_str, f'{EPISODE_INFO_URL}/{episode_id_str}')
     if not info:
         Printer.print(PrintChannel.ERRORS, "###   INVALID EPISODE ID   ###")
-    duration_ms = info[DURATION_MS]
+        return None
     if ERROR in info:
-        return None, None
-    return fix_filename(info[SHOW][NAME]), duration_ms, fix_filename(info[NAME])
+        return None
+    return info
 
 
-def get_show_episodes(show_id_str) -> list:
-    episodes = []
-    offset = 0
-    limit = 50
+def get_episode_info(episode_id_str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    info = fetch_episode_info(episode_id_str)
+    if info is None:
+        return None, None, None
+    return parse_episode_info(info)
 
-    with Loader(PrintChannel.PROGRESS_INFO, "Fetching episodes..."):
-        while True:
-            resp = Zotify.invoke_url_with_params(
-                f'{SHOWS_URL}/{show_id_str}/episodes', limit=limit, offset=offset)
-            offset += limit
-            for episode in resp[ITEMS]:
-                episodes.append(episode[ID])
-            if len(resp[ITEMS]) < limit:
-                break
 
-    return episodes
+def get_episodes_info(episode_ids: List[str]) -> Dict[str, dict]:
+    """ Looks up the metadata of many episodes, EPISODE_BATCH_SIZE episodes per request """
+    infos = {}
+    missing = []
+    for episode_id in episode_ids:
+        cached = Zotify.METADATA_CACHE.get('episode', episode_id) if Zotify.METADATA_CACHE is not None else None
+        if cached is not None:
+            infos[episode_id] = cached
+        else:
+            missing.append(episode_id)
 
+    for i in range(0, len(missing), EPISODE_BATCH_SIZE):
+        ids = ','.join(missing[i:i + EPISODE_BATCH_SIZE])
+        (raw, resp) = Zotify.invoke_url(f'{EPISODE_INFO_URL}?ids={ids}')
+        for info in resp.get(EPISODES) or []:
+            # unavailable episodes are returned as null
+            if info:
+                infos[info[ID]] = info
+                if Zotify.METADATA_CACHE is not None:
+                    Zotify.METADATA_CACHE.put('episode', info[ID], info)
+    return infos
 
-def download_podcast_directly(url, filename):
-    import functools
-    import shutil
-    import requests
-    from tqdm.auto import tqdm
-
-    r = requests.get(url, stream=True, allow_redirects=True)
-    if r.status_code != 200:
-        r.raise_for_status()  # Will only raise for 4xx codes, so...
-        raise RuntimeError(
-            f"Request to {url} returned status code {r.status_code}")
-    file_size = int(r.headers.get('Content-Length', 0))
 
+def get_show_episodes(show_id_str, catalog: Optional[EpisodeCatalog] = None) -> Iterator[dict]:
+    """ Yields the episodes of a show newest first, fetched lazily page by page.
+
+    With a catalog, listing stops at the watermark of the last complete sync of the show.
+    """
+    url = f'{SHOWS_URL}/{show_id_str}/episodes'
+    if catalog is None or catalog.watermark is None:
+        yield from (episode for episode in Paginator(url, limit=EPISODE_BATCH_SIZE) if episode)
+        return
+
+    watermark_date, watermark_ids = catalog.watermark
+    # usually only the first page is new, so don't request pages ahead
+    for episode in Paginator(url, limit=EPISODE_BATCH_SIZE, prefetch=1):
+        if not episode:
+            continue
+        release_date = episode.get(RELEASE_DATE, '')
+        if release_date < watermark_date:
+            break
+        if release_date == watermark_date and episode[ID] in watermark_ids:
+            continue
+        yield episode
+
+
+def download_show(show_id_str) -> None:
+    """ Downloads the episodes of a show with up to DOWNLOAD_WORKERS concurrent workers.
+
+    With SKIP_EXISTING the show is synced incrementally: listing stops at the watermark of the
+    last complete sync, and episodes in the show's catalog are skipped without any lookup.
+    """
+    with Loader(PrintChannel.PROGRESS_INFO, "Fetching show information..."):
+        (raw, show) = Zotify.invoke_url_cached('show', show_id_str, f'{SHOWS_URL}/{show_id_str}')
+    if not show or ERROR in show:
+        Printer.print(PrintChannel.ERRORS, "###   INVALID SHOW ID   ###")
+        return
+
+    download_directory = PurePath(Zotify.CONFIG.get_root_podcast_path()).joinpath(fix_filename(show[NAME]))
+    if Zotify.PLAN is None:
+        create_download_directory(download_directory)
+    catalog = EpisodeCatalog(download_directory)
+    skip_existing = Zotify.CONFIG.get_skip_existing()
+    listed = []
+    unavailable = set()
+
+    def lookup(batch):
+        infos = get_episodes_info([episode[ID] for episode in batch])
+        for episode in batch:
+            if episode[ID] in infos:
+                yield {'episode_id': episode[ID], 'episode_info': infos[episode[ID]], 'catalog': catalog}
+            else:
+                unavailable.add(episode[ID])
+                Printer.event('episode_skipped', id=episode[ID], name=episode[NAME], reason='unavailable')
+                Printer.print(PrintChannel.SKIPS, f"\n###   SKIPPING: {fix_filename(episode[NAME])} (EPISODE NOT AVAILABLE)   ###")
+
+    def jobs():
+        batch = []
+        for episode in get_show_episodes(show_id_str, catalog if skip_existing else None):
+            listed.append((episode[ID], episode.get(RELEASE_DATE, '')))
+            if skip_existing and episode[ID] in catalog.ids:
+                Printer.event('episode_skipped', id=episode[ID], name=episode[NAME], reason='exists')
+                Printer.print(PrintChannel.SKIPS, f"\n###   SKIPPING: {fix_filename(episode[NAME])} (EPISODE ALREADY EXISTS)   ###")
+                continue
+            batch.append(episode)
+            if len(batch) == EPISODE_BATCH_SIZE:
+                yield from lookup(batch)
+                batch = []
+        if batch:
+            yield from lookup(batch)
+
+    run_jobs(download_episode, jobs(), Zotify.CONFIG.get_download_workers(), name='episode')
+
+    # the watermark only moves once nothing newer than it is missing
+    if Zotify.PLAN is None and all(episode_id in catalog.ids or episode_id in unavailable for episode_id, _ in listed):
+        catalog.save_watermark(listed)
+
+
+def download_podcast_directly(url, filename):
     path = Path(filename).expanduser().resolve()
-    path.parent.mkdir(parents=True, exist_ok=True)
+    with Printer.progress(desc=path.name, unit='B', unit_scale=True, unit_divisor=1024) as p_bar:
+        def set_total(size):
+            p_bar.total = size or None
 
-    desc = "(Unknown total file size)" if file_size == 0 else ""
-    r.raw.read = functools.partial(
-        r.raw.read, decode_content=True)  # Decompress if needed
-    with tqdm.wrapattr(r.raw, "read", total=file_size, desc=desc) as r_raw:
-        with path.open("wb") as f:
-            shutil.copyfileobj(r_raw, f)
+        download_segmented(url, path, connections=Zotify.CONFIG.get_direct_download_connections(),
+                           progress=p_bar.update, on_size=set_total, throttle=Zotify.BANDWIDTH.stream(),
+                           timeout=Zotify.CONFIG.get_http_timeout())
 
     return path
 
 
-def download_episode(episode_id) -> None:
-    podcast_name, duration_ms, episode_name = get_episode_info(episode_id)
+def download_episode(episode_id, episode_info: Optional[dict] = None, catalog: Optional[EpisodeCatalog] = None) -> None:
+    if episode_info is None:
+        episode_info = fetch_episode_info(episode_id)
+    if episode_info is None:
+        # counts as a failed attempt, --retry-failed backs off from it and quarantines it eventually
+        Zotify.record_failure('episode', episode_id, {}, LookupError(f'Episode {episode_id} not found'))
+        Printer.event('episode_skipped', id=episode_id, reason='not_found')
+        Printer.print(PrintChannel.SKIPS, '###   SKIPPING: (EPISODE NOT FOUND)   ###')
+        return
+
+    podcast_name, duration_ms, episode_name = parse_episode_info(episode_info)
+    release_date = episode_info.get(RELEASE_DATE, '')
     extra_paths = podcast_name + '/'
+    filename = podcast_name + ' - ' + episode_name
+
+    download_directory = PurePath(Zotify.CONFIG.get_root_podcast_path()).joinpath(extra_paths)
+    # download_directory = os.path.realpath(download_directory)
+
+    # checked against the catalog before the episode is resolved or any stream is opened
+    if catalog is None:
+        catalog = EpisodeCatalog(download_directory)
+    if Zotify.CONFIG.get_skip_existing():
+        exists = catalog.has_episode(episode_id)
+        if not exists:
+            legacy_name = catalog.find_legacy_file(filename, duration_ms)
+            exists = legacy_name is not None
+            # adopted once, later runs find it by its id
+            if exists and Zotify.PLAN is None:
+                catalog.add(episode_id, release_date, legacy_name)
+        if exists:
+            Printer.event('episode_skipped', id=episode_id, name=filename, reason='exists')
+            Printer.print(PrintChannel.SKIPS, "\n###   SKIPPING: " + podcast_name + " - " + episode_name + " (EPISODE ALREADY EXISTS)   ###")
+            Zotify.resolve_failure('episode', episode_id)
+            return
+
+    if Zotify.PLAN is not None:
+        # the format (and so the extension) is only known once the episode is resolved
+        Zotify.PLAN.add_episode(episode_id, episode_info, filename, str(download_directory.joinpath(filename)), duration_ms)
+        return
+
+    claim_key = f'episode:{episode_id}'
+    if not Zotify.claim(claim_key):
+        Printer.event('episode_skipped', id=episode_id, name=filename, reason='claimed')
+        Printer.print(PrintChannel.SKIPS, "\n###   SKIPPING: " + podcast_name + " - " + episode_name + " (EPISODE IS DOWNLOADED BY ANOTHER PROCESS)   ###")
+        # the other process queues it again if its download fails, the queue is shared
+        Zotify.resolve_failure('episode', episode_id)
+        return
+
+    completed = False
+    # the file written by librespot, removed if the download fails. A direct download keeps its
+    # partial file and segment state, the next attempt resumes from there
+    part_path = None
     prepare_download_loader = Loader(PrintChannel.PROGRESS_INFO, "Preparing download...")
-    prepare_download_loader.start()
+    try:
+        create_download_directory(download_directory)
 
-    if podcast_name is None:
-        Printer.print(PrintChannel.SKIPS, '###   SKIPPING: (EPISODE NOT FOUND)   ###')
-        prepare_download_loader.stop()
-    else:
-        filename = podcast_name + ' - ' + episode_name
+        Printer.event('episode_started', id=episode_id, name=filename)
+        time_start = time.time()
+        prepare_download_loader.start()
 
         resp = Zotify.invoke_url(
             'https://api-partner.spotify.com/pathfinder/v1/query?operationName=getEpisode&variables={"uri":"spotify:episode:' + episode_id + '"}&extensions={"persistedQuery":{"version":1,"sha256Hash":"224ba0fd89fcfdfb3a15fa2d82a6112d3f4e2ac88fba5c6713de04d1b72cf482"}}')[1]["data"]["episode"]
         direct_download_url = resp["audio"]["items"][-1]["url"]
 
-        download_directory = PurePath(Zotify.CONFIG.get_root_podcast_path()).joinpath(extra_paths)
-        # download_directory = os.path.realpath(download_directory)
-        create_download_directory(download_directory)
-
         if "anon-podcast.scdn.co" in direct_download_url or "audio_preview_url" not in resp:
-            episode_id = EpisodeId.from_base62(episode_id)
             stream = Zotify.get_content_stream(
-                episode_id, Zotify.DOWNLOAD_QUALITY)
+                EpisodeId.from_base62(episode_id), Zotify.DOWNLOAD_QUALITY)
 
             total_size = stream.input_stream.size
 
             filepath = PurePath(download_directory).joinpath(f"{filename}.ogg")
-            if (
-                Path(filepath).is_file()
-                and Path(filepath).stat().st_size == total_size
-                and Zotify.CONFIG.get_skip_existing()
-            ):
-                Printer.print(PrintChannel.SKIPS, "\n###   SKIPPING: " + podcast_name + " - " + episode_name + " (EPISODE ALREADY EXISTS)   ###")
-                prepare_download_loader.stop()
-                return
+            # written under a temporary name, so an interrupted download never looks complete
+            part_path = Path(f"{filepath}.part")
 
             prepare_download_loader.stop()
-            time_start = time.time()
-            downloaded = 0
-            with open(filepath, 'wb') as file, Printer.progress(
+            throttle = Zotify.BANDWIDTH.stream()
+            with open(part_path, 'wb') as file, Printer.progress(
                 desc=filename,
                 total=total_size,
                 unit='B',
                 unit_scale=True,
                 unit_divisor=1024
             ) as p_bar:
-                prepare_download_loader.stop()
-                while True:
-                #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
+
+                def read_chunk() -> Optional[int]:
                     data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
                     p_bar.update(file.write(data))
-                    downloaded += len(data)
-                    if data == b'':
-                        break
-                    if Zotify.CONFIG.get_download_real_time():
-                        delta_real = time.time() - time_start
-                        delta_want = (downloaded / total_size) * (duration_ms/1000)
-                        if delta_want > delta_real:
-                            time.sleep(delta_want - delta_real)
+                    return len(data) if data != b'' else None
+
+                if Zotify.CONFIG.get_download_real_time():
+                    Zotify.PACER.pace(read_chunk, total_size, duration_ms / 1000, throttle)
+                else:
+                    while True:
+                        size = read_chunk()
+                        if size is None:
+                            break
+                        throttle.consume(size)
+            part_path.replace(filepath)
         else:
             filepath = PurePath(download_directory).joinpath(f"{filename}.mp3")
+            prepare_download_loader.stop()
             download_podcast_directly(direct_download_url, filepath)
 
-    prepare_download_loader.stop()
+        catalog.add(episode_id, release_date, filepath.name)
+        completed = True
+        Printer.event('episode_downloaded', id=episode_id, name=filename, path=str(filepath),
+                      bytes=Path(filepath).stat().st_size, download_seconds=round(time.time() - time_start, 3))
+    except Exception as e:
+        Zotify.record_failure('episode', episode_id, {}, e)
+        Printer.event('episode_failed', id=episode_id, name=filename, error=str(e))
+        Printer.print(PrintChannel.ERRORS, '###   SKIPPING: ' + podcast_name + ' - ' + episode_name + ' (GENERAL DOWNLOAD ERROR)   ###')
+        Printer.print(PrintChannel.ERRORS, 'Episode_ID: ' + str(episode_id) + "\n")
+        Printer.print(PrintChannel.ERRORS, str(e) + "\n")
+        Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
+    finally:
+        Zotify.release_claim(claim_key, completed)
+        if not completed and part_path is not None:
+            part_path.unlink(missing_ok=True)
+        prepare_download_loader.stop()
+    if completed:
+        Zotify.resolve_failure('episode', episode_id)
@@ -0,0 +1,152 @@
+import sys
+import threading
+import time
+from shutil import get_terminal_size
+from typing import Iterable, Optional
+
+from tqdm import tqdm
+
+
+# seconds between two status lines when the output is not a terminal
+LINE_INTERVAL = 30.0
+
+
+class ProgressRenderer:
+    """ Draws the progress of all active loaders and progress bars from a single thread.
+
+    On a terminal the active items are redrawn as a block of lines at a fixed refresh rate,
+    messages are printed above that block. When the output is redirected (main.py, Docker)
+    loaders are not drawn at all and progress bars are reported as a plain line now and then.
+    The cost of a refresh only depends on the number of lines on screen, not on the number
+    of threads or downloads.
+    """
+
+    def __init__(self, refresh: float = 0.1):
+        self.refresh = refresh
+        self._items = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._drawn = 0
+        self._last_lines = 0.0
+
+    @staticmethod
+    def interactive() -> bool:
+        return sys.stdout.isatty()
+
+    def add(self, item) -> None:
+        with self._condition:
+            self._items.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def remove(self, item) -> None:
+        with self._condition:
+            if item not in self._items:
+                return
+            self._items.remove(item)
+            if self.interactive():
+                self._draw()
+
+    def write(self, msg: str, file=None) -> None:
+        """ Prints a message without tearing the progress lines """
+        with self._condition:
+            self._clear()
+            print(msg, file=file if file is not None else sys.stdout, flush=True)
+            if self.interactive():
+                self._draw()
+
+    def _clear(self) -> None:
+        if self._drawn:
+            # move to the start of the block and erase everything below
+            sys.stdout.write(f'\x1b[{self._drawn}F\x1b[J')
+            sys.stdout.flush()
+            self._drawn = 0
+
+    def _draw(self) -> None:
+        columns, rows = get_terminal_size((80, 20))
+        now = time.monotonic()
+        items = self._items
+        if len(items) > rows - 1:
+            lines = [item.render(now, columns) for item in items[:rows - 2]]
+            lines.append(f'\t... and {len(items) - len(lines)} more')
+        else:
+            lines = [item.render(now, columns) for item in items]
+        erase = f'\x1b[{self._drawn}F\x1b[J' if self._drawn else ''
+        sys.stdout.write(erase + ''.join(line[:columns - 1] + '\n' for line in lines))
+        sys.stdout.flush()
+        self._drawn = len(lines)
+
+    def _print_lines(self) -> None:
+        now = time.monotonic()
+        if now - self._last_lines < LINE_INTERVAL:
+            return
+        self._last_lines = now
+        for item in self._items:
+            line = item.summary(now)
+            if line is not None:
+                print(line, flush=True)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._items:
+                    self._condition.wait()
+                if self.interactive():
+                    self._draw()
+                else:
+                    self._print_lines()
+                self._condition.wait(self.refresh)
+
+
+class ProgressBar:
+    """ A progress bar drawn by the ProgressRenderer, covering the parts of the tqdm API zotify uses """
+
+    def __init__(self, renderer: ProgressRenderer, iterable: Optional[Iterable] = None, desc: Optional[str] = None,
+                 total: Optional[int] = None, unit: str = 'it', disable: bool = False, unit_scale: bool = False,
+                 unit_divisor: int = 1000):
+        self.renderer = renderer
+        self.iterable = iterable
+        self.desc = desc or ''
+        self.total = total
+        self.unit = unit
+        self.unit_scale = unit_scale
+        self.unit_divisor = unit_divisor
+        self.disable = disable
+        self.n = 0
+        self.start = time.monotonic()
+        if not disable:
+            renderer.add(self)
+
+    def update(self, n: int = 1) -> None:
+        self.n += n
+
+    def set_description(self, desc: str) -> None:
+        self.desc = desc
+
+    def render(self, now: float, width: int) -> str:
+        return tqdm.format_meter(self.n, self.total, now - self.start, ncols=width - 1, prefix=self.desc,
+                                 unit=self.unit, unit_scale=self.unit_scale, unit_divisor=self.unit_divisor)
+
+    def summary(self, now: float) -> str:
+        return tqdm.format_meter(self.n, self.total, now - self.start, ncols=0, prefix=self.desc,
+                                 unit=self.unit, unit_scale=self.unit_scale, unit_divisor=self.unit_divisor)
+
+    def close(self) -> None:
+        if not self.disable:
+            self.renderer.remove(self)
+
+    def __iter__(self):
+        try:
+            for obj in self.iterable:
+                yield obj
+                self.update()
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -0,0 +1,77 @@
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from zotify.utils import listed_jobs
+
+
+POLICIES = ('fifo', 'round_robin', 'smallest_first', 'priority')
+
+
+class Source:
+    """ The download jobs of one playlist, album, artist or track.
+
+    `size` returns the number of tracks (None if unknown) and is only called by the
+    smallest_first policy, `priority` is used by the priority policy, higher goes first.
+    """
+    __slots__ = ('id', 'jobs', 'size', 'priority')
+
+    def __init__(self, source_id: str, jobs: Iterable[dict], size: Callable[[], Optional[int]] = lambda: None,
+                 priority: int = 0):
+        self.id = source_id
+        self.jobs = jobs
+        self.size = size
+        self.priority = priority
+
+
+def parse_priorities(value: str) -> Dict[str, int]:
+    """ Parses 'spotify id=priority,...' """
+    priorities = {}
+    for part in value.split(','):
+        if '=' not in part:
+            continue
+        source_id, priority = part.split('=', 1)
+        priorities[source_id.strip()] = int(priority)
+    return priorities
+
+
+def schedule(sources: List[Source], policy: str = 'fifo') -> Iterator[dict]:
+    """ Merges the jobs of several sources into one stream for a single pool of download workers.
+
+    fifo keeps the input order, round_robin takes one track of every source in turn,
+    smallest_first downloads the sources with the fewest tracks first (unknown sizes last) and
+    priority orders the sources by their priority, keeping the input order for equal ones.
+    Jobs are still taken from every source lazily, a source whose listing fails is reported and
+    the other sources go on.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown scheduler policy {policy}, expected one of {", ".join(POLICIES)}')
+
+    if policy == 'smallest_first':
+        sizes = {id(source): source_size(source) for source in sources}
+        sources = sorted(sources, key=lambda source: (sizes[id(source)] is None, sizes[id(source)] or 0))
+    elif policy == 'priority':
+        sources = sorted(sources, key=lambda source: -source.priority)
+
+    if policy != 'round_robin':
+        for source in sources:
+            yield from listed_jobs(source.jobs, source.id)
+        return
+
+    active = deque(listed_jobs(source.jobs, source.id) for source in sources)
+    while active:
+        jobs = active.popleft()
+        try:
+            job = next(jobs)
+        except StopIteration:
+            continue
+        yield job
+        active.append(jobs)
+
+
+def source_size(source: Source) -> Optional[int]:
+    """ The number of tracks of a source, None if unknown or its lookup failed """
+    try:
+        return source.size()
+    except Exception:
+        # the listing reports the error itself, if it fails as well
+        return None
@@ -0,0 +1,149 @@
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+SEGMENT_SIZE = 4 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+CONTENT_RANGE = re.compile(r'bytes\s+\d+-\d+/(\d+)')
+
+
+class SegmentedDownload:
+    """ Downloads a file over several pooled connections using HTTP range requests.
+
+    The file is split into fixed size segments that are written into a preallocated
+    '<name>.part' file. Finished segments are recorded in '<name>.part.json', so an
+    interrupted download resumes with the segments that are still missing. Servers that
+    don't support ranges are downloaded as a single stream instead.
+    """
+
+    def __init__(self, url: str, path: Path, connections: int = 4, segment_size: int = SEGMENT_SIZE,
+                 progress: Optional[Callable[[int], None]] = None, on_size: Optional[Callable[[int], None]] = None,
+                 throttle=None, session: Optional[requests.Session] = None,
+                 timeout: Optional[Tuple[Optional[float], Optional[float]]] = None):
+        self.url = url
+        self.path = Path(path)
+        self.connections = max(1, connections)
+        self.segment_size = segment_size
+        self.progress = progress
+        self.on_size = on_size
+        self.throttle = throttle
+        # (connect, read) timeout of every request
+        self.timeout = timeout
+        self.part_path = self.path.with_name(self.path.name + '.part')
+        self.state_path = self.path.with_name(self.path.name + '.part.json')
+        self._lock = threading.Lock()
+        self._done = set()
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def run(self) -> Path:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # ask for the first byte only, this tells whether ranges are supported and the total size
+        probe = self.session.get(self.url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'},
+                                 stream=True, allow_redirects=True, timeout=self.timeout)
+        content_range = CONTENT_RANGE.match(probe.headers.get('Content-Range', ''))
+        if probe.status_code != 206 or content_range is None:
+            self._size_known(int(probe.headers.get('Content-Length', 0)))
+            self._download_single(probe)
+        else:
+            probe.close()
+            self._size_known(int(content_range.group(1)))
+            self._download_segments(int(content_range.group(1)))
+        self.part_path.replace(self.path)
+        if self.state_path.exists():
+            self.state_path.unlink()
+        return self.path
+
+    def _size_known(self, size: int) -> None:
+        if self.on_size is not None:
+            self.on_size(size)
+
+    def _report(self, size: int) -> None:
+        if self.throttle is not None:
+            self.throttle.consume(size)
+        if self.progress is not None:
+            self.progress(size)
+
+    def _download_single(self, response: requests.Response) -> None:
+        if response.status_code != 200:
+            response.raise_for_status()  # Will only raise for 4xx codes, so...
+            raise RuntimeError(f'Request to {self.url} returned status code {response.status_code}')
+        if self.state_path.exists():
+            self.state_path.unlink()
+        with response, open(self.part_path, 'wb') as file:
+            for data in response.iter_content(CHUNK_SIZE):
+                file.write(data)
+                self._report(len(data))
+
+    def _load_state(self, size: int) -> None:
+        """ Picks up the finished segments of an earlier attempt at the same file """
+        if not (self.state_path.exists() and self.part_path.exists()):
+            return
+        try:
+            state = json.loads(self.state_path.read_text(encoding='utf-8'))
+        except ValueError:
+            return
+        if state.get('size') == size and state.get('segment_size') == self.segment_size \
+                and self.part_path.stat().st_size == size:
+            self._done = set(state.get('done', []))
+
+    def _save_state(self, size: int) -> None:
+        temp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        temp_path.write_text(json.dumps({'size': size, 'segment_size': self.segment_size,
+                                         'done': sorted(self._done)}), encoding='utf-8')
+        temp_path.replace(self.state_path)
+
+    def _download_segments(self, size: int) -> None:
+        self._load_state(size)
+        if not self._done:
+            # preallocate the whole file, every segment is then written in place
+            with open(self.part_path, 'wb') as file:
+                file.truncate(size)
+
+        count = (size + self.segment_size - 1) // self.segment_size
+        missing = [index for index in range(count) if index not in self._done]
+        if self.progress is not None:
+            self.progress(sum(min(self.segment_size, size - index * self.segment_size) for index in self._done))
+
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            for future in [executor.submit(self._download_segment, index, size) for index in missing]:
+                future.result()
+
+    def _download_segment(self, index: int, size: int) -> None:
+        start = index * self.segment_size
+        end = min(start + self.segment_size, size) - 1
+        headers = {'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}
+        received = 0
+        with self.session.get(self.url, headers=headers, stream=True, allow_redirects=True,
+                              timeout=self.timeout) as response:
+            if response.status_code != 206:
+                response.raise_for_status()
+                raise RuntimeError(f'Range request to {self.url} returned status code {response.status_code}')
+            with open(self.part_path, 'r+b') as file:
+                file.seek(start)
+                for data in response.iter_content(CHUNK_SIZE):
+                    file.write(data)
+                    received += len(data)
+                    self._report(len(data))
+        if received != end - start + 1:
+            raise RuntimeError(f'Segment {index} of {self.url} is incomplete ({received} of {end - start + 1} bytes)')
+
+        with self._lock:
+            self._done.add(index)
+            self._save_state(size)
+
+
+def download_segmented(url: str, path: Path, connections: int = 4, **kwargs) -> Path:
+    """ Downloads `url` to `path`, see SegmentedDownload """
+    return SegmentedDownload(url, path, connections=connections, **kwargs).run()
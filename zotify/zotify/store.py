@@ -0,0 +1,121 @@
+import os
+import shutil
+import threading
+from pathlib import Path, PurePath
+from typing import Dict, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+LINK_MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+# ioctl that makes a file share the extents of another one (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def lyrics_path(filename: PurePath) -> Path:
+    """ The lyrics file download_track writes next to a track """
+    return Path(str(filename)[:-3] + 'lrc')
+
+
+def reflink(source: PurePath, target: PurePath) -> None:
+    """ Creates a copy-on-write clone of `source`, raises OSError where the file system can't """
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(target)
+            raise
+
+
+class ContentStore:
+    """ Keeps a single copy of every downloaded track, keyed by track id and format.
+
+    Files in the output directories are links to the stored copy, so a track that appears in
+    many playlists is downloaded, converted and tagged only once. Concurrent downloads of the
+    same track share one download: the first worker downloads it, the others wait for it and
+    link the result.
+    """
+
+    def __init__(self, root: PurePath, link_mode: str = 'hardlink'):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f'Unknown link mode {link_mode}, expected one of {", ".join(LINK_MODES)}')
+        self.root = Path(root)
+        self.link_mode = link_mode
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Tuple[str, str], Tuple[threading.Event, int]] = {}
+
+    def path(self, track_id: str, ext: str) -> Path:
+        return self.root / ext / track_id[:2] / f'{track_id}.{ext}'
+
+    def has(self, track_id: str, ext: str) -> bool:
+        return self.path(track_id, ext).is_file()
+
+    def link_into(self, track_id: str, ext: str, target: PurePath) -> bool:
+        """ Links the stored copy of a track to `target`, after waiting for a download of it in progress.
+
+        Returns False if the track is not stored yet. The caller then owns its download, and has to
+        publish() it when done and call finish() in any case.
+        """
+        key = (track_id, ext)
+        source = self.path(track_id, ext)
+        while True:
+            with self._lock:
+                if source.is_file():
+                    break
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    self._in_flight[key] = (threading.Event(), threading.get_ident())
+                    return False
+            in_flight[0].wait()
+
+        self.link(source, target)
+        lyrics = source.with_suffix('.lrc')
+        if lyrics.is_file():
+            self.link(lyrics, lyrics_path(target))
+        return True
+
+    def publish(self, track_id: str, ext: str, filename: PurePath) -> None:
+        """ Moves a finished download (and its lyrics) into the store and puts a link in its place """
+        source = self.path(track_id, ext)
+        source.parent.mkdir(parents=True, exist_ok=True)
+        for downloaded, stored in ((Path(filename), source),
+                                   (lyrics_path(filename), source.with_suffix('.lrc'))):
+            if downloaded.is_file():
+                shutil.move(downloaded, stored)
+                self.link(stored, downloaded)
+
+    def finish(self, track_id: str, ext: str) -> None:
+        """ Ends a download owned by this thread, waiting workers then link it or take over """
+        with self._lock:
+            in_flight = self._in_flight.get((track_id, ext))
+            if in_flight is None or in_flight[1] != threading.get_ident():
+                return
+            del self._in_flight[(track_id, ext)]
+        in_flight[0].set()
+
+    def link(self, source: PurePath, target: PurePath) -> None:
+        """ Links `source` to `target` with the configured mode, copying where linking isn't possible """
+        target = Path(target)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists() or target.is_symlink():
+            target.unlink()
+        try:
+            if self.link_mode == 'hardlink':
+                os.link(source, target)
+                return
+            if self.link_mode == 'reflink':
+                reflink(source, target)
+                return
+            if self.link_mode == 'symlink':
+                target.symlink_to(Path(source).resolve())
+                return
+        except OSError:
+            # e.g. the store is on another file system
+            pass
+        shutil.copyfile(source, target)
@@ -1,8 +1,8 @@
 import sys
 from enum import Enum
-from tqdm import tqdm
 
 from zotify.config import *
+from zotify.progress import ProgressBar, ProgressRenderer
 from zotify.zotify import Zotify
 
 
@@ -18,24 +18,42 @@ class PrintChannel(Enum):
 
 
 ERROR_CHANNEL = [PrintChannel.ERRORS, PrintChannel.API_ERRORS]
+MESSAGE_CHANNEL = [PrintChannel.ERRORS, PrintChannel.API_ERRORS, PrintChannel.WARNINGS]
 
 
 class Printer:
+    # draws every loader and progress bar, and keeps printed messages clear of them
+    RENDERER = ProgressRenderer()
+
     @staticmethod
     def print(channel: PrintChannel, msg: str) -> None:
+        if Zotify.EVENTS is not None and Zotify.EVENTS.to_stdout:
+            # the event log owns stdout, only messages without an event of their own are passed on
+            if channel in MESSAGE_CHANNEL and Zotify.CONFIG.get(channel.value):
+                Zotify.EVENTS.emit('message', level=channel.name.lower(), message=msg.strip().strip('#').strip())
+            return
         if Zotify.CONFIG.get(channel.value):
             if channel in ERROR_CHANNEL:
-                print(msg, file=sys.stderr)
+                Printer.RENDERER.write(msg, file=sys.stderr)
             else:
-                print(msg)
+                Printer.RENDERER.write(msg)
 
     @staticmethod
-    def print_loader(channel: PrintChannel, msg: str) -> None:
-        if Zotify.CONFIG.get(channel.value):
-            print(msg, flush=True, end="")
+    def event(event: str, **fields) -> None:
+        """ Records a structured event when LOG_FORMAT is json, and the skips of a --plan run """
+        if Zotify.EVENTS is not None:
+            Zotify.EVENTS.emit(event, **fields)
+        if Zotify.PLAN is not None:
+            Zotify.PLAN.observe(event, fields)
+
+    @staticmethod
+    def shows_progress() -> bool:
+        """ Whether loaders and progress bars are shown at all """
+        return Zotify.EVENTS is None or not Zotify.EVENTS.to_stdout
 
     @staticmethod
     def progress(iterable=None, desc=None, total=None, unit='it', disable=False, unit_scale=False, unit_divisor=1000):
-        if not Zotify.CONFIG.get(PrintChannel.DOWNLOAD_PROGRESS.value):
+        if not Zotify.CONFIG.get(PrintChannel.DOWNLOAD_PROGRESS.value) or not Printer.shows_progress():
             disable = True
-        return tqdm(iterable=iterable, desc=desc, total=total, disable=disable, unit=unit, unit_scale=unit_scale, unit_divisor=unit_divisor)
+        return ProgressBar(Printer.RENDERER, iterable=iterable, desc=desc, total=total, disable=disable, unit=unit,
+                           unit_scale=unit_scale, unit_divisor=unit_divisor)
@@ -0,0 +1,83 @@
+import threading
+import time
+
+
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    """ Parses sizes like '512K' or '2M' into bytes, '' and '0' mean no limit """
+    value = str(value).strip().upper().rstrip('B')
+    if not value:
+        return 0
+    suffix = value[-1] if value[-1] in SIZE_SUFFIXES else ''
+    number = value[:-1] if suffix else value
+    return int(float(number) * SIZE_SUFFIXES[suffix])
+
+
+class TokenBucket:
+    """ Thread-safe token bucket refilling at `rate` bytes per second with a burst of one second.
+
+    Consumers may overdraw the bucket, they then sleep until the debt is paid back, which keeps
+    the average rate exact regardless of the chunk size.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: int) -> float:
+        """ Takes `amount` tokens and returns how long the caller has to wait before using them """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def consume(self, amount: int) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class StreamThrottle:
+    """ Throttle of a single stream, charged against its own bucket and the shared one """
+
+    def __init__(self, stream_bucket, total_bucket):
+        self._stream_bucket = stream_bucket
+        self._total_bucket = total_bucket
+
+    def reserve(self, amount: int) -> float:
+        """ Charges `amount` bytes without blocking and returns the required wait in seconds """
+        if amount <= 0:
+            return 0.0
+        wait = 0.0
+        if self._stream_bucket is not None:
+            wait = self._stream_bucket.reserve(amount)
+        if self._total_bucket is not None:
+            wait = max(wait, self._total_bucket.reserve(amount))
+        return wait
+
+    def consume(self, amount: int) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class BandwidthLimiter:
+    """ Caps the aggregate download rate of all streams and, optionally, the rate of each stream """
+
+    def __init__(self):
+        self.configure(0, 0)
+
+    def configure(self, total_rate: int, stream_rate: int) -> None:
+        self._total_bucket = TokenBucket(total_rate) if total_rate > 0 else None
+        self._stream_rate = stream_rate
+
+    def stream(self) -> StreamThrottle:
+        """ Returns the throttle for a new stream """
+        stream_bucket = TokenBucket(self._stream_rate) if self._stream_rate > 0 else None
+        return StreamThrottle(stream_bucket, self._total_bucket)
@@ -1,39 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePath
+import json
 import math
-import re
 import time
 import uuid
-from typing import Any, Tuple, List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 from librespot.metadata import TrackId
 import ffmpy
+import requests
 
 from zotify.const import TRACKS, ALBUM, GENRES, NAME, ITEMS, DISC_NUMBER, TRACK_NUMBER, IS_PLAYABLE, ARTISTS, IMAGES, URL, \
     RELEASE_DATE, ID, TRACKS_URL, FOLLOWED_ARTISTS_URL, SAVED_TRACKS_URL, TRACK_STATS_URL, CODEC_MAP, EXT_MAP, DURATION_MS, \
-    HREF, ARTISTS, WIDTH
+    HREF, ARTISTS, WIDTH, ERROR
+from zotify.paginator import Paginator
 from zotify.termoutput import Printer, PrintChannel
+from zotify.paths import PathPlanner, partial_filename
 from zotify.utils import fix_filename, set_audio_tags, set_music_thumbnail, create_download_directory, \
-    get_directory_song_ids, add_to_directory_song_ids, get_previously_downloaded, add_to_archive, fmt_seconds
+    add_to_directory_song_ids, add_to_archive, is_recorded, fmt_seconds, run_jobs
+from zotify.watchdog import EMPTY_READS, StageTimeout, Watchdog
 from zotify.zotify import Zotify
 import traceback
 from zotify.loader import Loader
 
 
-def get_saved_tracks() -> list:
-    """ Returns user's saved tracks """
-    songs = []
-    offset = 0
-    limit = 50
+# lyrics are fetched in the background while the audio of a track is streamed
+LYRICS_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='lyrics')
+# downloads that fail with one of these are tried once more at the end of their run
+TIMEOUT_ERRORS = (StageTimeout, requests.exceptions.Timeout)
 
-    while True:
-        resp = Zotify.invoke_url_with_params(
-            SAVED_TRACKS_URL, limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
 
-    return songs
+def get_saved_tracks() -> Paginator:
+    """ Returns user's saved tracks """
+    return Paginator(SAVED_TRACKS_URL, limit=50, market='from_token')
 
 
 def get_followed_artists() -> list:
@@ -46,47 +45,103 @@ def get_followed_artists() -> list:
     return artists
 
 
-def get_song_info(song_id) -> Tuple[List[str], List[Any], str, str, Any, Any, Any, Any, Any, Any, int]:
+class TrackInfo:
+    """ Compact track metadata record.
+
+    Built from full track objects as well as from the (partial) track objects contained in
+    playlist, album and liked songs listings. Fields missing from a listing are left as None
+    and only fetched when the track is actually downloaded.
+    """
+    __slots__ = ('id', 'name', 'artists', 'artist_urls', 'album_name', 'image_url', 'release_year',
+                 'disc_number', 'track_number', 'is_playable', 'duration_ms')
+
+    def __init__(self, **fields):
+        for slot in self.__slots__:
+            setattr(self, slot, fields.get(slot))
+
+    @classmethod
+    def from_json(cls, track: dict, album: Optional[dict] = None) -> 'TrackInfo':
+        """ Builds a record from a track object, `album` is used for simplified album tracks """
+        album = track.get(ALBUM) or album or {}
+        images = [image for image in album.get(IMAGES) or [] if image.get(URL)]
+        release_date = album.get(RELEASE_DATE)
+        artists = track.get(ARTISTS)
+        return cls(
+            id=track.get(ID),
+            name=track.get(NAME),
+            artists=tuple(artist[NAME] for artist in artists) if artists else None,
+            artist_urls=tuple(artist[HREF] for artist in artists) if artists else None,
+            album_name=album.get(NAME),
+            image_url=max(images, key=lambda image: image.get(WIDTH) or 0)[URL] if images else None,
+            release_year=release_date.split('-')[0] if release_date else None,
+            disc_number=track.get(DISC_NUMBER),
+            track_number=track.get(TRACK_NUMBER),
+            is_playable=track.get(IS_PLAYABLE),
+            duration_ms=track.get(DURATION_MS),
+        )
+
+    def to_json(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def is_complete(self) -> bool:
+        return all(getattr(self, slot) is not None for slot in self.__slots__)
+
+    def fill(self, other: 'TrackInfo') -> 'TrackInfo':
+        """ Takes over every field that is missing in this record from `other` """
+        for slot in self.__slots__:
+            if getattr(self, slot) is None:
+                setattr(self, slot, getattr(other, slot))
+        return self
+
+
+def get_song_info(song_id) -> TrackInfo:
     """ Retrieves metadata for downloaded songs """
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
-        (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={song_id}&market=from_token')
+        (raw, info) = Zotify.invoke_url_cached('track', song_id, f'{TRACKS_URL}?ids={song_id}&market=from_token')
 
     if not TRACKS in info:
         raise ValueError(f'Invalid response from TRACKS_URL:\n{raw}')
 
     try:
-        artists = []
-        for data in info[TRACKS][0][ARTISTS]:
-            artists.append(data[NAME])
-
-        album_name = info[TRACKS][0][ALBUM][NAME]
-        name = info[TRACKS][0][NAME]
-        release_year = info[TRACKS][0][ALBUM][RELEASE_DATE].split('-')[0]
-        disc_number = info[TRACKS][0][DISC_NUMBER]
-        track_number = info[TRACKS][0][TRACK_NUMBER]
-        scraped_song_id = info[TRACKS][0][ID]
-        is_playable = info[TRACKS][0][IS_PLAYABLE]
-        duration_ms = info[TRACKS][0][DURATION_MS]
-
-        image = info[TRACKS][0][ALBUM][IMAGES][0]
-        for i in info[TRACKS][0][ALBUM][IMAGES]:
-            if i[WIDTH] > image[WIDTH]:
-                image = i
-        image_url = image[URL]
-
-        return artists, info[TRACKS][0][ARTISTS], album_name, name, image_url, release_year, disc_number, track_number, scraped_song_id, is_playable, duration_ms
+        track_info = TrackInfo.from_json(info[TRACKS][0])
     except Exception as e:
         raise ValueError(f'Failed to parse TRACKS_URL response: {str(e)}\n{raw}')
-
-
-def get_song_genres(rawartists: List[str], track_name: str) -> List[str]:
+    if not track_info.is_complete():
+        raise ValueError(f'Failed to parse TRACKS_URL response: incomplete track object\n{raw}')
+    return track_info
+
+
+def get_songs_info(song_ids: List[str]) -> Dict[str, TrackInfo]:
+    """ Retrieves metadata of many songs, 50 per request, songs in the metadata cache are not requested """
+    infos = {}
+    missing = []
+    for song_id in song_ids:
+        cached = Zotify.METADATA_CACHE.get('track', song_id) if Zotify.METADATA_CACHE is not None else None
+        if cached and cached.get(TRACKS):
+            infos[song_id] = TrackInfo.from_json(cached[TRACKS][0])
+        else:
+            missing.append(song_id)
+
+    for i in range(0, len(missing), 50):
+        batch = missing[i:i + 50]
+        (raw, resp) = Zotify.invoke_url(f'{TRACKS_URL}?ids={",".join(batch)}&market=from_token')
+        # tracks come back in the order of the ids, relinked tracks carry a different id
+        for song_id, track in zip(batch, resp.get(TRACKS) or []):
+            if track:
+                infos[song_id] = TrackInfo.from_json(track)
+                if Zotify.METADATA_CACHE is not None:
+                    Zotify.METADATA_CACHE.put('track', song_id, {TRACKS: [track]})
+    return infos
+
+
+def get_song_genres(artist_urls: List[str], track_name: str) -> List[str]:
     if Zotify.CONFIG.get_save_genres():
         try:
             genres = []
-            for data in rawartists:
+            for artist_url in artist_urls:
                 # query artist genres via href, which will be the api url
                 with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
-                    (raw, artistInfo) = Zotify.invoke_url(f'{data[HREF]}')
+                    (raw, artistInfo) = Zotify.invoke_url_cached('artist', artist_url.rsplit('/', 1)[-1], f'{artist_url}')
                 if Zotify.CONFIG.get_all_genres() and len(artistInfo[GENRES]) > 0:
                     for genre in artistInfo[GENRES]:
                         genres.append(genre)
@@ -104,31 +159,49 @@ def get_song_genres(rawartists: List[str], track_name: str) -> List[str]:
         return ['']
 
 
-def get_song_lyrics(song_id: str, file_save: str) -> None:
+def fetch_song_lyrics(song_id: str) -> List[str]:
+    """ Returns the lines of the song's .lrc file, tracks known to have no lyrics are not requested again """
+    cache = Zotify.METADATA_CACHE
+    if cache is not None and cache.has('lyrics_miss', song_id):
+        raise ValueError(f'Failed to fetch lyrics: {song_id}')
+
     raw, lyrics = Zotify.invoke_url(f'https://spclient.wg.spotify.com/color-lyrics/v2/track/{song_id}')
 
-    if lyrics:
+    if lyrics and 'lyrics' in lyrics:
         try:
             formatted_lyrics = lyrics['lyrics']['lines']
         except KeyError:
             raise ValueError(f'Failed to fetch lyrics: {song_id}')
         if(lyrics['lyrics']['syncType'] == "UNSYNCED"):
-            with open(file_save, 'w+', encoding='utf-8') as file:
-                for line in formatted_lyrics:
-                    file.writelines(line['words'] + '\n')
-            return
+            return [line['words'] + '\n' for line in formatted_lyrics]
         elif(lyrics['lyrics']['syncType'] == "LINE_SYNCED"):
-            with open(file_save, 'w+', encoding='utf-8') as file:
-                for line in formatted_lyrics:
-                    timestamp = int(line['startTimeMs'])
-                    ts_minutes = str(math.floor(timestamp / 60000)).zfill(2)
-                    ts_seconds = str(math.floor((timestamp % 60000) / 1000)).zfill(2)
-                    ts_millis = str(math.floor(timestamp % 1000))[:2].zfill(2)
-                    file.writelines(f'[{ts_minutes}:{ts_seconds}.{ts_millis}]' + line['words'] + '\n')
-            return
+            lines = []
+            for line in formatted_lyrics:
+                timestamp = int(line['startTimeMs'])
+                ts_minutes = str(math.floor(timestamp / 60000)).zfill(2)
+                ts_seconds = str(math.floor((timestamp % 60000) / 1000)).zfill(2)
+                ts_millis = str(math.floor(timestamp % 1000))[:2].zfill(2)
+                lines.append(f'[{ts_minutes}:{ts_seconds}.{ts_millis}]' + line['words'] + '\n')
+            return lines
+
+    # remember tracks without lyrics, but not failures that may be temporary, e.g. the 'unknown'
+    # status of an empty response
+    error = (lyrics or {}).get(ERROR)
+    no_lyrics = (bool(lyrics) and error is None) or (isinstance(error, dict) and error.get('status') == 404)
+    if cache is not None and no_lyrics:
+        cache.put('lyrics_miss', song_id, True)
     raise ValueError(f'Failed to fetch lyrics: {song_id}')
 
 
+def write_song_lyrics(lines: List[str], file_save: str) -> None:
+    with open(file_save, 'w+', encoding='utf-8') as file:
+        file.writelines(lines)
+
+
+def get_song_lyrics(song_id: str, file_save: str) -> None:
+    write_song_lyrics(fetch_song_lyrics(song_id), file_save)
+
+
 def get_song_duration(song_id: str) -> float:
     """ Retrieves duration of song in second as is on spotify """
 
@@ -142,59 +215,103 @@ def get_song_duration(song_id: str) -> float:
     return duration
 
 
-def download_track(mode: str, track_id: str, extra_keys=None, disable_progressbar=False) -> None:
-    """ Downloads raw song audio from Spotify """
+def download_track(mode: str, track_id: str, extra_keys=None, disable_progressbar=False,
+                   track_info: Optional[TrackInfo] = None, planner: Optional[PathPlanner] = None,
+                   output_template: Optional[str] = None, requeue: Optional[Callable[[], None]] = None) -> bool:
+    """ Downloads raw song audio from Spotify, `track_info` may carry metadata already known from a listing
+    and `planner` is shared by all tracks of one playlist or album. `output_template` replaces the
+    configured output of `mode`, e.g. to download a track again to the path it already had. `requeue`
+    is called when the download is given up on because it timed out. Returns False if the download
+    failed, True if it succeeded or there was nothing to download """
 
     if extra_keys is None:
         extra_keys = {}
+    if planner is None:
+        planner = PathPlanner()
+    reserved = False
+    completed = False
+    claimed = False
+    # what --retry-failed needs to repeat this download
+    failure_id = track_id
+    failure_context = {'mode': mode, 'extra_keys': extra_keys}
+    if output_template is not None:
+        failure_context['output_template'] = output_template
+    failed = False
+    watchdog = Watchdog(Zotify.CONFIG.get_stream_stall_timeout(), Zotify.CONFIG.get_track_deadline())
+    stream = None
 
     prepare_download_loader = Loader(PrintChannel.PROGRESS_INFO, "Preparing download...")
     prepare_download_loader.start()
 
     try:
-        output_template = Zotify.CONFIG.get_output(mode)
+        if output_template is None:
+            output_template = Zotify.CONFIG.get_output(mode)
 
-        (artists, raw_artists, album_name, name, image_url, release_year, disc_number,
-         track_number, scraped_song_id, is_playable, duration_ms) = get_song_info(track_id)
+        if track_info is None:
+            track_info = get_song_info(track_id)
+        elif not track_info.is_complete():
+            track_info.fill(get_song_info(track_id))
+        watchdog.check('metadata')
 
-        song_name = fix_filename(artists[0]) + ' - ' + fix_filename(name)
+        artists, artist_urls, album_name, name = track_info.artists, track_info.artist_urls, track_info.album_name, track_info.name
+        image_url, release_year, disc_number, track_number = track_info.image_url, track_info.release_year, track_info.disc_number, track_info.track_number
+        scraped_song_id, is_playable, duration_ms = track_info.id, track_info.is_playable, track_info.duration_ms
 
-        for k in extra_keys:
-            output_template = output_template.replace("{"+k+"}", fix_filename(extra_keys[k]))
+        song_name = fix_filename(artists[0]) + ' - ' + fix_filename(name)
 
         ext = EXT_MAP.get(Zotify.CONFIG.get_download_format().lower())
 
-        output_template = output_template.replace("{artist}", fix_filename(artists[0]))
-        output_template = output_template.replace("{album}", fix_filename(album_name))
-        output_template = output_template.replace("{song_name}", fix_filename(name))
-        output_template = output_template.replace("{release_year}", fix_filename(release_year))
-        output_template = output_template.replace("{disc_number}", fix_filename(disc_number))
-        output_template = output_template.replace("{track_number}", fix_filename(track_number))
-        output_template = output_template.replace("{id}", fix_filename(scraped_song_id))
-        output_template = output_template.replace("{track_id}", fix_filename(track_id))
-        output_template = output_template.replace("{ext}", ext)
-
-        filename = PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
+        values = {
+            'artist': fix_filename(artists[0]),
+            'album': fix_filename(album_name),
+            'song_name': fix_filename(name),
+            'release_year': fix_filename(release_year),
+            'disc_number': fix_filename(disc_number),
+            'track_number': fix_filename(track_number),
+            'id': fix_filename(scraped_song_id),
+            'track_id': fix_filename(track_id),
+            'ext': ext,
+        }
+        # extra keys take precedence, e.g. the album artist when downloading an album
+        for k in extra_keys:
+            values[k] = fix_filename(extra_keys[k])
+
+        filename = PurePath(Zotify.CONFIG.get_root_path()).joinpath(planner.template(output_template).render(values))
         filedir = PurePath(filename).parent
 
-        filename_temp = filename
-        if Zotify.CONFIG.get_temp_download_dir() != '':
-            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{str(uuid.uuid4())}_{track_id}.{ext}')
+        check_all_time = scraped_song_id in planner.previously_downloaded() or \
+            (Zotify.PLAN is not None and Zotify.PLAN.has_track(scraped_song_id))
+        directory = planner.directory(filedir)
+        with directory.lock:
+            check_name = directory.has_file(filename.name)
+            check_id = scraped_song_id in directory.song_ids
 
-        check_name = Path(filename).is_file() and Path(filename).stat().st_size
-        check_id = scraped_song_id in get_directory_song_ids(filedir)
-        check_all_time = scraped_song_id in get_previously_downloaded()
+            # a song with the same name is installed
+            if not check_id and check_name:
+                filename = filedir.joinpath(directory.free_name(filename.name))
 
-        # a song with the same name is installed
-        if not check_id and check_name:
-            c = len([file for file in Path(filedir).iterdir() if re.search(f'^{filename}_', str(file))]) + 1
+            # claim a new name right away so that concurrent downloads don't pick the same one
+            if not (check_id and check_name):
+                directory.reserve(filename.name, scraped_song_id)
+                reserved = True
 
-            fname = PurePath(PurePath(filename).name).parent
-            ext = PurePath(PurePath(filename).name).suffix
+        if Zotify.CONFIG.get_temp_download_dir() != '':
+            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{str(uuid.uuid4())}_{track_id}.{ext}')
+        else:
+            # an interrupted download never leaves a truncated file under the name of the track
+            filename_temp = partial_filename(filename, scraped_song_id)
 
-            filename = PurePath(filedir).joinpath(f'{fname}_{c}{ext}')
+        # other processes sharing the archive skip a track claimed here, the archive decides
+        # whether a track is downloaded once or once per file. With a content store every file
+        # is claimed on its own, the store makes sure the track itself is downloaded once
+        claim_key = scraped_song_id if Zotify.CONFIG.get_skip_previously_downloaded() and Zotify.STORE is None else str(filename)
 
     except Exception as e:
+        failed = True
+        Zotify.record_failure('track', failure_id, failure_context, e)
+        if isinstance(e, TIMEOUT_ERRORS) and requeue is not None:
+            requeue()
+        Printer.event('track_failed', id=track_id, stage='metadata', error=str(e), context=extra_keys)
         Printer.print(PrintChannel.ERRORS, '###   SKIPPING SONG - FAILED TO QUERY METADATA   ###')
         Printer.print(PrintChannel.ERRORS, 'Track_ID: ' + str(track_id))
         for k in extra_keys:
@@ -204,31 +321,140 @@ def download_track(mode: str, track_id: str, extra_keys=None, disable_progressba
         Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
 
     else:
+        def record_download():
+            # add song id to archive file
+            if Zotify.CONFIG.get_skip_previously_downloaded():
+                add_to_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
+                planner.add_to_archive(scraped_song_id)
+            # add song id to download directory's .song_ids file
+            if not check_id:
+                add_to_directory_song_ids(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
+            directory.add(PurePath(filename).name, scraped_song_id)
+
+        def recorded_since() -> Optional[str]:
+            # the skip reason if another process recorded the track since the planner read the archive
+            # and .song_ids, only processes sharing them through claims can do that
+            if Zotify.CLAIMS is None:
+                return None
+            if Zotify.CONFIG.get_skip_existing() and is_recorded(PurePath(filedir).joinpath('.song_ids'), scraped_song_id):
+                return 'exists'
+            if Zotify.CONFIG.get_skip_previously_downloaded() and is_recorded(Zotify.CONFIG.get_song_archive(), scraped_song_id):
+                return 'archived'
+            return None
+
+        def extra_format_outputs() -> List[Tuple[str, PurePath]]:
+            # the other formats of DOWNLOAD_FORMAT, under their own root path
+            extra_outputs = []
+            for extra_format in Zotify.CONFIG.get_download_formats()[1:]:
+                extra_ext = EXT_MAP.get(extra_format)
+                extra_root = Zotify.CONFIG.get_format_root_paths().get(extra_format, Zotify.CONFIG.get_root_path())
+                extra_path = PurePath(extra_root).joinpath(planner.template(output_template).render({**values, 'ext': extra_ext}))
+                # takes over the name given to the main file if it clashed with another song
+                extra_path = extra_path.with_name(f'{PurePath(filename).stem}.{extra_ext}')
+                if extra_path != filename and extra_path not in (path for _, path in extra_outputs):
+                    extra_outputs.append((extra_format, extra_path))
+            return extra_outputs
+
+        def tag_outputs(outputs: List[PurePath]) -> None:
+            genres = get_song_genres(artist_urls, name)
+            try:
+                for output in outputs:
+                    set_audio_tags(output, artists, genres, name, album_name, release_year, disc_number, track_number)
+                # the artwork is downloaded once for every format
+                image = requests.get(image_url, timeout=Zotify.CONFIG.get_http_timeout()).content
+                for output in outputs:
+                    set_music_thumbnail(output, image_url, image)
+            except Exception:
+                Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure ffmpeg is installed and added to your PATH.")
+
+        def add_missing_formats() -> List[PurePath]:
+            # a track that is in place already, e.g. linked from the content store or downloaded before
+            # DOWNLOAD_FORMAT listed more formats, is converted into the ones it lacks
+            missing = [(extra_format, path) for extra_format, path in extra_format_outputs() if not Path(path).exists()]
+            if not missing:
+                return []
+            try:
+                written = convert_extra_formats(filename, missing, scraped_song_id)
+            except ffmpy.FFRuntimeError as e:
+                # the track itself is in place, the formats are added by the next run
+                Printer.print(PrintChannel.WARNINGS, f'###   Could not add formats to "{song_name}": {e}   ###')
+                return []
+            if written:
+                tag_outputs(written)
+                Printer.print(PrintChannel.DOWNLOADS, f'###   Added {", ".join(path.suffix[1:] for path in written)} to "{song_name}"   ###' + "\n")
+            return written
+
         try:
             if not is_playable:
                 prepare_download_loader.stop()
+                Printer.event('track_skipped', id=scraped_song_id, name=song_name, reason='unavailable')
                 Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG IS UNAVAILABLE)   ###' + "\n")
             else:
                 if check_id and check_name and Zotify.CONFIG.get_skip_existing():
                     prepare_download_loader.stop()
+                    Printer.event('track_skipped', id=scraped_song_id, name=song_name, reason='exists', path=str(filename))
                     Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG ALREADY EXISTS)   ###' + "\n")
+                    if Zotify.PLAN is None:
+                        add_missing_formats()
 
-                elif check_all_time and Zotify.CONFIG.get_skip_previously_downloaded():
+                elif check_all_time and Zotify.CONFIG.get_skip_previously_downloaded() and \
+                        not (Zotify.STORE is not None and Zotify.STORE.has(scraped_song_id, ext)):
                     prepare_download_loader.stop()
+                    Printer.event('track_skipped', id=scraped_song_id, name=song_name, reason='archived')
                     Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG ALREADY DOWNLOADED ONCE)   ###' + "\n")
 
+                elif Zotify.PLAN is not None:
+                    prepare_download_loader.stop()
+                    if Zotify.STORE is not None and Zotify.STORE.has(scraped_song_id, ext):
+                        Printer.event('track_skipped', id=scraped_song_id, name=song_name, reason='linked', path=str(filename))
+                    else:
+                        Zotify.PLAN.add_track({
+                            'mode': mode,
+                            'track_id': scraped_song_id,
+                            'extra_keys': extra_keys,
+                            'output': str(PurePath(filename).relative_to(Zotify.CONFIG.get_root_path()).with_suffix('')) + '.{ext}',
+                            'track_info': track_info.to_json(),
+                        }, song_name, str(filename), duration_ms)
+                    # later tracks see this one as downloaded, like they would in a real run
+                    directory.add(PurePath(filename).name, scraped_song_id)
+                    completed = True
+
+                # set right away, a claim is released below whatever happens after it was taken
+                elif not (claimed := Zotify.claim(claim_key)):
+                    prepare_download_loader.stop()
+                    Printer.event('track_skipped', id=scraped_song_id, name=song_name, reason='claimed')
+                    Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG IS DOWNLOADED BY ANOTHER PROCESS)   ###' + "\n")
+
+                # a process that finished it after the archive was read has given up its claim on exit
+                elif (recorded := recorded_since()) is not None:
+                    prepare_download_loader.stop()
+                    Printer.event('track_skipped', id=scraped_song_id, name=song_name, reason=recorded)
+                    Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + (' (SONG ALREADY EXISTS)   ###' if recorded == 'exists' else ' (SONG ALREADY DOWNLOADED ONCE)   ###') + "\n")
+
+                elif Zotify.STORE is not None and Zotify.STORE.link_into(scraped_song_id, ext, filename):
+                    prepare_download_loader.stop()
+                    Printer.print(PrintChannel.DOWNLOADS, f'###   Linked "{song_name}" to "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" from the content store   ###' + "\n")
+                    extra_paths = add_missing_formats()
+                    Printer.event('track_linked', id=scraped_song_id, name=song_name, path=str(filename),
+                                  extra_paths=[str(path) for path in extra_paths])
+                    record_download()
+                    completed = True
+
                 else:
                     if track_id != scraped_song_id:
                         track_id = scraped_song_id
                     track = TrackId.from_base62(track_id)
-                    stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
+                    Printer.event('track_started', id=track_id, name=song_name, context=extra_keys)
+                    # fetch the lyrics while the audio is streaming
+                    lyrics_future = LYRICS_EXECUTOR.submit(fetch_song_lyrics, track_id) if Zotify.CONFIG.get_download_lyrics() else None
+                    stream = watchdog.call('open', Zotify.get_content_stream, track, Zotify.DOWNLOAD_QUALITY)
                     create_download_directory(filedir)
                     total_size = stream.input_stream.size
 
                     prepare_download_loader.stop()
 
                     time_start = time.time()
-                    downloaded = 0
+                    throttle = Zotify.BANDWIDTH.stream()
                     with open(filename_temp, 'wb') as file, Printer.progress(
                             desc=song_name,
                             total=total_size,
@@ -237,53 +463,78 @@ def download_track(mode: str, track_id: str, extra_keys=None, disable_progressba
                             unit_divisor=1024,
                             disable=disable_progressbar
                     ) as p_bar:
-                        b = 0
-                        while b < 5:
-                        #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                            data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
+                        empty_reads = 0
+                        # reads that hang for longer than STREAM_STALL_TIMEOUT abort the download
+                        reader = watchdog.reader('stream', lambda: stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size()))
+
+                        def read_chunk() -> Optional[int]:
+                            nonlocal empty_reads
+                            data = reader.read()
                             p_bar.update(file.write(data))
-                            downloaded += len(data)
-                            b += 1 if data == b'' else 0
+                            empty_reads += 1 if data == b'' else 0
+                            return len(data) if empty_reads < EMPTY_READS else None
+
+                        try:
                             if Zotify.CONFIG.get_download_real_time():
-                                delta_real = time.time() - time_start
-                                delta_want = (downloaded / total_size) * (duration_ms/1000)
-                                if delta_want > delta_real:
-                                    time.sleep(delta_want - delta_real)
+                                Zotify.PACER.pace(read_chunk, total_size, duration_ms / 1000, throttle)
+                            else:
+                                while True:
+                                    size = read_chunk()
+                                    if size is None:
+                                        break
+                                    throttle.consume(size)
+                        finally:
+                            reader.close()
 
                     time_downloaded = time.time()
+                    watchdog.check('convert')
+
+                    # the other formats are converted from the same stream, only those written are tagged
+                    extra_paths = convert_audio_format(filename_temp, extra_format_outputs())
+                    tag_outputs([filename_temp] + extra_paths)
 
-                    genres = get_song_genres(raw_artists, name)
+                    Path(filename_temp).replace(filename)
 
-                    if(Zotify.CONFIG.get_download_lyrics()):
+                    # the audio is in place by now, lyrics never fail the download
+                    if lyrics_future is not None:
                         try:
-                            get_song_lyrics(track_id, PurePath(str(filename)[:-3] + "lrc"))
+                            write_song_lyrics(lyrics_future.result(), PurePath(str(filename)[:-3] + "lrc"))
                         except ValueError:
                             Printer.print(PrintChannel.SKIPS, f"###   Skipping lyrics for {song_name}: lyrics not available   ###")
-                    convert_audio_format(filename_temp)
-                    try:
-                        set_audio_tags(filename_temp, artists, genres, name, album_name, release_year, disc_number, track_number)
-                        set_music_thumbnail(filename_temp, image_url)
-                    except Exception:
-                        Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure ffmpeg is installed and added to your PATH.")
+                        except Exception as e:
+                            Printer.print(PrintChannel.WARNINGS, f"###   Skipping lyrics for {song_name}: {e}   ###")
 
-                    if filename_temp != filename:
-                        Path(filename_temp).rename(filename)
+                    if Zotify.STORE is not None:
+                        Zotify.STORE.publish(scraped_song_id, ext, filename)
 
                     time_finished = time.time()
 
+                    Printer.event('track_downloaded', id=scraped_song_id, name=song_name, path=str(filename), bytes=total_size,
+                                  extra_paths=[str(path) for path in extra_paths],
+                                  download_seconds=round(time_downloaded - time_start, 3),
+                                  convert_seconds=round(time_finished - time_downloaded, 3))
                     Printer.print(PrintChannel.DOWNLOADS, f'###   Downloaded "{song_name}" to "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" in {fmt_seconds(time_downloaded - time_start)} (plus {fmt_seconds(time_finished - time_downloaded)} converting)   ###' + "\n")
 
-                    # add song id to archive file
-                    if Zotify.CONFIG.get_skip_previously_downloaded():
-                        add_to_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
-                    # add song id to download directory's .song_ids file
-                    if not check_id:
-                        add_to_directory_song_ids(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
+                    record_download()
+                    completed = True
 
                     if Zotify.CONFIG.get_bulk_wait_time():
                         time.sleep(Zotify.CONFIG.get_bulk_wait_time())
         except Exception as e:
-            Printer.print(PrintChannel.ERRORS, '###   SKIPPING: ' + song_name + ' (GENERAL DOWNLOAD ERROR)   ###')
+            failed = True
+            Zotify.record_failure('track', failure_id, failure_context, e)
+            timed_out = isinstance(e, TIMEOUT_ERRORS)
+            if isinstance(e, StageTimeout) and stream is not None:
+                # frees the connection, the read that hangs is abandoned on its own thread
+                try:
+                    stream.input_stream.stream().close()
+                except Exception:
+                    pass
+            if timed_out and requeue is not None:
+                requeue()
+            Printer.event('track_failed', id=track_id, name=song_name, stage='download', error=str(e), context=extra_keys,
+                          timeout=e.stage if isinstance(e, StageTimeout) else 'http' if timed_out else None)
+            Printer.print(PrintChannel.ERRORS, '###   SKIPPING: ' + song_name + (' (TIMED OUT)   ###' if timed_out else ' (GENERAL DOWNLOAD ERROR)   ###'))
             Printer.print(PrintChannel.ERRORS, 'Track_ID: ' + str(track_id))
             for k in extra_keys:
                 Printer.print(PrintChannel.ERRORS, k + ': ' + str(extra_keys[k]))
@@ -293,15 +544,76 @@ def download_track(mode: str, track_id: str, extra_keys=None, disable_progressba
             if Path(filename_temp).exists():
                 Path(filename_temp).unlink()
 
+    if reserved and not completed:
+        directory.release(PurePath(filename).name, None if check_id else scraped_song_id)
+    if claimed:
+        Zotify.release_claim(claim_key, completed)
+        if Zotify.STORE is not None:
+            Zotify.STORE.finish(scraped_song_id, ext)
+    if not failed:
+        Zotify.resolve_failure('track', failure_id)
     prepare_download_loader.stop()
+    return not failed
+
+
+def download_tracks(jobs: Iterable[dict], journal: Optional[str] = None) -> None:
+    """ Downloads tracks with up to DOWNLOAD_WORKERS concurrent workers.
+
+    Every job holds the keyword arguments of one download_track call. Jobs are taken from the
+    iterable only as workers become free, so lazily listed playlists stay lazy. With a `journal`
+    name the work list is journaled, and a run of the same name after an interruption continues
+    with the unfinished jobs instead of listing them again.
+    """
+    job_journal = Zotify.open_journal(journal, key=journal_key) if journal is not None else None
+    if job_journal is None:
+        run_with_requeue(download_track, jobs)
+        return
+
+    planner = PathPlanner()
+    if job_journal.resumed:
+        Printer.print(PrintChannel.PROGRESS_INFO, f'###   Continuing {journal}: {len(job_journal.done)} of '
+                                                  f'{len(job_journal.jobs)} journaled tracks are done   ###')
+
+    def journaled_jobs():
+        for job in jobs:
+            yield {**{k: v for k, v in job.items() if k != 'planner'},
+                   'track_info': job['track_info'].to_json() if job.get('track_info') is not None else None}
+
+    def download_journaled(index: int, job: dict, requeue: Optional[Callable[[], None]] = None) -> None:
+        track_info = TrackInfo(**job['track_info']) if job.get('track_info') is not None else None
+        # a failed track stays unfinished, so a run interrupted after it still tries it again
+        if download_track(**{**job, 'track_info': track_info, 'planner': planner, 'requeue': requeue}):
+            job_journal.complete(index)
+
+    finished = False
+    try:
+        run_with_requeue(download_journaled, (dict(index=index, job=job) for index, job in job_journal.entries(journaled_jobs())))
+        finished = True
+    finally:
+        job_journal.close(finished)
 
 
-def convert_audio_format(filename) -> None:
-    """ Converts raw audio into playable file """
-    temp_filename = f'{PurePath(filename).parent}.tmp'
-    Path(filename).replace(temp_filename)
+def journal_key(job: dict) -> str:
+    """ Tells journaled download_track jobs apart, leaving out the track metadata that may change between runs """
+    return json.dumps({k: v for k, v in job.items() if k != 'track_info'}, sort_keys=True, default=str)
 
-    download_format = Zotify.CONFIG.get_download_format().lower()
+
+def run_with_requeue(function: Callable[..., None], jobs: Iterable[dict]) -> None:
+    """ Runs the download jobs, then once more the ones that timed out, see download_track.
+    Those that time out again are left to the failure queue """
+    requeued = []
+
+    def with_requeue(job: dict) -> dict:
+        return {**job, 'requeue': lambda: requeued.append(job)}
+
+    run_jobs(function, (with_requeue(job) for job in jobs), Zotify.CONFIG.get_download_workers(), name='download')
+    if requeued:
+        Printer.print(PrintChannel.PROGRESS_INFO, f'###   Retrying {len(requeued)} tracks that timed out   ###')
+        run_jobs(function, requeued, Zotify.CONFIG.get_download_workers(), name='download')
+
+
+def get_codec_params(download_format: str) -> List[str]:
+    """ The ffmpeg output options of one download format """
     file_codec = CODEC_MAP.get(download_format, 'copy')
     if file_codec != 'copy':
         bitrate = Zotify.CONFIG.get_transcode_bitrate()
@@ -318,12 +630,29 @@ def convert_audio_format(filename) -> None:
     output_params = ['-c:a', file_codec]
     if bitrate:
         output_params += ['-b:a', bitrate]
+    return output_params
+
+
+def convert_audio_format(filename, extra_outputs: Iterable[Tuple[str, PurePath]] = ()) -> List[PurePath]:
+    """ Converts raw audio into playable file, the (format, path) pairs of `extra_outputs` are
+    written by the same ffmpeg run from the same input. Returns the paths of the extra outputs
+    written, none if ffmpeg is missing """
+    # named after the file, tracks of one directory may be converted at the same time
+    temp_filename = f'{filename}.tmp'
+    Path(filename).replace(temp_filename)
+
+    download_format = Zotify.CONFIG.get_download_format().lower()
+    extra_outputs = list(extra_outputs)
+    outputs = {str(filename): get_codec_params(download_format)}
+    for extra_format, path in extra_outputs:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        outputs[str(path)] = get_codec_params(extra_format)
 
     try:
         ff_m = ffmpy.FFmpeg(
             global_options=['-y', '-hide_banner', '-loglevel error'],
             inputs={temp_filename: None},
-            outputs={filename: output_params}
+            outputs=outputs
         )
         with Loader(PrintChannel.PROGRESS_INFO, "Converting file..."):
             ff_m.run()
@@ -332,4 +661,35 @@ def convert_audio_format(filename) -> None:
             Path(temp_filename).unlink()
 
     except ffmpy.FFExecutableNotFoundError:
-        Printer.print(PrintChannel.WARNINGS, f'###   SKIPPING {file_codec.upper()} CONVERSION - FFMPEG NOT FOUND   ###')
+        Path(temp_filename).replace(filename)
+        Printer.print(PrintChannel.WARNINGS, f'###   SKIPPING {CODEC_MAP.get(download_format, "copy").upper()} CONVERSION - FFMPEG NOT FOUND   ###')
+        return []
+    return [path for _, path in extra_outputs]
+
+
+def convert_extra_formats(source: PurePath, extra_outputs: List[Tuple[str, PurePath]], track_id: str) -> List[PurePath]:
+    """ Converts a file that is in place into the (format, path) pairs of `extra_outputs`, returns
+    the paths written, none if ffmpeg is missing """
+    # staged like downloads, an interrupted conversion doesn't leave a file that looks complete
+    outputs = {}
+    for extra_format, path in extra_outputs:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        outputs[str(partial_filename(PurePath(path), track_id))] = get_codec_params(extra_format)
+
+    try:
+        ff_m = ffmpy.FFmpeg(
+            global_options=['-y', '-hide_banner', '-loglevel error'],
+            inputs={str(source): None},
+            outputs=outputs
+        )
+        with Loader(PrintChannel.PROGRESS_INFO, "Converting file..."):
+            ff_m.run()
+        for (_, path), temp_path in zip(extra_outputs, outputs):
+            Path(temp_path).replace(path)
+    except ffmpy.FFExecutableNotFoundError:
+        Printer.print(PrintChannel.WARNINGS, '###   SKIPPING ADDITIONAL FORMATS - FFMPEG NOT FOUND   ###')
+        return []
+    finally:
+        for temp_path in outputs:
+            Path(temp_path).unlink(missing_ok=True)
+    return [path for _, path in extra_outputs]
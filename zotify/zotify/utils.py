@@ -4,13 +4,21 @@ import os
 import platform
 import re
 import subprocess
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path, PurePath
-from typing import List, Tuple
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
 
 import music_tag
 import requests
 
+try:
+    import fcntl
+except ImportError:  # Windows, appends of a single write are not interleaved there
+    fcntl = None
+
 from zotify.const import ARTIST, GENRE, TRACKTITLE, ALBUM, YEAR, DISCNUMBER, TRACKNUMBER, ARTWORK, \
     WINDOWS_SYSTEM, ALBUMARTIST
 from zotify.zotify import Zotify
@@ -28,10 +36,37 @@ def create_download_directory(download_path: str) -> None:
     # add hidden file with song ids
     hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     if not Path(hidden_file_path).is_file():
-        with open(hidden_file_path, 'w', encoding='utf-8') as f:
+        # append mode, another process may have created and written it in the meantime
+        with open(hidden_file_path, 'a', encoding='utf-8') as f:
             pass
 
 
+def append_line(path, line: str) -> None:
+    """ Appends a line under an exclusive lock, so lines of concurrent processes never interleave """
+    with open(path, 'a', encoding='utf-8') as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        file.write(line)
+        file.flush()
+
+
+def remove_lines(path, song_ids: Set[str]) -> None:
+    """ Drops the lines of the given song ids from an archive or .song_ids file, under the same lock as append_line """
+    if not Path(path).is_file():
+        return
+    with open(path, 'r+', encoding='utf-8') as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        lines = file.readlines()
+        kept = [line for line in lines if line.split('\t', 1)[0].strip() not in song_ids]
+        if len(kept) == len(lines):
+            return
+        file.seek(0)
+        file.writelines(kept)
+        file.truncate()
+        file.flush()
+
+
 def get_previously_downloaded() -> List[str]:
     """ Returns list of all time downloaded songs """
 
@@ -45,17 +80,20 @@ def get_previously_downloaded() -> List[str]:
     return ids
 
 
+def is_recorded(path, song_id: str) -> bool:
+    """ Whether an archive or .song_ids file lists the song id, read from disk instead of a snapshot """
+    if not Path(path).is_file():
+        return False
+    with open(path, 'r', encoding='utf-8') as file:
+        return any(line.split('\t', 1)[0].strip() == song_id for line in file)
+
+
 def add_to_archive(song_id: str, filename: str, author_name: str, song_name: str) -> None:
     """ Adds song id to all time installed songs archive """
 
     archive_path = Zotify.CONFIG.get_song_archive()
 
-    if Path(archive_path).exists():
-        with open(archive_path, 'a', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
-    else:
-        with open(archive_path, 'w', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+    append_line(archive_path, f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
 
 
 def get_directory_song_ids(download_path: str) -> List[str]:
@@ -77,8 +115,7 @@ def add_to_directory_song_ids(download_path: str, song_id: str, filename: str, a
     hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     # not checking if file exists because we need an exception
     # to be raised if something is wrong
-    with open(hidden_file_path, 'a', encoding='utf-8') as file:
-        file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+    append_line(hidden_file_path, f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
 
 
 def get_downloaded_song_duration(filename: str) -> float:
@@ -93,6 +130,79 @@ def get_downloaded_song_duration(filename: str) -> float:
     return duration
 
 
+def run_jobs(function: Callable[..., None], jobs: Iterable[dict], workers: int, name: str = 'worker') -> None:
+    """ Calls `function` with the keyword arguments of every job, using up to `workers` threads.
+
+    Jobs are taken from the iterable only as workers become free, so lazy listings stay lazy.
+    A job that raises is reported and the remaining jobs go on, with one worker as with several.
+    A listing that raises is reported too, the jobs listed until then are still run.
+    """
+    jobs = listed_jobs(jobs, name)
+    if workers <= 1:
+        for job in jobs:
+            try:
+                function(**job)
+            except Exception as e:
+                report_job_error(name, job, e)
+        return
+
+    slots = threading.BoundedSemaphore(workers)
+    # futures are collected as they finish, so at most about `workers` of them are kept
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as executor:
+        for job in jobs:
+            slots.acquire()
+            future = executor.submit(function, **job)
+            future.add_done_callback(lambda _: slots.release())
+            pending[future] = job
+            for done in [future for future in pending if future.done()]:
+                collect_job(name, done, pending.pop(done))
+    for future, job in pending.items():
+        collect_job(name, future, job)
+
+
+def listed_jobs(jobs: Iterable[dict], name: str = 'listing') -> Iterator[dict]:
+    """ Yields the jobs of a listing until it ends or raises, a listing that raises is reported
+    instead of ending the run """
+    iterator = iter(jobs)
+    while True:
+        try:
+            job = next(iterator)
+        except StopIteration:
+            return
+        except Exception as e:
+            report_listing_error(name, e)
+            return
+        yield job
+
+
+def report_listing_error(name: str, error: Exception) -> None:
+    # we need to import that here, otherwise we will get circular imports!
+    from zotify.termoutput import Printer, PrintChannel
+    Printer.event('listing_failed', worker=name, error=str(error), error_class=type(error).__name__)
+    Printer.print(PrintChannel.ERRORS, f'###   LISTING FAILED, ITS REMAINING JOBS ARE SKIPPED: {error}   ###')
+    Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(error).format()) + "\n")
+
+
+def collect_job(name: str, future: Future, job: dict) -> None:
+    try:
+        future.result()
+    except Exception as e:
+        report_job_error(name, job, e)
+
+
+def report_job_error(name: str, job: dict, error: Exception) -> None:
+    """ Prints the error of a job that raised instead of handling it itself """
+    # we need to import that here, otherwise we will get circular imports!
+    from zotify.termoutput import Printer, PrintChannel
+    arguments = {key: value for key, value in job.items() if isinstance(value, (str, int, float, bool))}
+    Printer.event('job_failed', worker=name, job=arguments, error=str(error), error_class=type(error).__name__)
+    Printer.print(PrintChannel.ERRORS, f'###   {name.upper()} FAILED: {error}   ###')
+    for key, value in arguments.items():
+        Printer.print(PrintChannel.ERRORS, f'{key}: {value}')
+    Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(error).format()) + "\n")
+
+
 def split_input(selection) -> List[str]:
     """ Returns a list of inputted strings """
     inputs = []
@@ -145,103 +255,49 @@ def conv_artist_format(artists) -> str:
     return ', '.join(artists)
 
 
-def set_music_thumbnail(filename, image_url) -> None:
-    """ Downloads cover artwork """
-    img = requests.get(image_url).content
+def set_music_thumbnail(filename, image_url, image: Optional[bytes] = None) -> None:
+    """ Downloads cover artwork, `image` is the artwork already downloaded for another file """
+    img = image if image is not None else requests.get(image_url, timeout=Zotify.CONFIG.get_http_timeout()).content
     tags = music_tag.load_file(filename)
     tags[ARTWORK] = img
     tags.save()
 
 
-def regex_input_for_urls(search_input) -> Tuple[str, str, str, str, str, str]:
-    """ Since many kinds of search may be passed at the command line, process them all here. """
-    track_uri_search = re.search(
-        r'^spotify:track:(?P<TrackID>[0-9a-zA-Z]{22})$', search_input)
-    track_url_search = re.search(
-        r'^(https?://)?open\.spotify\.com/track/(?P<TrackID>[0-9a-zA-Z]{22})(\?si=.+?)?$',
-        search_input,
-    )
-
-    album_uri_search = re.search(
-        r'^spotify:album:(?P<AlbumID>[0-9a-zA-Z]{22})$', search_input)
-    album_url_search = re.search(
-        r'^(https?://)?open\.spotify\.com/album/(?P<AlbumID>[0-9a-zA-Z]{22})(\?si=.+?)?$',
-        search_input,
-    )
-
-    playlist_uri_search = re.search(
-        r'^spotify:playlist:(?P<PlaylistID>[0-9a-zA-Z]{22})$', search_input)
-    playlist_url_search = re.search(
-        r'^(https?://)?open\.spotify\.com/playlist/(?P<PlaylistID>[0-9a-zA-Z]{22})(\?si=.+?)?$',
-        search_input,
-    )
-
-    episode_uri_search = re.search(
-        r'^spotify:episode:(?P<EpisodeID>[0-9a-zA-Z]{22})$', search_input)
-    episode_url_search = re.search(
-        r'^(https?://)?open\.spotify\.com/episode/(?P<EpisodeID>[0-9a-zA-Z]{22})(\?si=.+?)?$',
-        search_input,
-    )
-
-    show_uri_search = re.search(
-        r'^spotify:show:(?P<ShowID>[0-9a-zA-Z]{22})$', search_input)
-    show_url_search = re.search(
-        r'^(https?://)?open\.spotify\.com/show/(?P<ShowID>[0-9a-zA-Z]{22})(\?si=.+?)?$',
-        search_input,
-    )
-
-    artist_uri_search = re.search(
-        r'^spotify:artist:(?P<ArtistID>[0-9a-zA-Z]{22})$', search_input)
-    artist_url_search = re.search(
-        r'^(https?://)?open\.spotify\.com/artist/(?P<ArtistID>[0-9a-zA-Z]{22})(\?si=.+?)?$',
-        search_input,
-    )
-
-    if track_uri_search is not None or track_url_search is not None:
-        track_id_str = (track_uri_search
-                        if track_uri_search is not None else
-                        track_url_search).group('TrackID')
-    else:
-        track_id_str = None
+# every kind of link is matched by these two patterns, the kind is looked up from the match
+URL_KINDS = ('track', 'album', 'playlist', 'episode', 'show', 'artist')
+# spotify:<kind>:<id> or open.spotify.com/<kind>/<id>, the separator follows the prefix that matched
+SPOTIFY_INPUT = re.compile(r'^(?:spotify:(?P<uri>)|(https?://)?open\.spotify\.com/)(?P<kind>' + '|'.join(URL_KINDS) +
+                           r')(?(uri):|/)(?P<id>[0-9a-zA-Z]{22})(?(uri)|(\?si=.+?)?)$')
 
-    if album_uri_search is not None or album_url_search is not None:
-        album_id_str = (album_uri_search
-                        if album_uri_search is not None else
-                        album_url_search).group('AlbumID')
-    else:
-        album_id_str = None
 
-    if playlist_uri_search is not None or playlist_url_search is not None:
-        playlist_id_str = (playlist_uri_search
-                           if playlist_uri_search is not None else
-                           playlist_url_search).group('PlaylistID')
-    else:
-        playlist_id_str = None
+def parse_spotify_input(search_input: str) -> Optional[Tuple[str, str]]:
+    """ Returns the (kind, id) of a Spotify URL or URI, None for anything else
 
-    if episode_uri_search is not None or episode_url_search is not None:
-        episode_id_str = (episode_uri_search
-                          if episode_uri_search is not None else
-                          episode_url_search).group('EpisodeID')
-    else:
-        episode_id_str = None
+    >>> parse_spotify_input('spotify:album:6N9PS4QXF1D0OWPk0Sxtb4')
+    ('album', '6N9PS4QXF1D0OWPk0Sxtb4')
+    >>> parse_spotify_input('https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC?si=0123456789abcdef')
+    ('track', '4uLU6hMCjMI75M1A2tKUQC')
+    >>> parse_spotify_input('spotify:track/4uLU6hMCjMI75M1A2tKUQC') is None
+    True
+    """
+    match = SPOTIFY_INPUT.match(search_input)
+    return (match.group('kind'), match.group('id')) if match is not None else None
 
-    if show_uri_search is not None or show_url_search is not None:
-        show_id_str = (show_uri_search
-                       if show_uri_search is not None else
-                       show_url_search).group('ShowID')
-    else:
-        show_id_str = None
 
-    if artist_uri_search is not None or artist_url_search is not None:
-        artist_id_str = (artist_uri_search
-                         if artist_uri_search is not None else
-                         artist_url_search).group('ArtistID')
-    else:
-        artist_id_str = None
+def regex_input_for_urls(search_input) -> Tuple[str, str, str, str, str, str]:
+    """ Since many kinds of search may be passed at the command line, process them all here. """
+    ids = [None] * len(URL_KINDS)
+    parsed = parse_spotify_input(search_input)
+    if parsed is not None:
+        ids[URL_KINDS.index(parsed[0])] = parsed[1]
+    track_id_str, album_id_str, playlist_id_str, episode_id_str, show_id_str, artist_id_str = ids
 
     return track_id_str, album_id_str, playlist_id_str, episode_id_str, show_id_str, artist_id_str
 
 
+INVALID_FILENAME_CHARS = re.compile(r'[/\\:|<>"?*\0-\x1f]|^(AUX|COM[1-9]|CON|LPT[1-9]|NUL|PRN)(?![^.])|^\s|[\s.]$', re.IGNORECASE)
+
+
 def fix_filename(name):
     """
     Replace invalid characters on Linux/Windows/MacOS with underscores.
@@ -258,7 +314,7 @@ def fix_filename(name):
     >>> all('_' == fix_filename(chr(i)) for i in list(range(32)))
     True
     """
-    return re.sub(r'[/\\:|<>"?*\0-\x1f]|^(AUX|COM[1-9]|CON|LPT[1-9]|NUL|PRN)(?![^.])|^\s|[\s.]$', "_", str(name), flags=re.IGNORECASE)
+    return INVALID_FILENAME_CHARS.sub("_", str(name))
 
 
 def fmt_seconds(secs: float) -> str:
@@ -0,0 +1,213 @@
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePath
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from zotify.claims import LEASE_SECONDS
+from zotify.const import EXT_MAP
+from zotify.loader import Loader
+from zotify.paths import DURATION_TOLERANCE, PathPlanner, parse_partial_filename
+from zotify.termoutput import Printer, PrintChannel
+from zotify.track import download_tracks, get_songs_info
+from zotify.utils import get_downloaded_song_duration, remove_lines
+from zotify.zotify import Zotify
+
+
+AUDIO_EXTENSIONS = {f'.{ext}' for ext in EXT_MAP.values()}
+
+
+class LibraryFile(NamedTuple):
+    # None for files that are neither listed in .song_ids nor in the song archive
+    song_id: Optional[str]
+    path: Path
+    size: int
+    mtime_ns: int
+    # where the file belongs, differs from `path` for partial downloads
+    target: Path
+
+    @property
+    def partial(self) -> bool:
+        return self.target != self.path
+
+    @property
+    def probe_key(self) -> str:
+        """ Changes whenever the file is rewritten, so a cached probe never outlives the file it was made of """
+        return f'{self.path}|{self.size}|{self.mtime_ns}'
+
+
+def read_song_ids(path: PurePath) -> Dict[str, str]:
+    """ Maps the file names of a .song_ids or song archive file to their song ids, leaving out
+    names that belong to more than one song """
+    song_ids = {}
+    if not Path(path).is_file():
+        return song_ids
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            # song id, date, artist, name, file name
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 5 or not parts[4]:
+                continue
+            song_ids[parts[4]] = parts[0] if song_ids.get(parts[4], parts[0]) == parts[0] else None
+    return {name: song_id for name, song_id in song_ids.items() if song_id is not None}
+
+
+def scan_library(root: PurePath, archive: Optional[PurePath] = None) -> Iterator[LibraryFile]:
+    """ Yields every audio file below `root`.
+
+    Besides the downloads listed in .song_ids files these are the partial downloads of runs
+    that were interrupted and files that are not listed, e.g. because a run crashed before
+    recording them. The song id of those is looked up by file name in the song `archive`.
+    """
+    archived = read_song_ids(archive) if archive is not None else {}
+    for dirpath, _, filenames in os.walk(root):
+        listed = read_song_ids(Path(dirpath) / '.song_ids') if '.song_ids' in filenames else {}
+        for name in filenames:
+            path = Path(dirpath) / name
+            if path.suffix.lower() not in AUDIO_EXTENSIONS:
+                continue
+            target = path
+            partial = parse_partial_filename(name)
+            if name in listed:
+                song_id = listed[name]
+            elif partial is not None:
+                target, song_id = path.with_name(partial[0]), partial[1]
+            elif name.startswith('.'):
+                continue
+            else:
+                song_id = archived.get(name)
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            yield LibraryFile(song_id, path, stat.st_size, stat.st_mtime_ns, target)
+
+
+def probe_duration(filename: str) -> Optional[float]:
+    """ The duration ffprobe reports for a file, None if ffprobe can't read one from it.
+    Raises OSError if ffprobe itself can't be run """
+    try:
+        return get_downloaded_song_duration(filename)
+    except (AttributeError, ValueError):
+        # no duration in the ffprobe output: truncated or broken file
+        return None
+
+
+def probe_library(files: List[LibraryFile]) -> Dict[Path, Optional[float]]:
+    """ Returns the duration of every file ffprobe could be run on, probing only files that
+    changed since they were last probed """
+    durations = {}
+    missing = []
+    for file in files:
+        cached = Zotify.METADATA_CACHE.get('probe', file.probe_key) if Zotify.METADATA_CACHE is not None else None
+        if cached is not None:
+            durations[file.path] = cached['duration']
+        else:
+            missing.append(file)
+
+    if missing:
+        # ffprobe runs in worker processes, parsing its output doesn't hold up the other probes
+        with ProcessPoolExecutor() as executor, \
+                Printer.progress(desc='Verifying', total=len(missing), unit='file') as p_bar:
+            futures = [executor.submit(probe_duration, str(file.path)) for file in missing]
+            for file, future in zip(missing, futures):
+                p_bar.update()
+                try:
+                    duration = future.result()
+                except OSError as e:
+                    # not probed, so it is left alone
+                    Printer.print(PrintChannel.WARNINGS, f'###   COULD NOT PROBE "{file.path}": {e}   ###')
+                    continue
+                durations[file.path] = duration
+                if Zotify.METADATA_CACHE is not None:
+                    Zotify.METADATA_CACHE.put('probe', file.probe_key, {'duration': duration})
+    return durations
+
+
+def forget_downloads(files: List[LibraryFile]) -> None:
+    """ Deletes files and drops them from .song_ids, the song archive, the content store and the
+    claims of finished downloads, so that they are downloaded again """
+    directories: Dict[Path, set] = {}
+    for file in files:
+        file.path.unlink(missing_ok=True)
+        # a partial download was never recorded, the song id belongs to another copy of the track
+        if file.partial:
+            continue
+        directories.setdefault(file.path.parent, set()).add(file.song_id)
+        if Zotify.STORE is not None:
+            # a link shares the broken data with the stored copy
+            Zotify.STORE.path(file.song_id, file.path.suffix[1:]).unlink(missing_ok=True)
+    for directory, song_ids in directories.items():
+        remove_lines(directory / '.song_ids', song_ids)
+    if Zotify.CONFIG.get_skip_previously_downloaded():
+        remove_lines(Zotify.CONFIG.get_song_archive(), {file.song_id for file in files if not file.partial})
+    # claims are keyed by song id or by file, see download_track
+    Zotify.forget_claims({file.song_id for file in files} | {str(file.target) for file in files})
+
+
+def verify_library() -> None:
+    """ Checks every downloaded track against the duration of the track on Spotify and downloads
+    the ones that are broken or incomplete again, to the path they had """
+    root = Path(Zotify.CONFIG.get_root_path())
+    if shutil.which('ffprobe') is None:
+        # every file would look unreadable
+        Printer.print(PrintChannel.ERRORS, '###   CANNOT VERIFY - FFPROBE NOT FOUND, ensure ffmpeg is installed and added to your PATH   ###\n')
+        return
+
+    with Loader(PrintChannel.PROGRESS_INFO, 'Scanning library...'):
+        files = list(scan_library(root, Zotify.CONFIG.get_song_archive()))
+
+    # partial downloads younger than a claim lease may belong to a download that is still running
+    stale = time.time() - LEASE_SECONDS
+    partial = [file for file in files if file.partial and file.mtime_ns / 1e9 < stale]
+    unlisted = [file for file in files if file.song_id is None]
+    files = [file for file in files if not file.partial and file.song_id is not None]
+
+    durations = probe_library(files + unlisted)
+
+    with Loader(PrintChannel.PROGRESS_INFO, 'Fetching track information...'):
+        infos = get_songs_info(list(dict.fromkeys(file.song_id for file in files + partial)))
+
+    failed = []
+    unknown = 0
+    for file in partial:
+        failed.append(file)
+        Printer.event('track_invalid', id=file.song_id, path=str(file.path), duration=None, expected=None)
+        Printer.print(PrintChannel.WARNINGS, f'###   INVALID: "{file.path.relative_to(root)}" (interrupted download)   ###')
+    for file in files:
+        info = infos.get(file.song_id)
+        if info is None or info.duration_ms is None or file.path not in durations:
+            unknown += 1
+            continue
+        duration, expected = durations[file.path], info.duration_ms / 1000
+        if duration is None or abs(duration - expected) > DURATION_TOLERANCE:
+            failed.append(file)
+            Printer.event('track_invalid', id=file.song_id, path=str(file.path), duration=duration, expected=expected)
+            Printer.print(PrintChannel.WARNINGS, f'###   INVALID: "{file.path.relative_to(root)}" '
+                                                 f'({"unreadable" if duration is None else f"{duration:.1f}s"} '
+                                                 f'instead of {expected:.1f}s)   ###')
+
+    # without a song id there is nothing to download again, these are only reported
+    unreadable = [file for file in unlisted if file.path in durations and durations[file.path] is None]
+    for file in unreadable:
+        Printer.print(PrintChannel.WARNINGS, f'###   UNREADABLE: "{file.path.relative_to(root)}" is not a download '
+                                             f'zotify knows of, it is left as it is   ###')
+
+    Printer.event('verify_finished', files=len(files) + len(partial), invalid=len(failed), unknown=unknown,
+                  unlisted=len(unlisted), unreadable=len(unreadable))
+    Printer.print(PrintChannel.DOWNLOADS, f'###   Verified {len(files) + len(partial)} files: {len(failed)} invalid, '
+                                          f'{unknown} not checked, {len(unlisted)} not downloaded by zotify   ###\n')
+    # a --plan run only reports them
+    if not failed or Zotify.PLAN is not None:
+        return
+
+    forget_downloads(failed)
+    planner = PathPlanner()
+    download_tracks({
+        'mode': 'single',
+        'track_id': file.song_id,
+        'track_info': infos.get(file.song_id),
+        'planner': planner,
+        'output_template': str(file.target.relative_to(root).with_suffix('')) + '.{ext}',
+    } for file in failed)
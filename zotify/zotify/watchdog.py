@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+# chunks read ahead of the download loop, small so real time pacing stays close to its schedule
+READ_AHEAD = 4
+# reads in a row that return nothing before a stream counts as finished
+EMPTY_READS = 5
+
+
+class StageTimeout(TimeoutError):
+    """ A stage of a download made no progress for too long, or the download ran past its deadline """
+
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+
+
+class Watchdog:
+    """ Bounds how long one download may take.
+
+    `stall_timeout` is how long a stage may go without progress and `deadline` how long the
+    whole download may take, both in seconds, 0 turns either off. Blocking calls that can't be
+    interrupted, like the reads of a librespot stream, are made on a daemon thread instead: a
+    stage that runs out of time is given up on and StageTimeout raised, the call is left behind.
+    """
+
+    def __init__(self, stall_timeout: float = 0, deadline: float = 0):
+        self.stall_timeout = stall_timeout or None
+        self.deadline = deadline
+        self._deadline_at = time.monotonic() + deadline if deadline else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.stall_timeout is not None or self._deadline_at is not None
+
+    def check(self, stage: str) -> None:
+        """ Raises StageTimeout if the download is past its deadline """
+        if self._deadline_at is not None and time.monotonic() >= self._deadline_at:
+            raise StageTimeout(stage, f'Download ran past its deadline of {self.deadline}s while in stage {stage}')
+
+    def call(self, stage: str, function: Callable[..., Any], *args) -> Any:
+        """ Returns function(*args), unless it doesn't return within the time the stage has left """
+        if not self.enabled:
+            return function(*args)
+
+        result = queue.Queue(maxsize=1)
+
+        def run():
+            try:
+                result.put((True, function(*args)))
+            except BaseException as e:
+                result.put((False, e))
+
+        threading.Thread(target=run, name=f'watchdog-{stage}', daemon=True).start()
+        try:
+            returned, value = result.get(timeout=self._wait(stage))
+        except queue.Empty:
+            raise self._expired(stage) from None
+        if not returned:
+            raise value
+        return value
+
+    def reader(self, stage: str, read: Callable[[], bytes]) -> 'StreamReader':
+        return StreamReader(self, stage, read)
+
+    def _wait(self, stage: str) -> Optional[float]:
+        """ How long the stage may block from now on, None if forever """
+        self.check(stage)
+        if self._deadline_at is None:
+            return self.stall_timeout
+        remaining = self._deadline_at - time.monotonic()
+        return remaining if self.stall_timeout is None else min(self.stall_timeout, remaining)
+
+    def _expired(self, stage: str) -> StageTimeout:
+        self.check(stage)
+        return StageTimeout(stage, f'No progress in stage {stage} for {self.stall_timeout}s')
+
+
+class StreamReader:
+    """ Reads a stream ahead on a daemon thread, so a read that hangs can be given up on.
+
+    `read` returns the next chunk, b'' if there is none (yet). Without a stall timeout or
+    deadline the stream is read directly.
+    """
+
+    def __init__(self, watchdog: Watchdog, stage: str, read: Callable[[], bytes]):
+        self._watchdog = watchdog
+        self._stage = stage
+        self._read = read
+        self._chunks = queue.Queue(maxsize=READ_AHEAD)
+        self._closed = threading.Event()
+        self._thread = None
+        if watchdog.enabled:
+            self._thread = threading.Thread(target=self._pump, name=f'watchdog-{stage}', daemon=True)
+            self._thread.start()
+
+    def _pump(self) -> None:
+        empty_reads = 0
+        while empty_reads < EMPTY_READS and not self._closed.is_set():
+            try:
+                data = self._read()
+            except BaseException as e:
+                data = e
+            while not self._closed.is_set():
+                try:
+                    self._chunks.put(data, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(data, BaseException):
+                return
+            empty_reads = empty_reads + 1 if data == b'' else 0
+
+    def read(self) -> bytes:
+        if self._thread is None:
+            return self._read()
+        try:
+            data = self._chunks.get(timeout=self._watchdog._wait(self._stage))
+        except queue.Empty:
+            self.close()
+            raise self._watchdog._expired(self._stage) from None
+        except StageTimeout:
+            self.close()
+            raise
+        if isinstance(data, BaseException):
+            raise data
+        return data
+
+    def close(self) -> None:
+        """ Stops reading ahead, a read that hangs is left to the daemon thread """
+        self._closed.set()
@@ -1,28 +1,206 @@
+import atexit
 import json
 from pathlib import Path
 from pwinput import pwinput
+import threading
 import time
+from urllib.parse import urlencode
 import requests
 from librespot.audio.decoders import VorbisOnlyAudioQuality
 from librespot.core import Session
 
-from zotify.const import TYPE, \
+from zotify.cache import MetadataCache, parse_ttls
+from zotify.claims import Claim, ClaimStore
+from zotify.const import TYPE, ERROR, \
     PREMIUM, USER_READ_EMAIL, OFFSET, LIMIT, \
     PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ
 from zotify.config import Config
+from zotify.events import EventLog
+from zotify.failures import FailureQueue
+from zotify.journal import JobJournal
+from zotify.pacer import RealTimePacer
+from zotify.plan import Plan
+from zotify.store import ContentStore
+from zotify.throttle import BandwidthLimiter
+
+
+# a GET that times out is tried at least this often in total, whatever RETRY_ATTEMPTS says,
+# waiting TIMEOUT_BACKOFF seconds before the first retry and twice as long before every further one
+TIMEOUT_RETRIES = 3
+TIMEOUT_BACKOFF = 1.0
+
+
+class RateLimiter:
+    """ Process wide limit on concurrent API requests and the rate at which they are started """
+
+    def __init__(self, concurrency: int = 1, per_second: int = 0):
+        self.configure(concurrency, per_second)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def configure(self, concurrency: int, per_second: int) -> None:
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._interval = 1 / per_second if per_second > 0 else 0.0
+
+    def pause(self, seconds: float) -> None:
+        """ Holds back every request for the given time, e.g. after a 429 response """
+        with self._lock:
+            self._next_start = max(self._next_start, time.monotonic() + seconds)
+
+    def __enter__(self):
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._slots.release()
+
 
 class Zotify:    
     SESSION: Session = None
     DOWNLOAD_QUALITY = None
     CONFIG: Config = Config()
+    RATE_LIMITER: RateLimiter = RateLimiter()
+    METADATA_CACHE: MetadataCache = None
+    BANDWIDTH: BandwidthLimiter = BandwidthLimiter()
+    PACER: RealTimePacer = RealTimePacer()
+    EVENTS: EventLog = None
+    CLAIMS: ClaimStore = None
+    STORE: ContentStore = None
+    FAILURES: FailureQueue = None
+    # set by --plan, downloads are recorded instead of started
+    PLAN: Plan = None
+    # account type of the current session, looked up once
+    _premium = None
 
     def __init__(self, args):
         Zotify.CONFIG.load(args)
+        Zotify.RATE_LIMITER.configure(Zotify.CONFIG.get_api_concurrency(), Zotify.CONFIG.get_api_rate_limit())
+        Zotify.BANDWIDTH.configure(Zotify.CONFIG.get_download_rate_limit(), Zotify.CONFIG.get_download_stream_rate_limit())
+        Zotify.open_event_log()
+        Zotify.open_metadata_cache(args)
+        Zotify.open_claims()
+        Zotify.open_failure_queue()
+        if Zotify.CONFIG.get_content_store():
+            Zotify.STORE = ContentStore(Zotify.CONFIG.get_content_store(), Zotify.CONFIG.get_content_store_link())
         Zotify.login(args)
 
+    @classmethod
+    def open_event_log(cls):
+        """ Starts writing JSON-lines events when LOG_FORMAT is json """
+        if cls.CONFIG.get_log_format() != 'json':
+            return
+        cls.EVENTS = EventLog(cls.CONFIG.get_log_file())
+        # registered first, so it runs after everything else that logs on exit
+        atexit.register(cls.EVENTS.close)
+
+    @classmethod
+    def open_metadata_cache(cls, args):
+        """ Opens the on-disk metadata cache and applies a requested invalidation """
+        # we need to import that here, otherwise we will get circular imports!
+        from zotify.termoutput import Printer, PrintChannel
+        if not cls.CONFIG.get_metadata_cache():
+            if args.invalidate_cache:
+                Printer.print(PrintChannel.WARNINGS, '###   Nothing to invalidate, the metadata cache is disabled (METADATA_CACHE)   ###')
+            return
+        cls.METADATA_CACHE = MetadataCache(cls.CONFIG.get_metadata_cache_location(),
+                                           max_entries=cls.CONFIG.get_metadata_cache_size(),
+                                           ttls=parse_ttls(cls.CONFIG.get_metadata_cache_ttl()))
+        if args.invalidate_cache:
+            cls.METADATA_CACHE.invalidate(None if args.invalidate_cache == 'all' else args.invalidate_cache)
+        atexit.register(cls.close_metadata_cache)
+
+    @classmethod
+    def close_metadata_cache(cls):
+        # we need to import that here, otherwise we will get circular imports!
+        from zotify.termoutput import Printer, PrintChannel
+        if cls.METADATA_CACHE is not None:
+            Printer.print(PrintChannel.PROGRESS_INFO, f'Metadata cache: {cls.METADATA_CACHE.stats()}')
+            Printer.event('cache_stats', hits=cls.METADATA_CACHE.hits, misses=cls.METADATA_CACHE.misses,
+                          revalidated=cls.METADATA_CACHE.revalidated)
+            cls.METADATA_CACHE.close()
+            cls.METADATA_CACHE = None
+
+    @classmethod
+    def open_claims(cls):
+        """ Opens the claims shared with other processes that use the same song archive """
+        if not cls.CONFIG.get_archive_claims():
+            return
+        cls.CLAIMS = ClaimStore(cls.CONFIG.get_archive_claims_location())
+        atexit.register(cls.CLAIMS.close)
+
+    @classmethod
+    def claim(cls, key) -> bool:
+        """ Claims a download, False if another process is downloading it or has just done so """
+        return cls.CLAIMS is None or cls.CLAIMS.claim(key) is Claim.CLAIMED
+
+    @classmethod
+    def release_claim(cls, key, completed) -> None:
+        if cls.CLAIMS is None:
+            return
+        if completed:
+            cls.CLAIMS.complete(key)
+        else:
+            cls.CLAIMS.release(key)
+
+    @classmethod
+    def forget_claims(cls, keys) -> None:
+        if cls.CLAIMS is not None:
+            cls.CLAIMS.forget(keys)
+
+    @classmethod
+    def open_failure_queue(cls):
+        """ Opens the queue of failed downloads that --retry-failed works through """
+        if not cls.CONFIG.get_failure_queue():
+            return
+        cls.FAILURES = FailureQueue(cls.CONFIG.get_failure_queue_location(),
+                                    max_attempts=cls.CONFIG.get_retry_max_attempts(),
+                                    backoff=cls.CONFIG.get_retry_backoff())
+        atexit.register(cls.FAILURES.close)
+
+    @classmethod
+    def record_failure(cls, kind, entity_id, context, error) -> None:
+        # we need to import that here, otherwise we will get circular imports!
+        from zotify.termoutput import Printer, PrintChannel
+        if cls.FAILURES is None:
+            return
+        if cls.FAILURES.record(kind, entity_id, context, error):
+            Printer.event('download_quarantined', kind=kind, id=entity_id, error=str(error))
+            Printer.print(PrintChannel.WARNINGS, f'###   QUARANTINED: {kind} {entity_id} failed '
+                                                 f'{cls.CONFIG.get_retry_max_attempts()} times, it is not retried anymore   ###')
+
+    @classmethod
+    def resolve_failure(cls, kind, entity_id) -> None:
+        # a dry run downloads nothing, so it can't tell whether a download works again
+        if cls.FAILURES is not None and cls.PLAN is None:
+            cls.FAILURES.resolve(kind, entity_id)
+
+    @classmethod
+    def open_journal(cls, name, key=None):
+        """ Opens the journal of a long run, None if journaling is off or another process runs the same job.
+        `key` tells the jobs apart, see JobJournal """
+        # we need to import that here, otherwise we will get circular imports!
+        from zotify.termoutput import Printer, PrintChannel
+        if not cls.CONFIG.get_job_journal() or cls.PLAN is not None:
+            return None
+        try:
+            journal = JobJournal(cls.CONFIG.get_job_journal_location() / f'{name}.jsonl', key=key)
+        except OSError as e:
+            Printer.print(PrintChannel.WARNINGS, f'###   Not journaling {name}: {e}   ###')
+            return None
+        if journal.expired:
+            Printer.print(PrintChannel.PROGRESS_INFO, f'###   The journal of {name} is too old to continue, listing it again   ###')
+        return journal
+
     @classmethod
     def login(cls, args):
         """ Authenticates with Spotify and saves credentials to a file """
+        cls._premium = None
 
         cred_location = Config.get_credentials_location()
 
@@ -76,21 +254,67 @@ class Zotify:
             'app-platform': 'WebPlayer'
         }, {LIMIT: limit, OFFSET: offset}
 
+    @classmethod
+    def _get(cls, url, headers, params=None):
+        """ Performs a GET request under the global rate limit, backing off on 429 responses.
+        A request that times out is repeated with a growing delay, at least TIMEOUT_RETRIES and
+        at most RETRY_ATTEMPTS times in total """
+        tries = 0
+        while True:
+            try:
+                with cls.RATE_LIMITER:
+                    response = requests.get(url, headers=headers, params=params, timeout=cls.CONFIG.get_http_timeout())
+            except requests.exceptions.Timeout:
+                tries += 1
+                if tries >= max(TIMEOUT_RETRIES, cls.CONFIG.get_retry_attempts()):
+                    raise
+                time.sleep(TIMEOUT_BACKOFF * 2 ** (tries - 1))
+                continue
+            if response.status_code != 429:
+                return response
+            cls.RATE_LIMITER.pause(float(response.headers.get('Retry-After', 1)))
+
+    @classmethod
+    def _get_text(cls, url, headers, params=None):
+        """ Returns the body of a GET request, revalidating a stored copy with its ETag/Last-Modified if possible """
+        cache = cls.METADATA_CACHE if cls.CONFIG.get_http_revalidate() else None
+        if cache is None:
+            return cls._get(url, headers=headers, params=params).text
+
+        key = f'{url}?{urlencode(sorted(params.items()))}' if params else url
+        key += f'|{headers.get("Accept-Language")}'
+        stored = cache.get_response(key)
+        if stored is not None:
+            etag, last_modified, body = stored
+            headers = dict(headers)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = cls._get(url, headers=headers, params=params)
+        if response.status_code == 304 and stored is not None:
+            cache.touch_response(key)
+            return body
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if response.status_code == 200 and (etag or last_modified):
+            cache.put_response(key, etag, last_modified, response.text)
+        return response.text
+
     @classmethod
     def invoke_url_with_params(cls, url, limit, offset, **kwargs):
         headers, params = cls.get_auth_header_and_params(limit=limit, offset=offset)
         params.update(kwargs)
-        return requests.get(url, headers=headers, params=params).json()
+        return json.loads(cls._get_text(url, headers=headers, params=params))
 
     @classmethod
     def invoke_url(cls, url, tryCount=0):
         # we need to import that here, otherwise we will get circular imports!
         from zotify.termoutput import Printer, PrintChannel
         headers = cls.get_auth_header()
-        response = requests.get(url, headers=headers)
-        responsetext = response.text
+        responsetext = cls._get_text(url, headers=headers)
         try:
-            responsejson = response.json()
+            responsejson = json.loads(responsetext)
         except json.decoder.JSONDecodeError:
             responsejson = {"error": {"status": "unknown", "message": "received an empty response"}}
 
@@ -104,7 +328,22 @@ class Zotify:
 
         return responsetext, responsejson
 
+    @classmethod
+    def invoke_url_cached(cls, entity, entity_id, url):
+        """ Like invoke_url, but answers from the metadata cache when it holds the entity """
+        if cls.METADATA_CACHE is None:
+            return cls.invoke_url(url)
+        cached = cls.METADATA_CACHE.get(entity, entity_id)
+        if cached is not None:
+            return '', cached
+        responsetext, responsejson = cls.invoke_url(url)
+        if responsejson and ERROR not in responsejson:
+            cls.METADATA_CACHE.put(entity, entity_id, responsejson)
+        return responsetext, responsejson
+
     @classmethod
     def check_premium(cls) -> bool:
         """ If user has spotify premium return true """
-        return (cls.SESSION.get_user_attribute(TYPE) == PREMIUM)
+        if cls._premium is None:
+            cls._premium = (cls.SESSION.get_user_attribute(TYPE) == PREMIUM)
+        return cls._premium